@@ -0,0 +1,525 @@
+import colorsys
+import math
+import queue
+import threading
+import time
+import wave
+from collections import deque
+
+import numpy as np
+
+class WavSource:
+    """
+    WavSource turns a WAV file into frames for the ambient pipeline:
+    every frame is a one pixel high image with one pixel per frequency
+    band, colored along the color wheel and as bright as the band is
+    loud.
+
+    Band levels are normalized against a slowly decaying peak, so quiet
+    and loud recordings both use the full brightness range.
+
+    Attributes:
+    - rate (float): Frames per second.
+    - bands (int): Frequency bands, pixels per frame.
+    - sample_rate (int): Samples per second of the file.
+
+    Methods:
+    - frames: Yields the frames of the file.
+    """
+    MIN_FREQUENCY = 40.0
+    MAX_FREQUENCY = 8000.0
+    # Share of the peak level kept per frame.
+    PEAK_DECAY = 0.995
+
+    def __init__(self, path, rate=25.0, bands=8, loop=False):
+        """
+        Args:
+            path (str): Path of an 8, 16 or 32 bit PCM WAV file.
+            rate (float, optional): Frames per second. Defaults to 25.
+            bands (int, optional): Frequency bands. Defaults to 8.
+            loop (bool, optional): Start over at the end of the file.
+        """
+        self.path = path
+        self.rate = rate
+        self.bands = bands
+        self.loop = loop
+        with wave.open(path, 'rb') as file:
+            self.sample_rate = file.getframerate()
+            width = file.getsampwidth()
+            channels = file.getnchannels()
+            data = file.readframes(file.getnframes())
+        if width == 1:
+            samples = np.frombuffer(data, np.uint8).astype(np.float32) - 128
+            samples /= 128
+        elif width in (2, 4):
+            dtype = np.int16 if width == 2 else np.int32
+            samples = np.frombuffer(data, dtype).astype(np.float32)
+            samples /= float(np.iinfo(dtype).max)
+        else:
+            raise ValueError("unsupported sample width: {}".format(width))
+        # Channels are mixed down to mono.
+        self._samples = samples.reshape(-1, channels).mean(axis=1)
+
+        self._window_size = max(2, int(self.sample_rate / rate))
+        self._window = np.hanning(self._window_size).astype(np.float32)
+        frequencies = np.fft.rfftfreq(self._window_size, 1 / self.sample_rate)
+        edges = np.geomspace(self.MIN_FREQUENCY,
+                             min(self.MAX_FREQUENCY, self.sample_rate / 2),
+                             bands + 1)
+        self._band_index = np.clip(np.searchsorted(edges, frequencies) - 1,
+                                   0, bands - 1)
+        self._in_range = (frequencies >= edges[0]) & (frequencies <= edges[-1])
+        self._palette = np.array(
+            [colorsys.hsv_to_rgb(band / bands, 1.0, 1.0)
+             for band in range(bands)], dtype=np.float32)
+
+    def frames(self):
+        """
+        Yields:
+            ndarray: Shape (1, bands, 3), red, green and blue in 0.0 to
+                     1.0.
+        """
+        peak = 1e-6
+        while True:
+            for start in range(0, len(self._samples) - self._window_size + 1,
+                               self._window_size):
+                chunk = self._samples[start:start + self._window_size]
+                power = np.abs(np.fft.rfft(chunk * self._window)) ** 2
+                levels = np.bincount(self._band_index[self._in_range],
+                                     power[self._in_range],
+                                     minlength=self.bands)
+                levels = np.log1p(levels)
+                peak = max(peak * self.PEAK_DECAY, float(levels.max()))
+                yield (self._palette * (levels / peak)[:, np.newaxis]
+                       )[np.newaxis]
+            if not self.loop:
+                return
+
+
+class ArraySource:
+    """
+    ArraySource plays frames stored as a NumPy array, e.g. a video or a
+    screen recording saved with numpy.save. The file is memory mapped,
+    only the frames played are read.
+
+    Attributes:
+    - rate (float): Frames per second.
+
+    Methods:
+    - frames: Yields the frames of the array.
+    """
+    def __init__(self, path, rate=25.0, loop=True):
+        """
+        Args:
+            path (str): Path of a .npy file of shape (frames, height,
+                        width, 3), or (height, width, 3) for a still
+                        image, uint8 or floats in 0.0 to 1.0.
+            rate (float, optional): Frames per second. Defaults to 25.
+            loop (bool, optional): Start over at the end. Defaults to
+                                   True.
+        """
+        self.path = path
+        self.rate = rate
+        self.loop = loop
+        self._frames = np.load(path, mmap_mode='r')
+        if self._frames.ndim == 3:
+            self._frames = self._frames[np.newaxis]
+        if self._frames.ndim != 4 or self._frames.shape[-1] != 3:
+            raise ValueError("expected frames of shape (height, width, 3), "
+                             "got {}".format(self._frames.shape))
+
+    def frames(self):
+        """
+        Yields:
+            ndarray: Shape (height, width, 3).
+        """
+        while True:
+            for frame in self._frames:
+                yield frame
+            if not self.loop:
+                return
+
+
+def open_source(path, rate=25.0, **settings):
+    """
+    Opens a frame source for a file, chosen by its extension.
+
+    Args:
+        path (str): A .wav or .npy file.
+        rate (float, optional): Frames per second. Defaults to 25.
+        **settings: Passed on to the source, e.g. bands or loop.
+
+    Returns:
+        WavSource or ArraySource: The source.
+    """
+    if path.lower().endswith('.wav'):
+        return WavSource(path, rate, **settings)
+    if path.lower().endswith('.npy'):
+        return ArraySource(path, rate, **settings)
+    raise ValueError("no frame source for {}".format(path))
+
+
+def column_zones(count):
+    """
+    Splits a frame into side by side columns, one per light.
+
+    Args:
+        count (int): Number of zones.
+
+    Returns:
+        list: (left, top, right, bottom) boxes as shares of the frame.
+    """
+    return [(index / count, 0.0, (index + 1) / count, 1.0)
+            for index in range(count)]
+
+
+class ZoneSampler:
+    """
+    ZoneSampler averages the color of a frame within one box per light.
+
+    Large frames are first thinned out to at most max_side pixels per
+    side. The averages of all zones then come from a single summed area
+    table, four lookups per zone however large it is.
+
+    Methods:
+    - sample: Returns the average color of every zone.
+    """
+    def __init__(self, zones, max_side=64):
+        """
+        Args:
+            zones (list): (left, top, right, bottom) boxes as shares of
+                          the frame, see column_zones().
+            max_side (int, optional): Pixels per side the frame is
+                                      thinned out to. Defaults to 64.
+        """
+        self.zones = np.asarray(zones, dtype=np.float64)
+        self.max_side = max_side
+        self._shape = None
+
+    def _boxes(self, height, width):
+        if self._shape != (height, width):
+            scale = np.array([width, height, width, height])
+            boxes = np.rint(self.zones * scale).astype(np.intp)
+            # Every zone covers at least one pixel.
+            boxes[:, 2] = np.clip(np.maximum(boxes[:, 2], boxes[:, 0] + 1),
+                                  1, width)
+            boxes[:, 3] = np.clip(np.maximum(boxes[:, 3], boxes[:, 1] + 1),
+                                  1, height)
+            boxes[:, 0] = np.minimum(boxes[:, 0], boxes[:, 2] - 1)
+            boxes[:, 1] = np.minimum(boxes[:, 1], boxes[:, 3] - 1)
+            area = ((boxes[:, 2] - boxes[:, 0])
+                    * (boxes[:, 3] - boxes[:, 1])).astype(np.float32)
+            self._shape = (height, width)
+            self._cached = boxes, area[:, np.newaxis]
+        return self._cached
+
+    def sample(self, frame):
+        """
+        Args:
+            frame (ndarray): Shape (height, width, 3), uint8 or floats
+                             in 0.0 to 1.0.
+
+        Returns:
+            ndarray: Shape (zones, 3), float32 in 0.0 to 1.0.
+        """
+        frame = np.asarray(frame)
+        step = max(1, math.ceil(max(frame.shape[:2]) / self.max_side))
+        small = frame[::step, ::step]
+        pixels = small.astype(np.float32)
+        if frame.dtype == np.uint8:
+            pixels /= 255.0
+
+        height, width = pixels.shape[:2]
+        table = np.zeros((height + 1, width + 1, 3), dtype=np.float32)
+        np.cumsum(np.cumsum(pixels, axis=0), axis=1, out=table[1:, 1:])
+        boxes, area = self._boxes(height, width)
+        left, top, right, bottom = boxes.T
+        sums = table[bottom, right] - table[top, right] \
+            - table[bottom, left] + table[top, left]
+        return np.clip(sums / area, 0.0, 1.0)
+
+
+class Smoother:
+    """
+    Smoother fades zone colors over time with an exponential moving
+    average, so flicker in the source does not reach the lights.
+
+    Methods:
+    - update: Blends a new sample in and returns the result.
+    """
+    def __init__(self, time_constant=0.3):
+        """
+        Args:
+            time_constant (float, optional): Seconds for the output to
+                    cover about two thirds of a step. 0 disables
+                    smoothing. Defaults to 0.3.
+        """
+        self.time_constant = time_constant
+        self._value = None
+        self._time = None
+
+    def update(self, sample, now):
+        """
+        Args:
+            sample (ndarray): The new zone colors.
+            now (float): Time of the sample in seconds.
+
+        Returns:
+            ndarray: The smoothed zone colors.
+        """
+        if self._value is None or self.time_constant <= 0:
+            self._value = np.array(sample, dtype=np.float32)
+        else:
+            alpha = 1.0 - math.exp(-max(0.0, now - self._time)
+                                   / self.time_constant)
+            self._value += alpha * (sample - self._value)
+        self._time = now
+        return self._value.copy()
+
+
+class _Frame:
+    __slots__ = ('number', 'captured', 'stamps', 'data')
+
+    def __init__(self, number, captured, data):
+        self.number = number
+        self.captured = captured
+        self.stamps = [captured]
+        self.data = data
+
+
+class AmbientPipeline:
+    """
+    AmbientPipeline drives lights from a frame source in four stages,
+    each on its own thread and connected by bounded queues:
+
+        capture -> downsample -> smooth -> emit
+
+    Capture reads the source at its frame rate. When the next stage is
+    still busy the frame is dropped rather than queued, a live source
+    cannot wait. The later stages block on a full queue, so a slow
+    stage holds back the ones before it instead of piling up frames.
+
+    Emit converts the zone colors to xy and brightness and queues a
+    command for every light whose color changed noticeably through the
+    controller's dispatcher, which coalesces them and keeps them within
+    the bridge rate limits. The transition time is set to how often a
+    light can be updated, so the bridge fades between two updates.
+
+    The time every frame spends in each stage, waiting included, is
+    recorded, as well as the time from capture to emit.
+
+    Attributes:
+    - STAGES (tuple): Names of the stages, in order.
+    - light_ids (list): The lights driven, one per zone.
+    - captured (int): Frames read from the source.
+    - dropped (int): Frames dropped because the pipeline was busy.
+    - emitted (int): Frames that reached the emit stage.
+    - commands (int): Light commands queued.
+
+    Methods:
+    - start: Starts the stage threads.
+    - stop: Stops them.
+    - wait: Waits until a finite source is played to its end.
+    - stats: Returns the counters and per-stage latencies.
+    """
+    STAGES = ("capture", "downsample", "smooth", "emit")
+
+    # Changes smaller than this are not sent.
+    XY_THRESHOLD = 0.005
+    BRI_THRESHOLD = 4
+
+    LATENCY_SAMPLES = 1000
+
+    def __init__(self, controller, source, light_ids, zones=None,
+                 time_constant=0.3, queue_size=2, max_side=64):
+        """
+        Initializes the AmbientPipeline.
+
+        Args:
+            controller (HueController): Sends the light commands.
+            source: A frame source, e.g. WavSource or ArraySource.
+            light_ids (list): The lights to drive.
+            zones (list, optional): A (left, top, right, bottom) box
+                    per light as shares of the frame. Defaults to side
+                    by side columns.
+            time_constant (float, optional): Smoothing, see Smoother.
+            queue_size (int, optional): Frames each queue holds.
+            max_side (int, optional): See ZoneSampler.
+        """
+        self.controller = controller
+        self.source = source
+        self.light_ids = [str(light_id) for light_id in light_ids]
+        self.sampler = ZoneSampler(zones or column_zones(len(light_ids)),
+                                   max_side)
+        self.smoother = Smoother(time_constant)
+
+        self.captured = 0
+        self.dropped = 0
+        self.emitted = 0
+        self.commands = 0
+
+        self._queues = [queue.Queue(maxsize=queue_size)
+                        for _ in self.STAGES[1:]]
+        self._latencies = {name: deque(maxlen=self.LATENCY_SAMPLES)
+                           for name in self.STAGES + ("end_to_end",)}
+        self._lock = threading.Lock()
+        self._sent = {}
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """
+        Starts the stage threads.
+        """
+        self._stopped.clear()
+        targets = [self._capture,
+                   lambda: self._stage(1, self._downsample),
+                   lambda: self._stage(2, self._smooth),
+                   lambda: self._stage(3, self._emit)]
+        self._threads = [threading.Thread(target=target, daemon=True,
+                                          name="Ambient-" + name)
+                         for name, target in zip(self.STAGES, targets)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """
+        Stops the stage threads and waits for them to end.
+        """
+        self._stopped.set()
+        for stage_queue in self._queues:
+            # Frees a stage blocked on a full queue.
+            try:
+                stage_queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                stage_queue.put_nowait(None)
+            except queue.Full:
+                pass
+        self.wait()
+
+    def wait(self, timeout=None):
+        """
+        Waits until the source ran out and every frame went through.
+
+        Returns:
+            bool: True if all stages ended in time.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            remaining = None if deadline is None \
+                else max(0.0, deadline - time.monotonic())
+            thread.join(remaining)
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def stats(self):
+        """
+        Returns:
+            dict: "captured", "dropped", "emitted" and "commands", and
+                  per stage plus "end_to_end" the mean, p50 and p99
+                  latency in milliseconds.
+        """
+        with self._lock:
+            stats = {'captured': self.captured, 'dropped': self.dropped,
+                     'emitted': self.emitted, 'commands': self.commands}
+            latencies = {name: sorted(values)
+                         for name, values in self._latencies.items()}
+        for name, values in latencies.items():
+            if values:
+                stats[name] = {
+                    'mean_ms': sum(values) / len(values) * 1000,
+                    'p50_ms': values[len(values) // 2] * 1000,
+                    'p99_ms': values[min(len(values) - 1,
+                                         int(len(values) * 0.99))] * 1000}
+        return stats
+
+    def _capture(self):
+        period = 1.0 / self.source.rate
+        start = time.monotonic()
+        outbox = self._queues[0]
+        for number, data in enumerate(self.source.frames()):
+            delay = start + number * period - time.monotonic()
+            if delay > 0 and self._stopped.wait(delay):
+                break
+            if self._stopped.is_set():
+                break
+            frame = _Frame(number, time.monotonic(), data)
+            self._record(frame, 0)
+            with self._lock:
+                self.captured += 1
+            try:
+                outbox.put_nowait(frame)
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+        self._put(outbox, None)
+
+    def _stage(self, index, process):
+        inbox = self._queues[index - 1]
+        outbox = self._queues[index] if index < len(self._queues) else None
+        while True:
+            frame = inbox.get()
+            if frame is None or self._stopped.is_set():
+                break
+            frame.data = process(frame)
+            self._record(frame, index)
+            if outbox is not None:
+                self._put(outbox, frame)
+        if outbox is not None:
+            self._put(outbox, None)
+
+    def _put(self, outbox, frame):
+        # Blocks while the next stage is busy, the backpressure, but
+        # gives up once stopped.
+        while not self._stopped.is_set():
+            try:
+                outbox.put(frame, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _record(self, frame, index):
+        now = time.monotonic()
+        with self._lock:
+            self._latencies[self.STAGES[index]].append(now - frame.stamps[-1])
+            if index == len(self.STAGES) - 1:
+                self._latencies['end_to_end'].append(now - frame.captured)
+        frame.stamps.append(now)
+
+    def _downsample(self, frame):
+        return self.sampler.sample(frame.data)
+
+    def _smooth(self, frame):
+        return self.smoother.update(frame.data, frame.captured)
+
+    def _emit(self, frame):
+        engine = self.controller.color_engine
+        xy, bri = engine.rgb_to_xy(frame.data)
+        rate = self.controller.rate_limiter.rate("light") or 10.0
+        # Deciseconds until the bridge gets to each light again.
+        transition = max(1, int(round(10 * len(self.light_ids) / rate)))
+        commands = 0
+        for index, light_id in enumerate(self.light_ids):
+            color = [round(float(xy[index][0]), 4),
+                     round(float(xy[index][1]), 4)]
+            brightness = int(bri[index])
+            sent = self._sent.get(light_id)
+            if sent is not None and \
+                    abs(sent[0][0] - color[0]) < self.XY_THRESHOLD and \
+                    abs(sent[0][1] - color[1]) < self.XY_THRESHOLD and \
+                    abs(sent[1] - brightness) < self.BRI_THRESHOLD:
+                continue
+            self._sent[light_id] = (color, brightness)
+            # Dark zones dim the light rather than switch it off, the
+            # bridge takes longer to switch a light on again.
+            self.controller.dispatcher.submit(
+                "light", light_id, {'on': True, 'xy': color,
+                                    'bri': max(1, brightness),
+                                    'transitiontime': transition},
+                priority="background")
+            commands += 1
+        with self._lock:
+            self.emitted += 1
+            self.commands += commands
+        return frame.data
@@ -0,0 +1,404 @@
+import datetime
+import heapq
+import itertools
+import json
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+# Seconds from the Unix epoch to noon of 2000-01-01 (J2000), in days.
+_J2000_UNIX_DAYS = 10957.5
+
+
+def sun_times(day, latitude, longitude):
+    """
+    Calculates sunrise and sunset with the sunrise equation, accurate
+    to a minute or two away from the poles.
+
+    Args:
+        day (datetime.date): The day.
+        latitude (float): Degrees north.
+        longitude (float): Degrees east.
+
+    Returns:
+        tuple: (sunrise, sunset) as Unix timestamps, (None, None) on
+               days the sun does not rise or does not set.
+    """
+    epoch_days = (day - datetime.date(1970, 1, 1)).days
+    # Mean solar noon, in days since J2000.
+    noon = round(epoch_days - _J2000_UNIX_DAYS + 0.0008) - longitude / 360
+    anomaly = math.radians((357.5291 + 0.98560028 * noon) % 360)
+    center = 1.9148 * math.sin(anomaly) + 0.0200 * math.sin(2 * anomaly) \
+        + 0.0003 * math.sin(3 * anomaly)
+    ecliptic = math.radians((math.degrees(anomaly) + center + 180 + 102.9372)
+                            % 360)
+    transit = noon + 0.0053 * math.sin(anomaly) \
+        - 0.0069 * math.sin(2 * ecliptic)
+    declination = math.asin(math.sin(ecliptic)
+                            * math.sin(math.radians(23.4397)))
+    phi = math.radians(latitude)
+    cos_hour_angle = (math.sin(math.radians(-0.833))
+                      - math.sin(phi) * math.sin(declination)) \
+        / (math.cos(phi) * math.cos(declination))
+    if not -1.0 <= cos_hour_angle <= 1.0:
+        return None, None
+    half_day = math.degrees(math.acos(cos_hour_angle)) / 360
+    to_unix = lambda j2000_day: (j2000_day + _J2000_UNIX_DAYS) * 86400
+    return to_unix(transit - half_day), to_unix(transit + half_day)
+
+
+class Rule:
+    """
+    Rule is a compiled automation: a trigger, the event data it
+    requires and the action it takes.
+
+    Attributes:
+    - name (str): Name of the rule.
+    - at (str): "HH:MM", "sunrise" or "sunset" for time triggered rules.
+    - offset (float): Seconds added to the time of day.
+    - days (frozenset): Weekdays (0 is Monday) a time rule runs on.
+    - event (str): Event type for event triggered rules, e.g. "motion".
+    - source (str): ID of the sensor or light the event must come
+                    from, None for any.
+    - conditions (dict): Event data the event must carry.
+    - action (dict): What the rule does, see AutomationEngine.
+    """
+    __slots__ = ('name', 'at', 'offset', 'days', 'event', 'source',
+                 'conditions', 'action')
+
+    def __init__(self, name, when, action):
+        """
+        Args:
+            name (str): Name of the rule.
+            when (dict): The trigger, {"at": ..., "offset": minutes,
+                         "days": [...]} or {"event": ..., "source": ...,
+                         more event data to match}.
+            action (dict): What the rule does.
+
+        Raises:
+            ValueError: If the trigger or the action is not understood.
+        """
+        self.name = name
+        self.action = dict(action)
+        when = dict(when)
+        self.at = when.pop("at", None)
+        self.offset = float(when.pop("offset", 0)) * 60
+        self.days = frozenset(WEEKDAYS.index(day[:3].lower())
+                              for day in when.pop("days", WEEKDAYS))
+        self.event = when.pop("event", None)
+        source = when.pop("source", None)
+        self.source = None if source is None else str(source)
+        self.conditions = when
+
+        if (self.at is None) == (self.event is None):
+            raise ValueError("Rule {!r} needs either \"at\" or \"event\" in "
+                             "\"when\"".format(name))
+        if self.at is not None and self.at not in ("sunrise", "sunset"):
+            try:
+                hours, minutes = (int(part) for part in self.at.split(':'))
+            except ValueError:
+                raise ValueError("Rule {!r}: \"at\" is not HH:MM, sunrise or "
+                                 "sunset: {!r}".format(name, self.at))
+            self.offset += hours * 3600 + minutes * 60
+        if not any(key in self.action for key in
+                   ("scene", "timeline", "group", "light")):
+            raise ValueError("Rule {!r} does nothing, \"do\" needs a scene, "
+                             "timeline, group or light".format(name))
+
+    def matches(self, data):
+        """
+        Args:
+            data (dict): The data carried by an event.
+
+        Returns:
+            bool: True if the event carries every required value.
+        """
+        return all(data.get(key) == value
+                   for key, value in self.conditions.items())
+
+
+def load_rules(path):
+    """
+    Loads the rules declared under "rules" in a JSON file, e.g.
+
+        {
+            "rules": {
+                "Evening": {"when": {"at": "sunset", "offset": -15},
+                            "do": {"scene": "Evening"}},
+                "Hallway": {"when": {"event": "motion", "source": "5",
+                                     "motion": true},
+                            "do": {"group": 3, "on": true,
+                                   "brightness": "DIM"}}
+            }
+        }
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        list: The compiled Rules.
+    """
+    with open(path, 'r') as file:
+        declarations = json.load(file).get("rules", {})
+    return [Rule(name, declaration.get("when", {}), declaration.get("do", {}))
+            for name, declaration in declarations.items()]
+
+
+class AutomationEngine:
+    """
+    AutomationEngine runs rules on top of a HueController, triggered by
+    the time of day or by events such as a motion sensor firing.
+
+    Rules are compiled into two indexes. Time triggered rules sit in a
+    heap ordered by their next run, watched by a single thread which
+    sleeps until the earliest one is due. Event triggered rules are
+    kept in a table keyed by event type and source, so an event only
+    looks at the rules waiting for exactly that event, however many
+    rules there are.
+
+    An action is one of:
+        {"scene": name, "transition_time": label}
+        {"timeline": name}
+        {"group" or "light": ID or name, "on": bool, "color": label,
+         "brightness": label, "transition_time": label}
+    Scenes are recalled on the controller's executor, states are queued
+    through its dispatcher, so the engine never waits for the bridge.
+
+    Attributes:
+    - rules (list): The compiled Rules.
+    - latitude (float): Degrees north, needed for sunrise and sunset.
+    - longitude (float): Degrees east.
+    - events (int): Events handled.
+    - evaluated (int): Rules looked at for those events.
+    - fired (int): Actions taken.
+
+    Methods:
+    - load: Replaces the rules.
+    - handle_event: Runs the rules triggered by an event.
+    - next_runs: Returns the upcoming time triggered runs.
+    - start: Starts running time triggered rules.
+    - stop: Stops the engine thread.
+    - stats: Returns the engine counters.
+    """
+    def __init__(self, controller, rules=(), latitude=None, longitude=None):
+        """
+        Initializes the AutomationEngine.
+
+        Args:
+            controller (HueController): Carries out the actions.
+            rules (iterable, optional): The Rules to run.
+            latitude (float, optional): Degrees north.
+            longitude (float, optional): Degrees east.
+        """
+        self.controller = controller
+        self.latitude = latitude
+        self.longitude = longitude
+        self.rules = []
+        self.events = 0
+        self.evaluated = 0
+        self.fired = 0
+
+        self._by_event = {}
+        self._timers = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.load(rules)
+
+    def load(self, rules, now=None):
+        """
+        Replaces the rules and rebuilds the trigger indexes.
+
+        Args:
+            rules (iterable): The Rules to run.
+            now (float, optional): Unix time to schedule from.
+        """
+        now = time.time() if now is None else now
+        by_event = {}
+        timers = []
+        sequence = itertools.count()
+        rules = list(rules)
+        for rule in rules:
+            if rule.event is not None:
+                by_event.setdefault(rule.event, {}).setdefault(
+                    rule.source, []).append(rule)
+                continue
+            due = self._next_run(rule, now)
+            if due is not None:
+                timers.append((due, next(sequence), rule))
+            elif rule.at in ("sunrise", "sunset"):
+                logger.warning("Rule %r needs a latitude and longitude "
+                               "for %s", rule.name, rule.at)
+        heapq.heapify(timers)
+
+        with self._condition:
+            self.rules = rules
+            self._by_event = by_event
+            self._timers = timers
+            self._sequence = sequence
+            self._condition.notify()
+
+    def handle_event(self, event_type, source=None, data=None):
+        """
+        Runs the rules triggered by an event. Safe to call from any
+        thread, e.g. the event stream's.
+
+        Args:
+            event_type (str): e.g. "motion" or "button".
+            source (str, optional): ID of the sensor or light the event
+                                    came from.
+            data (dict, optional): What the event carries, e.g.
+                                   {"motion": True}.
+
+        Returns:
+            list: Names of the rules whose actions were taken.
+        """
+        data = data or {}
+        with self._condition:
+            sources = self._by_event.get(event_type)
+            self.events += 1
+            if not sources:
+                return []
+            candidates = list(sources.get(None, ()))
+            if source is not None:
+                candidates += sources.get(str(source), ())
+            self.evaluated += len(candidates)
+        fired = []
+        for rule in candidates:
+            if rule.matches(data):
+                self._fire(rule)
+                fired.append(rule.name)
+        return fired
+
+    def next_runs(self, limit=10):
+        """
+        Returns:
+            list: (Unix time, rule name) of the next time triggered
+                  runs, earliest first.
+        """
+        with self._condition:
+            upcoming = heapq.nsmallest(limit, self._timers)
+        return [(due, rule.name) for due, _, rule in upcoming]
+
+    def start(self):
+        """
+        Starts the thread running the time triggered rules.
+        """
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="Automation",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the engine thread.
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        """
+        Returns:
+            dict: Rule and timer counts, events handled, rules
+                  evaluated and actions fired.
+        """
+        with self._condition:
+            return {'rules': len(self.rules), 'timers': len(self._timers),
+                    'event_types': len(self._by_event),
+                    'events': self.events, 'evaluated': self.evaluated,
+                    'fired': self.fired}
+
+    def _run(self):
+        with self._condition:
+            while self._running:
+                if not self._timers:
+                    self._condition.wait()
+                    continue
+                due, _, rule = self._timers[0]
+                # The wall clock is what rules are written against, it
+                # is checked again at least every minute in case the
+                # clock was changed.
+                delay = due - time.time()
+                if delay > 0:
+                    self._condition.wait(min(delay, 60.0))
+                    continue
+                heapq.heappop(self._timers)
+                following = self._next_run(rule, max(due, time.time()) + 1)
+                if following is not None:
+                    heapq.heappush(self._timers,
+                                   (following, next(self._sequence), rule))
+                self._condition.release()
+                try:
+                    self._fire(rule)
+                finally:
+                    self._condition.acquire()
+
+    def _next_run(self, rule, now):
+        """
+        Returns:
+            float: Unix time of the first run of a time triggered rule
+                   after now, None if it never runs.
+        """
+        today = datetime.date.fromtimestamp(now)
+        # A year covers the polar nights and days without a sunset.
+        for offset in range(367):
+            day = today + datetime.timedelta(days=offset)
+            if day.weekday() not in rule.days:
+                continue
+            if rule.at in ("sunrise", "sunset"):
+                if self.latitude is None or self.longitude is None:
+                    return None
+                sunrise, sunset = sun_times(day, self.latitude,
+                                            self.longitude)
+                base = sunrise if rule.at == "sunrise" else sunset
+                if base is None:
+                    continue
+            else:
+                base = datetime.datetime.combine(
+                    day, datetime.time()).timestamp()
+            due = base + rule.offset
+            if due > now:
+                return due
+        return None
+
+    def _fire(self, rule):
+        """
+        Takes the action of a rule.
+        """
+        action = rule.action
+        controller = self.controller
+        logger.info("Automation %r fired", rule.name)
+        try:
+            if "scene" in action:
+                controller.run_async(controller.recall_scene, action["scene"],
+                                     action.get("transition_time"),
+                                     key=("scene", action["scene"]))
+            elif "timeline" in action:
+                controller.play_timeline(action["timeline"])
+            else:
+                kind = "group" if "group" in action else "light"
+                settings = controller._build_settings(
+                    action.get("color"), action.get("brightness"),
+                    action.get("transition_time", "SHORT"))
+                if "on" in action:
+                    settings['on'] = bool(action["on"])
+                controller.dispatcher.submit(
+                    kind, controller.resolve(kind, action[kind]), settings)
+        except Exception:
+            logger.exception("Automation %r failed", rule.name)
+            return
+        with self._condition:
+            self.fired += 1
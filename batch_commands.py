@@ -0,0 +1,93 @@
+def _freeze(settings):
+    """
+    Returns a hashable version of a state so identical states can be
+    found with a dict lookup.
+    """
+    return tuple(sorted((attribute, tuple(value) if isinstance(value, list)
+                         else value)
+                        for attribute, value in settings.items()))
+
+
+def plan_batch(states, state_cache):
+    """
+    Turns a mapping of targets to states into as few bridge commands as
+    possible.
+
+    Lights sharing an identical state are merged into a group command
+    whenever every light of a group on the bridge is among them, the
+    largest groups first. A light is covered by one command only, a
+    group overlapping lights already merged is skipped. Groups in the
+    mapping, and lights that could not be merged, get a command of
+    their own.
+
+    Args:
+        states (dict): (kind, target_id) -> settings, where kind is
+                       "light" or "group".
+        state_cache (StateCache): Knows which lights each group holds.
+
+    Returns:
+        list: (kind, target_id, settings, targets) tuples, where targets
+              lists the requested targets the command covers.
+    """
+    commands = []
+    # frozen state -> (settings, {light ID as string: requested target})
+    lights_by_state = {}
+    for target, settings in states.items():
+        kind, target_id = target
+        if kind == "group":
+            commands.append((kind, target_id, settings, [target]))
+        else:
+            lights = lights_by_state.setdefault(_freeze(settings),
+                                                (settings, {}))[1]
+            lights[str(target_id)] = target
+
+    groups = sorted(((group_id, set(state_cache.group_lights(group_id)))
+                     for group_id in state_cache.group_ids()),
+                    key=lambda group: len(group[1]), reverse=True)
+
+    for settings, lights in lights_by_state.values():
+        remaining = set(lights)
+        for group_id, members in groups:
+            # A single light is as cheap to set as a group, and the
+            # bridge accepts far fewer group commands per second.
+            if len(members) > 1 and members <= remaining:
+                commands.append(("group", group_id, settings,
+                                 [lights[light_id]
+                                  for light_id in sorted(members)]))
+                remaining -= members
+        for light_id in sorted(remaining):
+            commands.append(("light", light_id, settings,
+                             [lights[light_id]]))
+    return commands
+
+
+class BatchResult:
+    """
+    BatchResult holds the outcome of a batch of commands.
+
+    Attributes:
+    - results (dict): (kind, target_id) -> bridge response, or the
+                      exception raised while sending it.
+    - commands (int): Number of bridge commands the batch needed.
+    - wall_time (float): Seconds the whole batch took.
+
+    Methods:
+    - failed: Returns the targets whose command raised.
+    """
+    def __init__(self, results, commands, wall_time):
+        self.results = results
+        self.commands = commands
+        self.wall_time = wall_time
+
+    def failed(self):
+        """
+        Returns:
+            list: The targets whose command raised an exception.
+        """
+        return [target for target, result in self.results.items()
+                if isinstance(result, Exception)]
+
+    def __repr__(self):
+        return "BatchResult(targets={}, commands={}, failed={}, " \
+               "wall_time={:.3f})".format(len(self.results), self.commands,
+                                          len(self.failed()), self.wall_time)
@@ -0,0 +1,102 @@
+"""
+Drives a local FakeBridge from generated video and audio files through
+the ambient pipeline and reports per-stage latency and frame counts.
+
+The video is a gradient scrolling across the frame, the audio a tone
+sweeping up through the frequency bands over a beat.
+
+Run from the repository root:
+    python -m benchmarks.bench_ambient [--seconds S] [--lights N]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+from ambient import open_source
+from fake_bridge import FakeBridge
+from hue_controller import HueController
+
+
+def write_video(path, seconds, rate, width=320, height=180):
+    frames = int(seconds * rate)
+    columns = np.arange(width, dtype=np.float32) / width
+    video = np.empty((frames, height, width, 3), dtype=np.uint8)
+    for number in range(frames):
+        shift = (columns + number / frames) % 1.0
+        video[number, :, :, 0] = (255 * shift).astype(np.uint8)
+        video[number, :, :, 1] = (255 * (1.0 - shift)).astype(np.uint8)
+        video[number, :, :, 2] = 128
+    np.save(path, video)
+
+
+def write_audio(path, seconds, sample_rate=44100):
+    times = np.arange(int(seconds * sample_rate)) / sample_rate
+    frequency = 60.0 * (100.0 ** (times / seconds))
+    phase = 2 * np.pi * np.cumsum(frequency) / sample_rate
+    beat = 0.5 + 0.5 * (np.sin(2 * np.pi * 2.0 * times) > 0)
+    samples = (np.sin(phase) * beat * 0.8 * 32767).astype('<i2')
+    with wave.open(path, 'wb') as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(sample_rate)
+        file.writeframes(samples.tobytes())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--rate', type=float, default=25.0,
+                        help="source frames per second")
+    parser.add_argument('--lights', type=int, default=6)
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help="simulated bridge latency in seconds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = {'video': os.path.join(directory, 'frames.npy'),
+                 'audio': os.path.join(directory, 'sweep.wav')}
+        write_video(files['video'], args.seconds, args.rate)
+        write_audio(files['audio'], args.seconds)
+
+        for name, path in files.items():
+            with FakeBridge(lights=args.lights, latency=args.latency,
+                            rate_limits=FakeBridge.BRIDGE_RATE_LIMITS
+                            ) as bridge:
+                controller = HueController(bridge.address, bridge.username)
+                # Loaded up front so the first frame does not pay for it.
+                controller.color_engine
+                source = open_source(path, args.rate, loop=False)
+                try:
+                    start = time.monotonic()
+                    pipeline = controller.start_ambient(source)
+                    pipeline.wait()
+                    wall = time.monotonic() - start
+                    controller.dispatcher.flush(timeout=10.0)
+                    stats = pipeline.stats()
+                    refused = bridge.throttled
+                    requests = len(bridge.commands)
+                finally:
+                    controller.close()
+
+            print("{} ({:.1f} s, {} lights)".format(name, wall, args.lights))
+            print("  frames captured {captured}, dropped {dropped}, "
+                  "emitted {emitted}, light commands {commands}".format(
+                      **stats))
+            print("  bridge requests {}, refused {}".format(requests,
+                                                             refused))
+            print("  {:<12} {:>8} {:>8} {:>8}".format(
+                'stage', 'mean ms', 'p50 ms', 'p99 ms'))
+            for stage in pipeline.STAGES[1:] + ('end_to_end',):
+                latency = stats[stage]
+                print("  {:<12} {:>8.2f} {:>8.2f} {:>8.2f}".format(
+                    stage, latency['mean_ms'], latency['p50_ms'],
+                    latency['p99_ms']))
+
+
+if __name__ == "__main__":
+    main()
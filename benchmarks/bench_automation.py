@@ -0,0 +1,104 @@
+"""
+Measures how fast the automation engine evaluates events against a
+large rule set, next to a linear scan of the same rules.
+
+Rules wait for events of a few types from many sensors, so every event
+triggers only a handful of them. Time triggered rules are mixed in to
+measure how long compiling the trigger indexes takes.
+
+Run from the repository root:
+    python -m benchmarks.bench_automation [--rules N] [--events N]
+"""
+
+import argparse
+import random
+import time
+
+from automation import AutomationEngine, Rule
+from fake_bridge import FakeBridge
+from hue_controller import HueController
+
+EVENT_TYPES = ("motion", "button", "light_level", "temperature")
+
+
+def make_rules(count, sensors, seed=1):
+    generator = random.Random(seed)
+    rules = []
+    for number in range(count):
+        name = "rule {}".format(number)
+        if number % 10 == 9:
+            when = {"at": "{:02d}:{:02d}".format(generator.randrange(24),
+                                                 generator.randrange(60))}
+        else:
+            when = {"event": generator.choice(EVENT_TYPES),
+                    "source": str(generator.randrange(sensors)),
+                    "motion": True}
+        rules.append(Rule(name, when, {"light": generator.randrange(1, 5),
+                                       "on": True}))
+    return rules
+
+
+def make_events(count, sensors, seed=2):
+    generator = random.Random(seed)
+    return [(generator.choice(EVENT_TYPES), str(generator.randrange(sensors)),
+             {"motion": generator.random() < 0.5}) for _ in range(count)]
+
+
+def linear_scan(rules, events):
+    """
+    The same matching without indexes, looking at every rule.
+    """
+    matched = 0
+    for event_type, source, data in events:
+        for rule in rules:
+            if rule.event == event_type and \
+                    rule.source in (None, source) and rule.matches(data):
+                matched += 1
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rules', type=int, default=10000)
+    parser.add_argument('--sensors', type=int, default=500)
+    parser.add_argument('--events', type=int, default=20000)
+    args = parser.parse_args()
+
+    rules = make_rules(args.rules, args.sensors)
+    events = make_events(args.events, args.sensors)
+
+    with FakeBridge(lights=4) as bridge:
+        controller = HueController(bridge.address, bridge.username)
+        try:
+            engine = AutomationEngine(controller)
+            start = time.perf_counter()
+            engine.load(rules)
+            compiled = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for event in events:
+                engine.handle_event(*event)
+            indexed = time.perf_counter() - start
+            stats = engine.stats()
+        finally:
+            controller.close()
+
+    # The scan is slow, a sample of the events is enough.
+    sample = events[:max(1, min(len(events), 200000 // max(1, args.rules)))]
+    start = time.perf_counter()
+    linear_scan(rules, sample)
+    scanned = (time.perf_counter() - start) * len(events) / len(sample)
+
+    print("rules         {:>10d} ({} timers)".format(stats['rules'],
+                                                     stats['timers']))
+    print("compile       {:>10.1f} ms".format(compiled * 1000))
+    print("events        {:>10d}".format(stats['events']))
+    print("evaluated     {:>10.1f} rules per event".format(
+        stats['evaluated'] / stats['events']))
+    print("fired         {:>10d}".format(stats['fired']))
+    print("indexed       {:>10.0f} events/s".format(len(events) / indexed))
+    print("linear scan   {:>10.0f} events/s".format(len(events) / scanned))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Compares sequential and batched execution of per-light states against
+a local FakeBridge with three rooms of ten lights.
+
+Run from the repository root:
+    python -m benchmarks.bench_batch [--latency SECONDS]
+"""
+
+import argparse
+import time
+
+from fake_bridge import FakeBridge
+from hue_controller import HueController
+
+ROOMS = {'1': [str(n) for n in range(1, 11)],
+         '2': [str(n) for n in range(11, 21)],
+         '3': [str(n) for n in range(21, 31)]}
+
+
+def workload(brightness):
+    """
+    Returns:
+        dict: One state per light. Two rooms share a state per room,
+              the lights of the third room all differ.
+    """
+    states = {}
+    for room, lights in ROOMS.items():
+        for offset, light_id in enumerate(lights):
+            bri = brightness + (offset if room == '3' else int(room))
+            states[("light", light_id)] = {'on': True, 'bri': bri}
+    return states
+
+
+def run_sequential(controller, states):
+    start = time.monotonic()
+    for (kind, target_id), settings in states.items():
+        controller.rate_limiter.acquire(kind)
+        controller._apply_state(kind, target_id, settings)
+    return len(states), time.monotonic() - start
+
+
+def run_batched(controller, states):
+    result = controller.apply_batch(states)
+    return result.commands, result.wall_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help="simulated bridge latency in seconds")
+    args = parser.parse_args()
+
+    with FakeBridge(lights=30, groups=ROOMS, latency=args.latency) as bridge:
+        controller = HueController(bridge.address, bridge.username)
+        try:
+            print("{:<12} {:>10} {:>10}".format('mode', 'commands', 'seconds'))
+            for name, run, brightness in (('sequential', run_sequential, 50),
+                                          ('batched', run_batched, 150)):
+                commands, seconds = run(controller, workload(brightness))
+                print("{:<12} {:>10d} {:>10.3f}".format(name, commands,
+                                                          seconds))
+        finally:
+            controller.close()
+
+
+if __name__ == "__main__":
+    main()
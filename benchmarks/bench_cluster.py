@@ -0,0 +1,55 @@
+"""
+Drives a BridgeCluster of local FakeBridges, one of them slow, and
+reports how long each bridge takes to work through its queue.
+
+Run from the repository root:
+    python -m benchmarks.bench_cluster [--commands N]
+"""
+
+import argparse
+import time
+
+from bridge_cluster import BridgeCluster
+from fake_bridge import FakeBridge
+
+LATENCIES = {'fast': 0.005, 'medium': 0.02, 'slow': 0.3}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--commands', type=int, default=20,
+                        help="light commands per bridge")
+    args = parser.parse_args()
+
+    fakes = {name: FakeBridge(lights=10, latency=latency).start()
+             for name, latency in LATENCIES.items()}
+    cluster = BridgeCluster([{'name': name, 'ip': fake.address,
+                              'username': fake.username}
+                             for name, fake in fakes.items()])
+    try:
+        start = time.monotonic()
+        for number in range(args.commands):
+            for name in fakes:
+                target = "{}/{}".format(name, number % 10 + 1)
+                cluster.submit("light", target, {'bri': number + 1})
+
+        # Each bridge drains on its own worker, the fast ones finish
+        # without waiting for the slow one.
+        print("{:<8} {:>10} {:>8} {:>8} {:>10}".format(
+            'bridge', 'drained s', 'sent', 'dropped', 'probe ms'))
+        drained = {}
+        for name, controller in cluster.controllers.items():
+            controller.dispatcher.flush()
+            drained[name] = time.monotonic() - start
+        for name, health in cluster.check_health().items():
+            print("{:<8} {:>10.2f} {:>8d} {:>8d} {:>10.1f}".format(
+                name, drained[name], health['sent'], health['dropped'],
+                health['latency_ms']))
+    finally:
+        cluster.close()
+        for fake in fakes.values():
+            fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Compares converting light colors one at a time in plain Python with
+the batched ColorEngine conversions.
+
+Run from the repository root:
+    python -m benchmarks.bench_color [--lights N]
+"""
+
+import argparse
+import random
+import timeit
+
+import numpy as np
+
+from color_engine import GAMUTS, ColorEngine
+
+
+def rgb_to_xy_scalar(red, green, blue):
+    """
+    Converts one sRGB color to xy and brightness, the way it is done
+    per light without the color engine.
+    """
+    def linear(value):
+        if value > 0.04045:
+            return ((value + 0.055) / 1.055) ** 2.4
+        return value / 12.92
+
+    red, green, blue = linear(red), linear(green), linear(blue)
+    x = red * 0.664511 + green * 0.154324 + blue * 0.162028
+    y = red * 0.283881 + green * 0.668433 + blue * 0.047685
+    z = red * 0.000088 + green * 0.072310 + blue * 0.986039
+    total = x + y + z
+    if total == 0:
+        return (0.3127, 0.3290), 0
+    point = (x / total, y / total)
+    return clamp_scalar(point, GAMUTS['C']), round(min(y, 1.0) * 254)
+
+
+def clamp_scalar(point, corners):
+    def side(a, b, p):
+        return (b[0] - a[0]) * (p[1] - a[1]) - (b[1] - a[1]) * (p[0] - a[0])
+
+    edges = [(corners[i], corners[(i + 1) % 3]) for i in range(3)]
+    sides = [side(a, b, point) for a, b in edges]
+    if all(s >= 0 for s in sides) or all(s <= 0 for s in sides):
+        return point
+
+    best, best_distance = None, None
+    for a, b in edges:
+        dx, dy = b[0] - a[0], b[1] - a[1]
+        t = ((point[0] - a[0]) * dx + (point[1] - a[1]) * dy) \
+            / (dx * dx + dy * dy)
+        t = min(1.0, max(0.0, t))
+        candidate = (a[0] + t * dx, a[1] + t * dy)
+        distance = (candidate[0] - point[0]) ** 2 \
+            + (candidate[1] - point[1]) ** 2
+        if best is None or distance < best_distance:
+            best, best_distance = candidate, distance
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--lights', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    engine = ColorEngine()
+    colors = [(random.random(), random.random(), random.random())
+              for _ in range(args.lights)]
+    rgb = np.array(colors)
+    rgb8 = (rgb * 255).astype(np.uint8)
+
+    runs = {
+        'scalar': lambda: [rgb_to_xy_scalar(*color) for color in colors],
+        'batched': lambda: engine.rgb_to_xy(rgb),
+        'lookup table': lambda: engine.lookup_rgb8(rgb8),
+    }
+    print("{} lights per frame".format(args.lights))
+    print("{:<14} {:>12} {:>14}".format('method', 'ms/frame', 'colors/s'))
+    for name, run in runs.items():
+        seconds = timeit.timeit(run, number=args.repeat) / args.repeat
+        print("{:<14} {:>12.3f} {:>14.0f}".format(
+            name, seconds * 1000, args.lights / seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Streams an effect to a LoopbackReceiver and reports frame timing.
+
+Run from the repository root:
+    python -m benchmarks.bench_entertainment [--rate HZ] [--lights N]
+"""
+
+import argparse
+import time
+
+from entertainment import ColorLoop, EntertainmentStream, LoopbackReceiver
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rate', type=float, default=50.0)
+    parser.add_argument('--lights', type=int, default=10)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    receiver = LoopbackReceiver()
+    receiver.start()
+    stream = EntertainmentStream(range(1, args.lights + 1), receiver.address,
+                                 ColorLoop(), rate=args.rate)
+    stream.start()
+    time.sleep(args.seconds)
+    stream.stop()
+    # Give the last datagrams time to arrive.
+    time.sleep(0.3)
+    receiver.stop()
+
+    sent = stream.stats()
+    received = receiver.stats()
+    print("rate        {:>8.1f} Hz".format(args.rate))
+    print("sent        {:>8d}".format(sent['frames_sent']))
+    print("skipped     {:>8d}".format(sent['frames_skipped']))
+    print("received    {:>8d}".format(received['received']))
+    print("dropped     {:>8d}".format(received['dropped']))
+    print("interval    {:>8.2f} ms".format(received['interval_ms']))
+    print("jitter      {:>8.2f} ms".format(received['jitter_ms']))
+
+
+if __name__ == "__main__":
+    main()
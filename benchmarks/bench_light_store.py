@@ -0,0 +1,139 @@
+"""
+Compares the memory and speed of the columnar light store against the
+dict per light representation of the state cache.
+
+A site of many lights spread over rooms is built three ways: dicts as
+the bridge reports them, LightRecord objects and a LightStateStore.
+Single light updates, group updates and the query "lights in a room
+that are on and brighter than 100" are timed on the dicts and on the
+store.
+
+Run from the repository root:
+    python -m benchmarks.bench_light_store [--lights N] [--rooms N]
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+from light_store import LightRecord, LightStateStore
+
+
+def make_site(lights, rooms, seed=1):
+    generator = random.Random(seed)
+    api = {'lights': {}}
+    room_of = {}
+    for number in range(1, lights + 1):
+        light_id = str(number)
+        api['lights'][light_id] = {'state': {
+            'on': generator.random() < 0.5,
+            'bri': generator.randrange(1, 255),
+            'xy': [round(generator.random(), 4), round(generator.random(), 4)],
+            'ct': generator.randrange(153, 501),
+            'reachable': True, 'colormode': 'xy'}}
+        room_of[light_id] = str(number % rooms + 1)
+    return api, room_of
+
+
+def measure(build):
+    """
+    Returns what build() returns and the bytes it allocated.
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--lights', type=int, default=1000)
+    parser.add_argument('--rooms', type=int, default=40)
+    parser.add_argument('--updates', type=int, default=50000)
+    args = parser.parse_args()
+
+    api, room_of = make_site(args.lights, args.rooms)
+    members = {}
+    for light_id, room in room_of.items():
+        members.setdefault(room, []).append(light_id)
+
+    dicts, dict_bytes = measure(lambda: {
+        light_id: dict(light['state'])
+        for light_id, light in api['lights'].items()})
+    records, record_bytes = measure(lambda: [
+        LightRecord.from_state(light_id, light['state'], room_of[light_id])
+        for light_id, light in api['lights'].items()])
+
+    def build_store():
+        store = LightStateStore()
+        store.load(api, room_of)
+        return store
+    store, store_bytes = measure(build_store)
+
+    print("{} lights in {} rooms".format(args.lights, args.rooms))
+    print("  {:<14} {:>12} {:>10}".format('memory', 'bytes', 'per light'))
+    for name, size in (('dicts', dict_bytes), ('records', record_bytes),
+                       ('store', store_bytes),
+                       ('store columns', store.nbytes())):
+        print("  {:<14} {:>12d} {:>10.1f}".format(name, size,
+                                                   size / args.lights))
+
+    generator = random.Random(2)
+    changes = [(str(generator.randrange(1, args.lights + 1)),
+                {'bri': generator.randrange(1, 255),
+                 'on': generator.random() < 0.5})
+               for _ in range(args.updates)]
+
+    start = time.perf_counter()
+    for light_id, state in changes:
+        dicts[light_id].update(state)
+    dict_updates = time.perf_counter() - start
+    start = time.perf_counter()
+    for light_id, state in changes:
+        store.update(light_id, state)
+    store_updates = time.perf_counter() - start
+
+    room = '1'
+    group = members[room]
+    state = {'on': True, 'bri': 180}
+
+    def dict_group():
+        for light_id in group:
+            dicts[light_id].update(state)
+
+    def dict_query():
+        return [light_id for light_id, light in dicts.items()
+                if room_of[light_id] == room and light['on'] and
+                light['bri'] > 100]
+
+    assert dict_query() == store.select(room=room, on=True, min_bri=101)
+    repeat = 200
+    rows = (
+        ('update', args.updates / dict_updates, args.updates / store_updates),
+        ('group update', 1 / timed(dict_group, repeat),
+         1 / timed(lambda: store.update_many(group, state), repeat)),
+        ('room query', 1 / timed(dict_query, repeat),
+         1 / timed(lambda: store.select(room=room, on=True, min_bri=101),
+                   repeat)),
+        ('count on', 1 / timed(lambda: sum(1 for light in dicts.values()
+                                           if light['on']), repeat),
+         1 / timed(lambda: store.count(on=True), repeat)),
+    )
+    print("  {:<14} {:>12} {:>12}".format('per second', 'dicts', 'store'))
+    for name, dict_rate, store_rate in rows:
+        print("  {:<14} {:>12.0f} {:>12.0f}".format(name, dict_rate,
+                                                    store_rate))
+
+
+if __name__ == "__main__":
+    main()
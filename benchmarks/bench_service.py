@@ -0,0 +1,168 @@
+"""
+Runs a CPU heavy effect next to a GUI-like event loop, once in the
+controller's process and once with the controller in a worker process.
+
+The event loop wakes every 10 ms like a Tk after() loop and records
+how late it woke. In the single process layout the effect thread holds
+the interpreter lock, in the multi process layout the effect runs in a
+front-end process of its own and sends frames through the shared
+memory ring, while the loop's process queries the worker over the
+control channel. Both run against a local FakeBridge.
+
+Run from the repository root:
+    python -m benchmarks.bench_service [--seconds S] [--lights N]
+"""
+
+import argparse
+import math
+import threading
+import time
+from multiprocessing import get_context
+
+from controller_service import ServiceClient, spawn_service
+from fake_bridge import FakeBridge
+from hue_controller import HueController
+
+AUTHKEY = b'bench'
+TICK = 0.010
+
+
+def effect_frame(number, lights, work):
+    """
+    A color wave over the lights, with pure Python busy work standing
+    in for an expensive effect.
+    """
+    total = 0.0
+    for step in range(work):
+        total += math.sin(step * 0.001)
+    return {str(light): {'on': True,
+                         'bri': 128 + int(100 * math.sin(number / 10 + light)),
+                         'xy': [0.3 + 0.1 * math.sin(number / 20 + light),
+                                0.3 + 0.1 * math.cos(number / 20 + light)],
+                         'transitiontime': 1}
+            for light in range(1, lights + 1)}
+
+
+def run_effect(submit, seconds, lights, work, rate):
+    frames = 0
+    start = time.monotonic()
+    while time.monotonic() - start < seconds:
+        submit(effect_frame(frames, lights, work))
+        frames += 1
+        delay = start + frames / rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    return frames
+
+
+def effect_process(address, seconds, lights, work, rate):
+    with ServiceClient(address, AUTHKEY) as client:
+        writer = client.open_frames(max_lights=lights)
+        run_effect(writer.write, seconds, lights, work, rate)
+        # Keeps the ring open until the last frames are read and the
+        # statistics collected.
+        time.sleep(0.5)
+
+
+def event_loop(seconds, query):
+    """
+    Wakes every TICK seconds, calls query() and returns how late each
+    wake-up was and how long each query took.
+    """
+    lags, queries = [], []
+    deadline = time.monotonic() + seconds
+    due = time.monotonic() + TICK
+    while due < deadline:
+        time.sleep(max(0.0, due - time.monotonic()))
+        lags.append(time.monotonic() - due)
+        start = time.perf_counter()
+        query()
+        queries.append(time.perf_counter() - start)
+        due += TICK
+    return lags, queries
+
+
+def percentiles(values):
+    values = sorted(values)
+    return (values[len(values) // 2] * 1000,
+            values[min(len(values) - 1, int(len(values) * 0.99))] * 1000)
+
+
+def single_process(bridge, args):
+    controller = HueController(bridge.address, bridge.username)
+    dispatcher = controller.dispatcher
+
+    def submit(states):
+        for light_id, state in states.items():
+            dispatcher.submit("light", light_id, state)
+
+    try:
+        effect = threading.Thread(target=run_effect, daemon=True, args=(
+            submit, args.seconds, args.lights, args.work, args.rate))
+        effect.start()
+        result = event_loop(args.seconds,
+                            lambda: controller.state_cache.get("light", "1"))
+        effect.join()
+    finally:
+        controller.close()
+    return result, None
+
+
+def multi_process(bridge, args):
+    process, address = spawn_service(bridge.address, bridge.username,
+                                     authkey=AUTHKEY)
+    try:
+        client = ServiceClient(address, AUTHKEY)
+        effect = get_context('spawn').Process(
+            target=effect_process, args=(address, args.seconds, args.lights,
+                                         args.work, args.rate))
+        effect.start()
+        # Waits for the effect process to attach before measuring.
+        while not client.stats()['rings']:
+            time.sleep(0.05)
+        result = event_loop(args.seconds,
+                            lambda: client.state("light", "1"))
+        # Read while the effect process still holds its ring open.
+        stats = client.stats()
+        effect.join()
+        client.close()
+    finally:
+        process.terminate()
+        process.join()
+    return result, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--lights', type=int, default=20)
+    parser.add_argument('--rate', type=float, default=30.0,
+                        help="effect frames per second")
+    parser.add_argument('--work', type=int, default=60000,
+                        help="busy loop steps per effect frame")
+    args = parser.parse_args()
+
+    print("{} lights, {} frames/s, {:.0f} s".format(args.lights, args.rate,
+                                                   args.seconds))
+    print("  {:<16} {:>10} {:>10} {:>10} {:>10}".format(
+        'layout', 'lag p50', 'lag p99', 'query p50', 'query p99'))
+    for name, layout in (('single process', single_process),
+                         ('multi process', multi_process)):
+        with FakeBridge(lights=args.lights) as bridge:
+            (lags, queries), stats = layout(bridge, args)
+        print("  {:<16} {:>7.2f} ms {:>7.2f} ms {:>7.2f} ms {:>7.2f} ms"
+              .format(name, *percentiles(lags), *percentiles(queries)))
+
+    rings = list(stats['rings'].values()) or [{}]
+    frame_latency = stats['frame_latency']
+    print("  worker: {} requests, frames written {}, dropped {}, "
+          "frame latency p50 {:.2f} ms p99 {:.2f} ms".format(
+              stats['requests'], rings[0].get('written', 0),
+              rings[0].get('dropped', 0), frame_latency.get('p50_ms', 0),
+              frame_latency.get('p99_ms', 0)))
+    print("  dispatcher: {sent} sent, {dropped} superseded".format(
+        **stats['dispatcher']))
+
+
+if __name__ == "__main__":
+    main()
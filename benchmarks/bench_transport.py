@@ -0,0 +1,80 @@
+"""
+Compares the pooled and unpooled bridge transports against a local
+FakeBridge.
+
+Run from the repository root:
+    python -m benchmarks.bench_transport [--requests N] [--threads N]
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bridge_transport import PooledTransport, Transport
+from fake_bridge import FakeBridge
+
+
+def percentile(samples, fraction):
+    """
+    Args:
+        samples (list): Sorted samples.
+        fraction (float): The percentile as a fraction, e.g. 0.99.
+
+    Returns:
+        The sample at the given percentile.
+    """
+    index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+    return samples[index]
+
+
+def run(transport, username, requests, threads):
+    """
+    Sends a number of light state PUTs through a transport.
+
+    Returns:
+        dict: Requests per second and p50/p99 latency in milliseconds.
+    """
+    def send(number):
+        address = "/api/{}/lights/{}/state".format(username, number % 10 + 1)
+        start = time.perf_counter()
+        transport.request('PUT', address, {'bri': number % 254})
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = sorted(pool.map(send, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'req/s': requests / elapsed,
+        'p50 ms': percentile(latencies, 0.50) * 1000,
+        'p99 ms': percentile(latencies, 0.99) * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="simulated bridge latency in seconds")
+    args = parser.parse_args()
+
+    with FakeBridge(latency=args.latency) as bridge:
+        transports = {
+            'unpooled': Transport(bridge.address),
+            'pooled': PooledTransport(bridge.address,
+                                      pool_size=max(1, args.threads))
+        }
+        print("{:<10} {:>10} {:>10} {:>10}".format(
+            'transport', 'req/s', 'p50 ms', 'p99 ms'))
+        for name, transport in transports.items():
+            result = run(transport, bridge.username,
+                         args.requests, args.threads)
+            transport.close()
+            print("{:<10} {:>10.0f} {:>10.2f} {:>10.2f}".format(
+                name, result['req/s'], result['p50 ms'], result['p99 ms']))
+
+
+if __name__ == "__main__":
+    main()
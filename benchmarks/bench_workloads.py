@@ -0,0 +1,266 @@
+"""
+Replays GUI-like workloads against a rate-limited local FakeBridge and
+reports throughput, latency and dropped commands for each.
+
+Workloads:
+- slider-group: a brightness slider dragged at 60 events per second.
+- slider-light: the same drag on a single light.
+- toggles: the power switch hammered ten times a second.
+- rooms-batch: a look applied to three rooms, light by light.
+- rooms-scene: the same looks recalled as bridge scenes.
+- effect-clicks: a light clicked twice a second while a background
+  effect drives the other lights, only the clicks are measured.
+- effect-clicks-fifo: the same with the clicks queued like the effect,
+  without priority.
+- effect-busy: the effect alone on a bridge another app keeps half
+  busy, the rate limiter has to find the rate left over.
+
+Latency is the time from an event to the bridge applying its state,
+or a newer one for the same target. Events whose own state never
+reached the bridge, superseded by a newer one or refused by the bridge
+for exceeding its rate limits, count as dropped.
+
+Run from the repository root:
+    python -m benchmarks.bench_workloads [--latency SECONDS] [--no-limits]
+"""
+
+import argparse
+import logging
+import math
+import threading
+import time
+
+from fake_bridge import FakeBridge
+from hue_controller import HueController
+
+ROOMS = {'1': ['1', '2', '3', '4'],
+         '2': ['5', '6', '7', '8'],
+         '3': ['9', '10', '11', '12']}
+LOOKS = 5
+
+
+class Recorder:
+    """
+    Records which event each bridge command carried, by wrapping the
+    controller's _send_command.
+    """
+    def __init__(self, controller):
+        self._lock = threading.Lock()
+        self._send = controller._send_command
+        self.submitted = {}
+        self.events = []
+        self.sends = []
+        self.refused = 0
+        controller._send_command = self._send_command
+
+    def event(self, kind, target_id):
+        with self._lock:
+            index = len(self.events)
+            self.events.append(((kind, str(target_id)), time.monotonic()))
+            self.submitted[(kind, str(target_id))] = index
+
+    def _send_command(self, kind, target_id, settings):
+        key = (kind, str(target_id))
+        with self._lock:
+            carried = self.submitted.get(key, -1)
+        response = self._send(kind, target_id, settings)
+        refused = has_error(response)
+        with self._lock:
+            if refused:
+                self.refused += 1
+            else:
+                self.sends.append((key, carried, time.monotonic()))
+        return response
+
+    def latencies(self):
+        """
+        Returns:
+            tuple: (latency in seconds of every served event, number of
+                   events whose own state was never sent).
+        """
+        latencies = []
+        carried = {index for _, index, _ in self.sends}
+        for index, (key, submitted) in enumerate(self.events):
+            served = [done for target, newest, done in self.sends
+                      if target == key and newest >= index]
+            if served:
+                latencies.append(min(served) - submitted)
+        return latencies, len(self.events) - len(carried & set(
+            range(len(self.events))))
+
+
+def has_error(response):
+    """
+    Tells whether a bridge response holds an error. phue returns the
+    responses of group commands as a list per group.
+    """
+    if isinstance(response, list):
+        return any(has_error(item) for item in response)
+    return isinstance(response, dict) and 'error' in response
+
+
+def paced(count, rate):
+    """
+    Yields count times, rate times per second, on monotonic deadlines.
+    """
+    start = time.monotonic()
+    for number in range(count):
+        delay = start + number / rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        yield number
+
+
+def slider(controller, recorder, kind, target_id):
+    for number in paced(120, 60):
+        recorder.event(kind, target_id)
+        controller.dispatcher.submit(kind, target_id,
+                                     {'bri': number + 1, 'transitiontime': 0})
+    controller.dispatcher.flush()
+
+
+def toggles(controller, recorder):
+    futures = []
+    for number in paced(20, 10):
+        recorder.event("group", 0)
+        turn = controller._turn_on_lights_group if number % 2 == 0 \
+            else controller._turn_off_lights_group
+        futures.append(turn(0))
+    for future in futures:
+        future.result()
+
+
+def effect(controller, recorder, seconds, record=True):
+    """
+    A color wave over lights 2 to 12 at 10 frames per second.
+    """
+    for number in paced(int(seconds * 10), 10):
+        for light in range(2, 13):
+            if record:
+                recorder.event("light", str(light))
+            controller.dispatcher.submit(
+                "light", str(light),
+                {'on': True, 'bri': 100 + (number * 7 + light * 13) % 150,
+                 'transitiontime': 1}, priority="background")
+
+
+def effect_clicks(controller, recorder, priority="user"):
+    runner = threading.Thread(target=effect,
+                              args=(controller, recorder, 4.0, False))
+    runner.start()
+    time.sleep(0.5)
+    for number in paced(6, 2):
+        recorder.event("light", "1")
+        controller.dispatcher.submit("light", "1", {'on': number % 2 == 0},
+                                     priority=priority)
+    runner.join()
+    controller.dispatcher.flush()
+
+
+def effect_busy(controller, recorder):
+    effect(controller, recorder, 4.0)
+    controller.dispatcher.flush()
+
+
+def look(number, room):
+    return {'on': True, 'bri': 40 * number + 10 * int(room),
+            'xy': [0.2 + 0.05 * number, 0.3]}
+
+
+def rooms_batch(controller, recorder):
+    for number in range(LOOKS):
+        states = {("light", light_id): look(number, room)
+                  for room, lights in ROOMS.items() for light_id in lights}
+        # Different colors per light keep the planner from merging
+        # everything into a single group command.
+        for offset, key in enumerate(states):
+            states[key]['xy'] = [states[key]['xy'][0], 0.3 + offset * 0.01]
+            recorder.event(*key)
+        controller.apply_batch(states)
+
+
+def rooms_scene(controller, recorder):
+    scenes = {}
+    for number in range(LOOKS):
+        for room in ROOMS:
+            scenes["look {} room {}".format(number, room)] = {
+                'group': int(room),
+                'state': {'brightness': 'DIM', 'color': 'BLUE'},
+                'lights': {light_id: {'brightness': 'BRIGHT'}
+                           for light_id in ROOMS[room][number % 4:]}}
+    controller.config.set_setting("scenes", scenes)
+    controller.sync_scenes()
+    for number in range(LOOKS):
+        for room in ROOMS:
+            recorder.event("group", room)
+            controller.recall_scene("look {} room {}".format(number, room))
+
+
+WORKLOADS = {
+    'slider-group': lambda c, r: slider(c, r, "group", "0"),
+    'slider-light': lambda c, r: slider(c, r, "light", "1"),
+    'toggles': toggles,
+    'rooms-batch': rooms_batch,
+    'rooms-scene': rooms_scene,
+    'effect-clicks': effect_clicks,
+    'effect-clicks-fifo': lambda c, r: effect_clicks(c, r, "background"),
+    'effect-busy': effect_busy,
+}
+
+# Workloads on a bridge that accepts less than a real one.
+BUSY_BRIDGE = {'effect-busy': {'light': 5.0, 'group': 1.0}}
+
+
+def percentile(values, share):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(share * len(ordered)) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help="simulated bridge latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.01,
+                        help="random extra latency in seconds")
+    parser.add_argument('--no-limits', action='store_true',
+                        help="let the fake bridge accept any rate")
+    parser.add_argument('--workload', choices=sorted(WORKLOADS),
+                        action='append', help="run only these workloads")
+    args = parser.parse_args()
+
+    # Refused commands are counted below, phue would log each of them.
+    logging.getLogger('phue').setLevel(logging.CRITICAL)
+    limits = None if args.no_limits else FakeBridge.BRIDGE_RATE_LIMITS
+    print("{:<18} {:>6} {:>8} {:>7} {:>7} {:>8} {:>8} {:>8} {:>6} {:>7}"
+          .format('workload', 'events', 'commands', 'dropped', 'refused',
+                  'cmd/s', 'p50 ms', 'p99 ms', 'wall s', 'light/s'))
+    for name in args.workload or WORKLOADS:
+        bridge_limits = limits and BUSY_BRIDGE.get(name, limits)
+        with FakeBridge(lights=12, groups=ROOMS, latency=args.latency,
+                        jitter=args.jitter, rate_limits=bridge_limits,
+                        seed=1) as bridge:
+            controller = HueController(bridge.address, bridge.username)
+            recorder = Recorder(controller)
+            try:
+                start = time.monotonic()
+                WORKLOADS[name](controller, recorder)
+                wall = time.monotonic() - start
+                # Where the rate limiter settled for light commands.
+                light_rate = controller.rate_limiter.rate("light")
+            finally:
+                controller.close()
+
+            latencies, dropped = recorder.latencies()
+            commands = len(recorder.sends) + recorder.refused
+            print("{:<18} {:>6d} {:>8d} {:>7d} {:>7d} {:>8.1f} {:>8.1f} "
+                  "{:>8.1f} {:>6.2f} {:>7.1f}".format(
+                      name, len(recorder.events), commands, dropped,
+                      recorder.refused, commands / wall,
+                      percentile(latencies, 0.5) * 1000,
+                      percentile(latencies, 0.99) * 1000, wall, light_rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from batch_commands import BatchResult
+from config_manager import ConfigManager
+from hue_controller import HueController
+
+logger = logging.getLogger(__name__)
+
+class BridgeCluster:
+    """
+    BridgeCluster controls the lights of several Philips Hue Bridges
+    as if they were one.
+
+    Every bridge gets its own HueController, and with it its own
+    connection pool, rate limiter and dispatcher thread, so a slow or
+    unreachable bridge never holds up commands for the others. A bridge
+    that cannot be reached is kept offline instead of failing the whole
+    cluster, and can be connected again later.
+
+    The members share the configuration, so none of them uploads the
+    configured scenes or serves metrics on the configured port.
+
+    Lights and groups share one namespace: a target ID is the bridge
+    name and the ID on that bridge joined by a slash, e.g. "hall/3".
+
+    Attributes:
+    - controllers (dict): Bridge name -> HueController.
+    - offline (dict): Bridge name -> the error that kept it offline.
+
+    Methods:
+    - from_config: Builds a cluster from the "bridges" setting.
+    - reconnect: Tries to connect the offline bridges again.
+    - resolve: Splits a cluster wide ID into controller and local ID.
+    - lights: Returns the cached state of every light.
+    - submit: Queues a state for a light or group.
+    - apply_batch: Applies states to targets across all bridges.
+    - check_health: Probes every bridge and returns its health.
+    - close: Stops every controller.
+    """
+    SEPARATOR = '/'
+
+    def __init__(self, bridges):
+        """
+        Initializes the BridgeCluster, connecting to all bridges in
+        parallel.
+
+        Args:
+            bridges (list): Dicts with the "name", "ip" and, optionally,
+                            "username" of each bridge.
+
+        Raises:
+            ValueError: If two bridges have the same name.
+        """
+        names = [bridge['name'] for bridge in bridges]
+        if len(set(names)) != len(names):
+            raise ValueError("bridge names must be unique")
+        self._started = time.monotonic()
+        self.controllers = {}
+        self.offline = {}
+        try:
+            for bridge in bridges:
+                self.controllers[bridge['name']] = HueController(
+                    bridge['ip'], bridge.get('username'), connect=False,
+                    shared_config=True)
+        except Exception:
+            # Nothing is left running for a cluster that never existed.
+            self.close()
+            raise
+        self._connect(list(self.controllers))
+
+    def _connect(self, names):
+        """
+        Connects the named bridges in parallel, marking those that fail
+        offline.
+        """
+        def connect(name):
+            try:
+                self.controllers[name].connect()
+                return name, None
+            except Exception as error:
+                return name, error
+
+        with ThreadPoolExecutor(max_workers=len(names) or 1) as pool:
+            for name, error in pool.map(connect, names):
+                if error is None:
+                    self.offline.pop(name, None)
+                else:
+                    logger.warning("Bridge %s is offline: %s", name, error)
+                    self.offline[name] = error
+
+    @classmethod
+    def from_config(cls):
+        """
+        Builds a cluster from the "bridges" setting, falling back to the
+        single "bridge_ip" as a bridge named "default".
+
+        Returns:
+            BridgeCluster: The connected cluster.
+        """
+        config = ConfigManager()
+        bridges = config.get_setting("bridges")
+        if not bridges:
+            bridges = [{'name': 'default',
+                        'ip': config.get_setting("bridge_ip")}]
+        return cls(bridges)
+
+    def reconnect(self):
+        """
+        Tries to connect the offline bridges again.
+
+        Returns:
+            list: Names of the bridges still offline.
+        """
+        self._connect(list(self.offline))
+        return list(self.offline)
+
+    def resolve(self, target_id):
+        """
+        Splits a cluster wide ID into the bridge controller and the ID
+        on that bridge.
+
+        Args:
+            target_id (str): e.g. "hall/3".
+
+        Returns:
+            tuple: (HueController, local ID).
+
+        Raises:
+            KeyError: If no bridge with that name is known.
+            ConnectionError: If the bridge is offline.
+        """
+        name, _, local_id = str(target_id).partition(self.SEPARATOR)
+        controller = self.controllers[name]
+        if name in self.offline:
+            raise ConnectionError("bridge {} is offline".format(name))
+        return controller, local_id
+
+    def lights(self):
+        """
+        Returns:
+            dict: Cluster wide light ID -> cached state, for every light
+                  on every bridge.
+        """
+        lights = {}
+        for name, controller in self.controllers.items():
+            if name in self.offline:
+                continue
+            for light_id in controller.state_cache.group_lights(0):
+                lights[name + self.SEPARATOR + light_id] = \
+                    controller.state_cache.get("light", light_id)
+        return lights
+
+    def submit(self, kind, target_id, settings, priority="normal"):
+        """
+        Queues a state for a light or group on the bridge owning it.
+        Returns immediately.
+
+        Args:
+            kind (str): "light" or "group".
+            target_id (str): Cluster wide ID of the light or group.
+            settings (dict): Bridge state attributes to apply.
+            priority (str, optional): "user", "normal" or "background".
+                                      Defaults to "normal".
+
+        Returns:
+            Future: Resolves to the bridge response once sent.
+        """
+        controller, local_id = self.resolve(target_id)
+        return controller.dispatcher.submit(kind, local_id, settings,
+                                            priority)
+
+    def apply_batch(self, states):
+        """
+        Applies states to targets across all bridges. Each bridge runs
+        its part of the batch at the same time as the others.
+
+        Args:
+            states (dict): (kind, cluster wide ID) -> bridge state
+                           attributes.
+
+        Returns:
+            BatchResult: The response, or exception, for every target.
+                         Targets on an offline bridge get a
+                         ConnectionError.
+        """
+        start = time.monotonic()
+        by_bridge = {}
+        results = {}
+        for (kind, target_id), settings in states.items():
+            name = str(target_id).partition(self.SEPARATOR)[0]
+            try:
+                local_id = self.resolve(target_id)[1]
+            except ConnectionError as error:
+                results[(kind, target_id)] = error
+                continue
+            by_bridge.setdefault(name, {})[(kind, local_id)] = \
+                ((kind, target_id), settings)
+
+        def run(name):
+            local_states = {target: settings for target, (_, settings)
+                            in by_bridge[name].items()}
+            return name, self.controllers[name].apply_batch(local_states)
+
+        commands = 0
+        with ThreadPoolExecutor(max_workers=len(by_bridge) or 1) as pool:
+            for name, result in pool.map(run, by_bridge):
+                commands += result.commands
+                for local_target, response in result.results.items():
+                    original_target = by_bridge[name][local_target][0]
+                    results[original_target] = response
+
+        return BatchResult(results, commands, time.monotonic() - start)
+
+    def check_health(self):
+        """
+        Probes every bridge in parallel and reports its health and
+        throughput.
+
+        Returns:
+            dict: Bridge name -> dict with "reachable", "latency_ms" of
+                  the probe, the dispatcher counters, the commands
+                  sent per second since the cluster started and, for
+                  offline bridges, the "error" that keeps them offline.
+        """
+        def probe(item):
+            name, controller = item
+            if name in self.offline:
+                return name, False, 0.0
+            start = time.monotonic()
+            try:
+                controller.bridge.request(
+                    'GET', '/api/{}/config'.format(controller.bridge.username))
+                reachable = True
+            except Exception:
+                reachable = False
+            return name, reachable, (time.monotonic() - start) * 1000
+
+        uptime = time.monotonic() - self._started
+        health = {}
+        with ThreadPoolExecutor(max_workers=len(self.controllers) or 1) \
+                as pool:
+            for name, reachable, latency in pool.map(
+                    probe, self.controllers.items()):
+                stats = self.controllers[name].dispatcher.stats()
+                stats['reachable'] = reachable
+                stats['latency_ms'] = latency
+                stats['commands_per_second'] = stats['sent'] / uptime
+                if name in self.offline:
+                    stats['error'] = str(self.offline[name])
+                health[name] = stats
+        return health
+
+    def close(self):
+        """
+        Stops the background workers of every controller.
+        """
+        for controller in self.controllers.values():
+            controller.close()
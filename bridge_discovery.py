@@ -0,0 +1,224 @@
+import http.client
+import ipaddress
+import json
+import logging
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+def probe_bridge(host, timeout=0.5):
+    """
+    Asks a host whether it is a Philips Hue Bridge.
+
+    Args:
+        host (str): Address of the host, optionally with ":port".
+        timeout (float, optional): Seconds to wait for an answer.
+
+    Returns:
+        str: The bridge ID when the host is a bridge, otherwise None.
+    """
+    connection = http.client.HTTPConnection(host, timeout=timeout)
+    try:
+        connection.request('GET', '/api/config')
+        response = connection.getresponse()
+        config = json.loads(response.read().decode('utf-8'))
+    except (OSError, http.client.HTTPException, ValueError):
+        return None
+    finally:
+        connection.close()
+    if isinstance(config, dict):
+        return config.get('bridgeid')
+    return None
+
+
+def discover_mdns(timeout=3.0, stop=None):
+    """
+    Looks for a bridge announcing itself over mDNS (_hue._tcp).
+
+    Args:
+        timeout (float, optional): Seconds to wait for an answer.
+        stop (threading.Event, optional): Ends the search early when set.
+
+    Returns:
+        str: The address of the first bridge found, otherwise None.
+    """
+    try:
+        from zeroconf import ServiceBrowser, Zeroconf
+    except ImportError:
+        logger.info("zeroconf is not installed, skipping mDNS discovery")
+        return None
+
+    found = []
+    done = stop or threading.Event()
+
+    class Listener:
+        def add_service(self, zc, service_type, name):
+            info = zc.get_service_info(service_type, name, timeout=1000)
+            if info and info.parsed_addresses():
+                found.append(info.parsed_addresses()[0])
+                done.set()
+
+        def update_service(self, zc, service_type, name):
+            pass
+
+        def remove_service(self, zc, service_type, name):
+            pass
+
+    zeroconf = Zeroconf()
+    try:
+        ServiceBrowser(zeroconf, "_hue._tcp.local.", Listener())
+        done.wait(timeout)
+    finally:
+        zeroconf.close()
+    return found[0] if found else None
+
+
+def local_subnet_hosts(max_prefix=24):
+    """
+    Lists the addresses on the local IPv4 networks, using the network
+    interfaces reported by ifaddr. Networks larger than max_prefix are
+    narrowed down to the part around the machine's own address.
+
+    Args:
+        max_prefix (int, optional): Smallest prefix length probed.
+                                    Defaults to 24 (254 hosts).
+
+    Returns:
+        list: Host addresses as strings, own addresses excluded.
+    """
+    try:
+        import ifaddr
+    except ImportError:
+        logger.info("ifaddr is not installed, skipping the subnet probe")
+        return []
+
+    hosts = []
+    for adapter in ifaddr.get_adapters():
+        for address in adapter.ips:
+            if not isinstance(address.ip, str) or \
+                    address.ip.startswith('127.'):
+                continue
+            prefix = max(address.network_prefix, max_prefix)
+            network = ipaddress.ip_network(
+                "{}/{}".format(address.ip, prefix), strict=False)
+            hosts.extend(str(host) for host in network.hosts()
+                         if str(host) != address.ip)
+    return hosts
+
+
+def probe_subnet(hosts, timeout=0.5, workers=64, stop=None):
+    """
+    Probes many hosts in parallel and returns the first bridge found.
+
+    Args:
+        hosts (list): Addresses to probe.
+        timeout (float, optional): Seconds to wait for each host.
+        workers (int, optional): Hosts probed at once.
+        stop (threading.Event, optional): Ends the probe early when set.
+
+    Returns:
+        str: The address of the first bridge found, otherwise None.
+    """
+    stop = stop or threading.Event()
+
+    def probe(host):
+        if stop.is_set():
+            return None
+        # A quick TCP connect weeds out the many addresses nobody
+        # answers on before an HTTP request is made.
+        try:
+            socket.create_connection((host, 80), timeout=timeout).close()
+        except OSError:
+            return None
+        return host if probe_bridge(host, timeout) else None
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        pending = {pool.submit(probe, host) for host in hosts}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.result():
+                    stop.set()
+                    return future.result()
+    finally:
+        # Probes still running end on their own timeout.
+        pool.shutdown(wait=False, cancel_futures=True)
+    return None
+
+
+def discover_bridge(cached_ip=None, cached_timeout=0.5, timeout=5.0):
+    """
+    Finds the bridge as fast as possible.
+
+    The cached address is tried first with a short timeout. When it
+    does not answer, mDNS discovery and a probe of the local subnets
+    run at the same time and the first to find a bridge wins.
+
+    Args:
+        cached_ip (str, optional): The address that worked last time.
+        cached_timeout (float, optional): Seconds to wait for the
+                                          cached address.
+        timeout (float, optional): Seconds to search for in total.
+
+    Returns:
+        str: The address of the bridge, or None if none was found.
+    """
+    if cached_ip and probe_bridge(cached_ip, cached_timeout):
+        return cached_ip
+
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=2)
+    searches = {pool.submit(discover_mdns, timeout, stop),
+                pool.submit(probe_subnet, local_subnet_hosts(), stop=stop)}
+    deadline = time.monotonic() + timeout
+    found = None
+    try:
+        while searches and found is None:
+            done, searches = wait(searches, deadline - time.monotonic(),
+                                  return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                found = found or future.result()
+    finally:
+        stop.set()
+        pool.shutdown(wait=False)
+    return found
+
+
+def bootstrap_controller(controller, timer=None):
+    """
+    Connects a HueController created with connect=False, finding the
+    bridge first when the cached address no longer answers. A new
+    address and username are written back to the configuration.
+
+    Args:
+        controller (HueController): The controller to connect.
+        timer (StartupTimer, optional): Marks "bridge found" and
+                                        "connected".
+
+    Raises:
+        ConnectionError: If no bridge could be found.
+    """
+    config = controller.config
+    bridge_ip = discover_bridge(
+        controller.bridge_ip,
+        **config.get_setting("discovery", {}))
+    if bridge_ip is None:
+        raise ConnectionError("No Philips Hue Bridge found")
+    if timer:
+        timer.mark("bridge found")
+
+    controller.connect(bridge_ip)
+    if timer:
+        timer.mark("connected")
+
+    if config.get_setting("bridge_ip") != controller.bridge_ip or \
+            config.get_setting("bridge_username") != controller.username:
+        config.set_setting("bridge_ip", controller.bridge_ip)
+        config.set_setting("bridge_username", controller.username)
+        config.save()
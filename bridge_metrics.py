@@ -0,0 +1,256 @@
+import bisect
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Light and group IDs are numbers, scene IDs long generated strings.
+_ID = re.compile(r'^\d+$|^[0-9A-Za-z-]{15,}$')
+
+
+def endpoint_name(mode, address, username=None):
+    """
+    Reduces a request to the endpoint it calls, so requests for
+    different lights or groups are counted together.
+
+    Args:
+        mode (str): The HTTP method.
+        address (str): The requested path, e.g. "/api/<user>/lights/3/state".
+        username (str, optional): The API username to strip.
+
+    Returns:
+        str: e.g. "PUT /lights/{id}/state".
+    """
+    parts = [part for part in (address or '').split('/') if part]
+    if parts and parts[0] == 'api':
+        parts = parts[1:]
+    if parts and parts[0] == username:
+        parts = parts[1:]
+    return "{} /{}".format(mode, '/'.join(
+        '{id}' if _ID.match(part) else part for part in parts))
+
+
+class _Endpoint:
+    __slots__ = ('requests', 'failures', 'latency_sum', 'buckets')
+
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.latency_sum = 0.0
+        # One count per bucket plus one for slower requests.
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+
+class BridgeMetrics:
+    """
+    BridgeMetrics records every request sent to the bridge: counters
+    and a latency histogram per endpoint, the error types the bridge
+    answered with, and gauges such as the dispatcher queue depth.
+
+    The controller only calls record() while metrics are enabled, a
+    disabled controller pays for a single attribute check per request.
+
+    Attributes:
+    - started (float): time.time() when recording started.
+
+    Methods:
+    - add_gauge: Registers a value read whenever metrics are exported.
+    - record: Records a finished request.
+    - timed: Sends a request through a callable and records it.
+    - snapshot: Returns all metrics as a dict.
+    - prometheus_text: Returns all metrics in Prometheus text format.
+    - serve: Serves the Prometheus text over HTTP.
+    - close: Stops the HTTP server.
+    """
+    def __init__(self, username=None):
+        """
+        Args:
+            username (str, optional): The API username, stripped from
+                                      endpoint names.
+        """
+        self.username = username
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._errors = {}
+        self._gauges = {}
+        self._server = None
+
+    def add_gauge(self, name, read):
+        """
+        Registers a value that is read whenever metrics are exported.
+
+        Args:
+            name (str): Name of the gauge, e.g. "dispatcher_pending".
+            read (callable): Returns the current value.
+        """
+        self._gauges[name] = read
+
+    def record(self, mode, address, latency, response=None, error=None):
+        """
+        Records a finished request.
+
+        Args:
+            mode (str): The HTTP method.
+            address (str): The requested path.
+            latency (float): Seconds the request took.
+            response (optional): The decoded bridge response. Error
+                    entries in it are counted by type, e.g. 201 for a
+                    light that is off or 901 for an overloaded bridge.
+            error (Exception, optional): The exception the request
+                                         raised, if it failed.
+        """
+        endpoint = endpoint_name(mode, address, self.username)
+        codes = []
+        if error is not None:
+            codes.append(type(error).__name__)
+        elif isinstance(response, list):
+            codes.extend(item['error'].get('type') for item in response
+                         if isinstance(item, dict) and 'error' in item)
+
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = _Endpoint()
+            stats.requests += 1
+            stats.latency_sum += latency
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+            if codes:
+                stats.failures += 1
+            for code in codes:
+                key = (endpoint, str(code))
+                self._errors[key] = self._errors.get(key, 0) + 1
+
+    def timed(self, send, mode, address, data=None):
+        """
+        Sends a request through a callable and records it.
+
+        Args:
+            send (callable): Called as send(mode, address, data).
+            mode (str): The HTTP method.
+            address (str): The requested path.
+            data (dict, optional): The request body.
+
+        Returns:
+            The response returned by send.
+        """
+        start = time.perf_counter()
+        try:
+            response = send(mode, address, data)
+        except Exception as error:
+            self.record(mode, address, time.perf_counter() - start,
+                        error=error)
+            raise
+        self.record(mode, address, time.perf_counter() - start, response)
+        return response
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: "endpoints" maps each endpoint to its requests,
+                  failures, mean latency in ms and histogram buckets,
+                  "errors" maps (endpoint, error type) to a count and
+                  "gauges" holds the current gauge values.
+        """
+        with self._lock:
+            endpoints = {
+                endpoint: {
+                    'requests': stats.requests,
+                    'failures': stats.failures,
+                    'mean_ms': stats.latency_sum * 1000 / stats.requests,
+                    'buckets': dict(zip(LATENCY_BUCKETS + (float('inf'),),
+                                        stats.buckets))
+                }
+                for endpoint, stats in self._endpoints.items()}
+            errors = dict(self._errors)
+        gauges = {name: read() for name, read in self._gauges.items()}
+        return {'endpoints': endpoints, 'errors': errors, 'gauges': gauges,
+                'uptime': time.time() - self.started}
+
+    def prometheus_text(self):
+        """
+        Returns:
+            str: All metrics in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = ["# TYPE lumen_bridge_requests_total counter",
+                 "# TYPE lumen_bridge_failures_total counter",
+                 "# TYPE lumen_bridge_request_seconds histogram"]
+        for endpoint, stats in sorted(snapshot['endpoints'].items()):
+            label = 'endpoint="{}"'.format(endpoint)
+            lines.append('lumen_bridge_requests_total{{{}}} {}'.format(
+                label, stats['requests']))
+            lines.append('lumen_bridge_failures_total{{{}}} {}'.format(
+                label, stats['failures']))
+            cumulative = 0
+            for bound, count in stats['buckets'].items():
+                cumulative += count
+                lines.append(
+                    'lumen_bridge_request_seconds_bucket{{{},le="{}"}} {}'
+                    .format(label, '+Inf' if bound == float('inf')
+                            else bound, cumulative))
+            lines.append('lumen_bridge_request_seconds_sum{{{}}} {:.6f}'
+                         .format(label,
+                                 stats['mean_ms'] * stats['requests'] / 1000))
+            lines.append('lumen_bridge_request_seconds_count{{{}}} {}'
+                         .format(label, stats['requests']))
+
+        lines.append("# TYPE lumen_bridge_errors_total counter")
+        for (endpoint, code), count in sorted(snapshot['errors'].items()):
+            lines.append('lumen_bridge_errors_total{{endpoint="{}",type="{}"}}'
+                         ' {}'.format(endpoint, code, count))
+
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append("# TYPE lumen_{} gauge".format(name))
+            lines.append("lumen_{} {}".format(name, value))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9464, host='127.0.0.1'):
+        """
+        Serves the metrics in Prometheus text format on /metrics from a
+        background thread.
+
+        Args:
+            port (int, optional): Port to listen on. Defaults to 9464.
+            host (str, optional): Address to listen on.
+                                  Defaults to "127.0.0.1".
+
+        Returns:
+            tuple: The (host, port) the server listens on.
+        """
+        if self._server is None:
+            self._server = ThreadingHTTPServer((host, port),
+                                               _MetricsHandler)
+            self._server.daemon_threads = True
+            self._server.metrics = self
+            threading.Thread(target=self._server.serve_forever,
+                             name="BridgeMetrics", daemon=True).start()
+        return self._server.server_address[:2]
+
+    def close(self):
+        """
+        Stops the HTTP server, if serving.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        data = self.server.metrics.prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,178 @@
+import http.client
+import json
+import queue
+import threading
+import time
+
+class Transport:
+    """
+    Transport sends JSON requests to the Philips Hue Bridge REST API.
+
+    This base transport opens a new HTTP connection for every request,
+    the same way phue does. PooledTransport keeps connections alive
+    and reuses them.
+
+    Failed requests are retried with exponential backoff. POST requests
+    are not retried since they create resources on the bridge. Only a
+    reused connection the bridge has reset or closed is retried at once
+    on a fresh one, a timeout is left to the backoff.
+
+    Attributes:
+    - host (str): Address of the bridge, optionally with ":port".
+    - timeout (float): Seconds to wait for the bridge per request.
+    - retries (int): Number of retries after a failed request.
+    - backoff (float): Seconds to wait before the first retry, doubled
+                       for every retry after that.
+
+    Methods:
+    - request: Sends a request and returns the decoded JSON response.
+    - close: Closes any open connections.
+    """
+    HEADERS = {'Content-Type': 'application/json'}
+
+    def __init__(self, host, timeout=5.0, retries=2, backoff=0.2):
+        """
+        Initializes the Transport.
+
+        Args:
+            host (str): Address of the bridge, optionally with ":port".
+            timeout (float, optional): Seconds to wait per request.
+                                       Defaults to 5.0.
+            retries (int, optional): Retries after a failed request.
+                                     Defaults to 2.
+            backoff (float, optional): Seconds before the first retry.
+                                       Defaults to 0.2.
+        """
+        self.host = host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+    def request(self, mode='GET', address=None, data=None):
+        """
+        Sends a request to the bridge.
+
+        Args:
+            mode (str, optional): The HTTP method. Defaults to "GET".
+            address (str): The path of the resource, e.g.
+                           "/api/<username>/lights".
+            data (dict, optional): Body sent as JSON with PUT and POST.
+
+        Returns:
+            The decoded JSON response.
+
+        Raises:
+            OSError, http.client.HTTPException: When the bridge could
+                not be reached after all retries.
+        """
+        body = json.dumps(data) if data is not None else None
+        attempt = 0
+        while True:
+            connection, reused = self._acquire()
+            try:
+                connection.request(mode, address, body, self.HEADERS)
+                response = connection.getresponse()
+                payload = response.read()
+            except (OSError, http.client.HTTPException) as error:
+                connection.close()
+                self._discard()
+                if reused and isinstance(error, (ConnectionResetError,
+                                                 BrokenPipeError)):
+                    # The bridge closed an idle keep-alive connection,
+                    # retry at once on a fresh one. RemoteDisconnected
+                    # is a ConnectionResetError.
+                    continue
+                if attempt >= self.retries or mode == 'POST':
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+                continue
+
+            self._release(connection, response)
+            return json.loads(payload.decode('utf-8'))
+
+    def close(self):
+        """
+        Closes any open connections.
+        """
+
+    def _connect(self):
+        return http.client.HTTPConnection(self.host, timeout=self.timeout)
+
+    def _acquire(self):
+        """
+        Returns:
+            tuple: (connection, reused) where reused tells whether the
+                   connection has served a request before.
+        """
+        return self._connect(), False
+
+    def _release(self, connection, response):
+        connection.close()
+
+    def _discard(self):
+        """
+        Called after a broken connection has been closed.
+        """
+
+
+class PooledTransport(Transport):
+    """
+    PooledTransport keeps HTTP/1.1 connections to the bridge alive and
+    reuses them, saving the TCP setup on every command.
+
+    At most pool_size connections exist at once. Callers beyond that
+    wait for a connection to be released.
+
+    Attributes:
+    - pool_size (int): Maximum number of connections to the bridge.
+    """
+    def __init__(self, host, timeout=5.0, retries=2, backoff=0.2,
+                 pool_size=4):
+        """
+        Initializes the PooledTransport.
+
+        Args:
+            host (str): Address of the bridge, optionally with ":port".
+            timeout (float, optional): Seconds to wait per request.
+                                       Defaults to 5.0.
+            retries (int, optional): Retries after a failed request.
+                                     Defaults to 2.
+            backoff (float, optional): Seconds before the first retry.
+                                       Defaults to 0.2.
+            pool_size (int, optional): Maximum number of connections.
+                                       Defaults to 4.
+        """
+        super().__init__(host, timeout, retries, backoff)
+        self.pool_size = pool_size
+        # Most recently used connections first, they are the least
+        # likely to have been closed by the bridge.
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def close(self):
+        """
+        Closes all idle connections.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._connect(), False
+
+    def _release(self, connection, response):
+        if response.will_close:
+            connection.close()
+        else:
+            self._idle.put(connection)
+        self._slots.release()
+
+    def _discard(self):
+        self._slots.release()
@@ -0,0 +1,325 @@
+import numpy as np
+
+# Color gamut triangles (red, green, blue corners in CIE xy) of the
+# three generations of Philips Hue lights.
+GAMUTS = {
+    'A': ((0.704, 0.296), (0.2151, 0.7106), (0.138, 0.08)),
+    'B': ((0.675, 0.322), (0.409, 0.518), (0.167, 0.04)),
+    'C': ((0.6915, 0.3083), (0.17, 0.7), (0.1532, 0.0475)),
+}
+
+# D65 white point, used for black where xy is undefined.
+WHITE_POINT = (0.3127, 0.3290)
+
+# Wide gamut RGB D65 to XYZ, as recommended by Philips for Hue lights.
+RGB_TO_XYZ = np.array([[0.664511, 0.154324, 0.162028],
+                       [0.283881, 0.668433, 0.047685],
+                       [0.000088, 0.072310, 0.986039]])
+XYZ_TO_RGB = np.linalg.inv(RGB_TO_XYZ)
+
+MAX_BRIGHTNESS = 254
+
+
+def srgb_to_linear(rgb):
+    """
+    Removes the sRGB gamma from color values in 0.0 to 1.0.
+    """
+    rgb = np.asarray(rgb, dtype=np.float64)
+    return np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4,
+                    rgb / 12.92)
+
+
+def linear_to_srgb(rgb):
+    """
+    Applies the sRGB gamma to linear color values in 0.0 to 1.0.
+    """
+    rgb = np.clip(rgb, 0.0, 1.0)
+    return np.where(rgb <= 0.0031308, rgb * 12.92,
+                    1.055 * rgb ** (1 / 2.4) - 0.055)
+
+
+def hsv_to_rgb(hsv):
+    """
+    Converts HSV colors to RGB.
+
+    Args:
+        hsv (array): Shape (..., 3), hue, saturation and value each in
+                     0.0 to 1.0.
+
+    Returns:
+        ndarray: Shape (..., 3), red, green and blue in 0.0 to 1.0.
+    """
+    hsv = np.asarray(hsv, dtype=np.float64)
+    h, s, v = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    sector = np.floor(h * 6.0)
+    f = h * 6.0 - sector
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    sector = sector.astype(np.int64) % 6
+
+    # Per sector, which of v, t, p and q each channel takes.
+    choices = np.stack([v, q, p, p, t, v], axis=-1), \
+        np.stack([t, v, v, q, p, p], axis=-1), \
+        np.stack([p, p, t, v, v, q], axis=-1)
+    index = sector[..., np.newaxis]
+    return np.stack([np.take_along_axis(channel, index, axis=-1)[..., 0]
+                     for channel in choices], axis=-1)
+
+
+def kelvin_to_xy(kelvin):
+    """
+    Finds the CIE xy of black body light at a color temperature, using
+    the cubic approximation of the Planckian locus by Kim et al.
+
+    Args:
+        kelvin (array): Color temperatures, clipped to 1667-25000 K.
+
+    Returns:
+        ndarray: Shape (..., 2), the xy coordinates.
+    """
+    t = np.clip(np.asarray(kelvin, dtype=np.float64), 1667.0, 25000.0)
+    x = np.where(t <= 4000.0,
+                 -0.2661239e9 / t ** 3 - 0.2343589e6 / t ** 2
+                 + 0.8776956e3 / t + 0.179910,
+                 -3.0258469e9 / t ** 3 + 2.1070379e6 / t ** 2
+                 + 0.2226347e3 / t + 0.240390)
+    y = np.select(
+        [t <= 2222.0, t <= 4000.0],
+        [-1.1063814 * x ** 3 - 1.34811020 * x ** 2
+         + 2.18555832 * x - 0.20219683,
+         -0.9549476 * x ** 3 - 1.37418593 * x ** 2
+         + 2.09137015 * x - 0.16748867],
+        3.0817580 * x ** 3 - 5.87338670 * x ** 2
+        + 3.75112997 * x - 0.37001483)
+    return np.stack([x, y], axis=-1)
+
+
+def kelvin_to_mirek(kelvin):
+    """
+    Converts color temperatures to the mirek values used by the bridge
+    ("ct"), limited to the 153-500 range Hue lights support.
+    """
+    mirek = 1e6 / np.asarray(kelvin, dtype=np.float64)
+    return np.clip(np.rint(mirek), 153, 500).astype(np.uint16)
+
+
+def clamp_to_gamut(xy, gamut='C'):
+    """
+    Moves xy coordinates outside a gamut triangle to the nearest point
+    on its edge. Coordinates inside are left unchanged.
+
+    Args:
+        xy (array): Shape (..., 2), the xy coordinates.
+        gamut (str, optional): "A", "B" or "C". Defaults to "C".
+
+    Returns:
+        ndarray: Shape (..., 2), coordinates the lights can show.
+    """
+    xy = np.asarray(xy, dtype=np.float64)
+    corners = np.asarray(GAMUTS[gamut])
+    starts = corners
+    ends = np.roll(corners, -1, axis=0)
+    edges = ends - starts
+
+    # Inside when on the same side of all three edges.
+    relative = xy[..., np.newaxis, :] - starts
+    cross = edges[:, 0] * relative[..., 1] - edges[:, 1] * relative[..., 0]
+    inside = np.all(cross >= 0, axis=-1) | np.all(cross <= 0, axis=-1)
+
+    # Closest point on each edge, then the closest of the three.
+    t = np.clip(np.sum(relative * edges, axis=-1)
+                / np.sum(edges * edges, axis=-1), 0.0, 1.0)
+    points = starts + t[..., np.newaxis] * edges
+    distances = np.sum((points - xy[..., np.newaxis, :]) ** 2, axis=-1)
+    nearest = np.take_along_axis(
+        points, np.argmin(distances, axis=-1)[..., np.newaxis, np.newaxis],
+        axis=-2)[..., 0, :]
+    return np.where(inside[..., np.newaxis], xy, nearest)
+
+
+def rgb_to_xy(rgb, gamut='C'):
+    """
+    Converts sRGB colors to CIE xy and bridge brightness.
+
+    Args:
+        rgb (array): Shape (..., 3), red, green and blue in 0.0 to 1.0.
+        gamut (str, optional): Gamut to clamp to, "A", "B" or "C", or
+                               None to skip clamping. Defaults to "C".
+
+    Returns:
+        tuple: (xy, bri) with xy of shape (..., 2) and bri of shape
+               (...) as integers from 0 to 254.
+    """
+    xyz = srgb_to_linear(rgb) @ RGB_TO_XYZ.T
+    total = xyz.sum(axis=-1)
+    dark = total <= 0
+    safe_total = np.where(dark, 1.0, total)
+    xy = np.stack([xyz[..., 0] / safe_total, xyz[..., 1] / safe_total],
+                  axis=-1)
+    xy = np.where(dark[..., np.newaxis], WHITE_POINT, xy)
+    if gamut is not None:
+        xy = clamp_to_gamut(xy, gamut)
+    bri = np.rint(np.clip(xyz[..., 1], 0.0, 1.0) * MAX_BRIGHTNESS)
+    return xy, bri.astype(np.uint8)
+
+
+def xy_to_rgb(xy, bri=MAX_BRIGHTNESS):
+    """
+    Converts CIE xy and bridge brightness back to sRGB, e.g. to show
+    a light's color on screen.
+
+    Args:
+        xy (array): Shape (..., 2), the xy coordinates.
+        bri (array, optional): Brightness from 0 to 254.
+
+    Returns:
+        ndarray: Shape (..., 3), red, green and blue in 0.0 to 1.0.
+    """
+    xy = np.asarray(xy, dtype=np.float64)
+    x, y = xy[..., 0], np.maximum(xy[..., 1], 1e-6)
+    luminance = np.asarray(bri, dtype=np.float64) / MAX_BRIGHTNESS
+    xyz = np.stack([x / y, np.ones_like(x), (1.0 - x - y) / y], axis=-1)
+    rgb = np.clip(xyz @ XYZ_TO_RGB.T, 0.0, None)
+    # Scale so the strongest channel is fully on, then dim by brightness.
+    peak = np.maximum(rgb.max(axis=-1, keepdims=True), 1e-6)
+    return linear_to_srgb(rgb / peak * luminance[..., np.newaxis])
+
+
+def to_hex(rgb):
+    """
+    Formats a single RGB color as a Tk color string.
+
+    Args:
+        rgb (array): Red, green and blue in 0.0 to 1.0.
+
+    Returns:
+        str: The color as "#rrggbb".
+    """
+    red, green, blue = np.rint(np.clip(rgb, 0.0, 1.0) * 255).astype(int)
+    return "#{:02x}{:02x}{:02x}".format(red, green, blue)
+
+
+def parse_hex(color):
+    """
+    Args:
+        color (str): A color as "#rrggbb".
+
+    Returns:
+        ndarray: Red, green and blue in 0.0 to 1.0.
+    """
+    value = color.lstrip('#')
+    return np.array([int(value[i:i + 2], 16) for i in (0, 2, 4)]) / 255.0
+
+
+class ColorEngine:
+    """
+    ColorEngine converts whole arrays of colors for a light gamut at
+    once, so effects and scenes can compute hundreds of light colors
+    per frame without a Python loop per light.
+
+    8-bit RGB colors are looked up in a table precomputed for every
+    color at a reduced bit depth, and color temperatures in a table
+    covering every 10 kelvin.
+
+    Attributes:
+    - gamut (str): The gamut colors are clamped to, "A", "B" or "C".
+    - lut_bits (int): Bits per channel of the RGB lookup table.
+
+    Methods:
+    - rgb_to_xy: Converts RGB floats to xy and brightness.
+    - hsv_to_xy: Converts HSV floats to xy and brightness.
+    - kelvin_to_xy: Converts color temperatures to xy.
+    - lookup_rgb8: Converts 8-bit RGB colors using the lookup table.
+    - preview_color: Returns the Tk color showing an xy and brightness.
+    """
+    KELVIN_MIN = 1000
+    KELVIN_MAX = 12000
+    KELVIN_STEP = 10
+
+    def __init__(self, gamut='C', lut_bits=6):
+        """
+        Initializes the ColorEngine and precomputes its lookup tables.
+
+        Args:
+            gamut (str, optional): "A", "B" or "C". Defaults to "C".
+            lut_bits (int, optional): Bits per channel of the RGB lookup
+                    table, 6 makes 262144 entries. Defaults to 6.
+        """
+        self.gamut = gamut
+        self.lut_bits = lut_bits
+
+        levels = np.arange(1 << lut_bits) / ((1 << lut_bits) - 1)
+        grid = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'),
+                        axis=-1).reshape(-1, 3)
+        xy, bri = rgb_to_xy(grid, gamut)
+        self._rgb_xy = xy.astype(np.float32)
+        self._rgb_bri = bri
+
+        kelvin = np.arange(self.KELVIN_MIN, self.KELVIN_MAX + 1,
+                           self.KELVIN_STEP)
+        self._kelvin_xy = clamp_to_gamut(kelvin_to_xy(kelvin),
+                                         gamut).astype(np.float32)
+
+    def rgb_to_xy(self, rgb):
+        """
+        Args:
+            rgb (array): Shape (..., 3), values in 0.0 to 1.0.
+
+        Returns:
+            tuple: (xy, bri), see rgb_to_xy().
+        """
+        return rgb_to_xy(rgb, self.gamut)
+
+    def hsv_to_xy(self, hsv):
+        """
+        Args:
+            hsv (array): Shape (..., 3), values in 0.0 to 1.0.
+
+        Returns:
+            tuple: (xy, bri), see rgb_to_xy().
+        """
+        return rgb_to_xy(hsv_to_rgb(hsv), self.gamut)
+
+    def kelvin_to_xy(self, kelvin):
+        """
+        Args:
+            kelvin (array): Color temperatures in kelvin.
+
+        Returns:
+            ndarray: Shape (..., 2), xy within the gamut.
+        """
+        index = np.rint((np.clip(kelvin, self.KELVIN_MIN, self.KELVIN_MAX)
+                         - self.KELVIN_MIN) / self.KELVIN_STEP)
+        return self._kelvin_xy[index.astype(np.intp)]
+
+    def lookup_rgb8(self, rgb8):
+        """
+        Converts 8-bit RGB colors with the lookup table, trading a
+        little precision for speed.
+
+        Args:
+            rgb8 (array): Shape (..., 3), unsigned 8-bit channels.
+
+        Returns:
+            tuple: (xy, bri) with xy as float32.
+        """
+        shift = 8 - self.lut_bits
+        rgb = np.asarray(rgb8, dtype=np.intp) >> shift
+        index = (rgb[..., 0] << (2 * self.lut_bits)) \
+            | (rgb[..., 1] << self.lut_bits) | rgb[..., 2]
+        return self._rgb_xy[index], self._rgb_bri[index]
+
+    def preview_color(self, xy, bri=MAX_BRIGHTNESS):
+        """
+        Returns the Tk color showing a light's xy and brightness as
+        closely as a screen can.
+
+        Args:
+            xy (sequence): The x and y coordinates.
+            bri (int, optional): Brightness from 0 to 254.
+
+        Returns:
+            str: The color as "#rrggbb".
+        """
+        return to_hex(xy_to_rgb(clamp_to_gamut(xy, self.gamut), bri))
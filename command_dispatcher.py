@@ -0,0 +1,278 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from rate_limiter import BridgeOverloadError
+
+logger = logging.getLogger(__name__)
+
+class _Command:
+    __slots__ = ('settings', 'rank', 'futures', 'attempts')
+
+    def __init__(self, settings, rank, future):
+        self.settings = settings
+        self.rank = rank
+        self.futures = [future]
+        self.attempts = 0
+
+
+class CommandDispatcher:
+    """
+    CommandDispatcher coalesces light and group commands and sends them
+    to the bridge from a background thread at a bridge safe rate.
+
+    Only the newest pending state per target is kept (last write wins).
+    A command submitted while an older one for the same target is still
+    waiting is folded into it, so a slider drag producing dozens of
+    events ends up as a handful of bridge requests.
+
+    Every command has a priority class, see RateLimiter. The most
+    urgent ready command is sent first, the oldest among equals, so a
+    click goes out before the commands an effect queued earlier. A
+    command refused because the bridge is overloaded is queued again,
+    unless a newer state for its target replaced it meanwhile.
+
+    Attributes:
+    - MAX_ATTEMPTS (int): Times a command is sent to an overloaded
+                          bridge before it fails.
+    - sent (int): Number of commands delivered to the bridge.
+    - merged (int): Number of submissions folded into a pending command
+                    that still carried other attributes.
+    - dropped (int): Number of pending commands fully replaced by a
+                     newer submission before they were sent.
+    - retried (int): Number of commands queued again after the bridge
+                     was overloaded.
+    - failed (int): Number of commands that raised while being sent.
+
+    Methods:
+    - submit: Queues a state for a target without blocking.
+    - pending: Number of targets waiting to be sent.
+    - stats: Returns the dispatcher counters.
+    - flush: Waits until every pending command is sent.
+    - stop: Stops the background thread.
+    """
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, send, rate_limiter):
+        """
+        Initializes the CommandDispatcher and starts its worker thread.
+
+        Args:
+            send (callable): Called as send(kind, target_id, settings)
+                             to deliver a command to the bridge.
+            rate_limiter (RateLimiter): Decides when the next command
+                                        of a kind may be sent.
+        """
+        self._send = send
+        self._rate_limiter = rate_limiter
+        self._ranks = {priority: rank for rank, priority in
+                       enumerate(rate_limiter.PRIORITIES)}
+
+        # (kind, str(target_id)) -> _Command, oldest submission first
+        self._pending = OrderedDict()
+        self._in_flight = 0
+        self._running = True
+        self._condition = threading.Condition()
+
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.retried = 0
+        self.failed = 0
+
+        self._thread = threading.Thread(target=self._run,
+                                        name="CommandDispatcher",
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, kind, target_id, settings, priority="normal"):
+        """
+        Queues a state for a light or group. Returns immediately.
+
+        Args:
+            kind (str): "light" or "group".
+            target_id (int): The ID of the light or group, as a number
+                             or a string. It is handed to send as a
+                             string.
+            settings (dict): Bridge state attributes to apply.
+            priority (str, optional): "user", "normal" or "background".
+                                      Defaults to "normal".
+
+        Returns:
+            Future: Resolves to the bridge response once the state, or
+                    a newer one it was folded into, reached the bridge.
+        """
+        # 0 from a slider and "0" from the GUI are the same group.
+        key = (kind, str(target_id))
+        future = Future()
+        with self._condition:
+            if not self._running:
+                future.cancel()
+                return future
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = _Command(dict(settings),
+                                              self._ranks[priority], future)
+            else:
+                # Transition time always follows the newest command so
+                # it is left out when deciding if anything was replaced.
+                old_keys = set(pending.settings) - {'transitiontime'}
+                new_keys = set(settings) - {'transitiontime'}
+                if old_keys <= new_keys:
+                    self.dropped += 1
+                else:
+                    self.merged += 1
+                pending.settings.update(settings)
+                pending.rank = min(pending.rank, self._ranks[priority])
+                pending.futures.append(future)
+            self._condition.notify_all()
+        return future
+
+    def pending(self):
+        """
+        Returns:
+            int: Number of targets with a command waiting to be sent.
+        """
+        with self._condition:
+            return len(self._pending)
+
+    def stats(self):
+        """
+        Returns:
+            dict: The sent, merged, dropped, retried and failed counters
+                  together with the number of pending targets.
+        """
+        with self._condition:
+            return {
+                'sent': self.sent,
+                'merged': self.merged,
+                'dropped': self.dropped,
+                'retried': self.retried,
+                'failed': self.failed,
+                'pending': len(self._pending)
+            }
+
+    def flush(self, timeout=None):
+        """
+        Blocks until all pending commands have been sent.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait.
+
+        Returns:
+            bool: True if the queue drained, False on timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._in_flight, timeout)
+
+    def stop(self):
+        """
+        Stops the worker thread. Commands still pending are discarded
+        and their futures cancelled.
+        """
+        with self._condition:
+            self._running = False
+            pending, self._pending = self._pending, OrderedDict()
+            self._condition.notify_all()
+        for command in pending.values():
+            for future in command.futures:
+                future.cancel()
+        self._thread.join()
+
+    def _next_ready(self):
+        """
+        Picks the most urgent pending command whose endpoint kind is
+        allowed to send, the oldest among equally urgent ones. Must be
+        called with the condition held.
+
+        Returns:
+            tuple: (key, command, wait) where wait is the time to sleep
+                   when nothing is ready yet.
+        """
+        wait = None
+        best = None
+        for key, command in self._pending.items():
+            if best is not None and command.rank >= best[1].rank:
+                continue
+            delay = self._rate_limiter.delay(
+                key[0], self._rate_limiter.PRIORITIES[command.rank])
+            if delay <= 0:
+                best = (key, command)
+                if command.rank == 0:
+                    break
+            else:
+                wait = delay if wait is None else min(wait, delay)
+        if best is None:
+            return None, None, wait
+        del self._pending[best[0]]
+        return best[0], best[1], None
+
+    def _requeue(self, key, command):
+        """
+        Queues a command refused by an overloaded bridge again, under
+        any newer state for the same target. Must be called with the
+        condition held.
+
+        Returns:
+            bool: False if it was sent too often and has to fail.
+        """
+        newer = self._pending.get(key)
+        if newer is not None:
+            command.settings.update(newer.settings)
+            command.rank = min(command.rank, newer.rank)
+            command.futures.extend(newer.futures)
+        elif command.attempts >= self.MAX_ATTEMPTS:
+            logger.warning("Bridge overloaded, giving up on %s %s", *key)
+            return False
+        self._pending[key] = command
+        # Retried ahead of commands submitted later.
+        self._pending.move_to_end(key, last=False)
+        self.retried += 1
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._running:
+                        return
+                    key, command, wait = self._next_ready()
+                    if key is not None:
+                        break
+                    self._condition.wait(wait)
+                self._rate_limiter.reserve(key[0])
+                self._in_flight += 1
+
+            kind, target_id = key
+            command.attempts += 1
+            error = response = None
+            try:
+                response = self._send(kind, target_id, command.settings)
+            except BridgeOverloadError as overloaded:
+                error = overloaded
+            except Exception as failure:
+                logger.exception("Failed to send %s %s", kind, target_id)
+                error = failure
+
+            with self._condition:
+                self._in_flight -= 1
+                if isinstance(error, BridgeOverloadError) and \
+                        self._running and self._requeue(key, command):
+                    futures = []
+                elif error is None:
+                    self.sent += 1
+                    futures = command.futures
+                else:
+                    self.failed += 1
+                    futures = command.futures
+                self._condition.notify_all()
+
+            for future in futures:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if error is None:
+                    future.set_result(response)
+                else:
+                    future.set_exception(error)
@@ -0,0 +1,100 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class CommandExecutor:
+    """
+    CommandExecutor runs bridge calls on a background worker so that
+    slow bridge responses never block the Tk main loop.
+
+    Every submitted call returns a concurrent.futures.Future. Calls may
+    be given a key, submitting a new call with the same key cancels the
+    previous one if it has not started yet, since its result would be
+    overwritten anyway.
+
+    Attributes:
+    - superseded (int): Number of calls cancelled by a newer call with
+                        the same key.
+
+    Methods:
+    - submit: Schedules a call and returns its future.
+    - shutdown: Stops the worker, cancelling calls not yet started.
+    """
+    def __init__(self, max_workers=1):
+        """
+        Initializes the CommandExecutor.
+
+        Args:
+            max_workers (int, optional): Number of worker threads.
+                    Defaults to 1 so commands reach the bridge in the
+                    order they were submitted.
+        """
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix="CommandExecutor")
+        self._latest = {}
+        # Reentrant since a future finishing before add_done_callback
+        # runs its callback right away, with the lock still held.
+        self._lock = threading.RLock()
+        self.superseded = 0
+
+    def submit(self, func, *args, key=None, **kwargs):
+        """
+        Schedules func(*args, **kwargs) on the worker.
+
+        Args:
+            func (callable): The call to run.
+            key (hashable, optional): Identifies what the call changes.
+                    A pending call with the same key is cancelled.
+
+        Returns:
+            Future: The future of the scheduled call.
+        """
+        with self._lock:
+            future = self._pool.submit(func, *args, **kwargs)
+            if key is not None:
+                previous = self._latest.get(key)
+                if previous is not None and previous.cancel():
+                    self.superseded += 1
+                self._latest[key] = future
+                future.add_done_callback(
+                    lambda done: self._forget(key, done))
+        return future
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._latest.get(key) is future:
+                del self._latest[key]
+
+    def shutdown(self, wait=False):
+        """
+        Stops the worker and cancels every call not yet started.
+
+        Args:
+            wait (bool, optional): Wait for the running call to finish.
+                                   Defaults to False.
+        """
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+def call_when_done(widget, future, callback, interval=16):
+    """
+    Runs callback(future) on the Tk thread once the future is done.
+
+    Tk widgets may only be touched from the thread running the main
+    loop, so instead of calling back from the worker the future is
+    polled with widget.after() every interval milliseconds.
+
+    Args:
+        widget: Any Tk widget, used for its after() method.
+        future (Future): The future to wait for.
+        callback (callable): Called with the future when it is done,
+                             cancelled futures included.
+        interval (int, optional): Poll interval in milliseconds.
+                                  Defaults to 16, about one frame.
+    """
+    def poll():
+        if future.done():
+            callback(future)
+        else:
+            widget.after(interval, poll)
+
+    widget.after(interval, poll)
@@ -1,4 +1,11 @@
 import json
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
 
 class SingletonMeta(type):
     """A metaclass for the Singleton Pattern ensuring that only 
@@ -12,20 +19,127 @@ class SingletonMeta(type):
             cls._instances[cls] = instance
         return cls._instances[cls]
 
+class ConfigTables:
+    """
+    ConfigTables is an immutable, precompiled form of the configuration
+    used for fast lookups.
+
+    Attributes:
+    - data (dict): The configuration data the tables were built from.
+    - brightness_labels (tuple): Brightness label for every brightness
+                                 value from 0 to 254.
+    - brightness_levels (MappingProxyType): Label -> brightness.
+    - default_brightness (int): Brightness for unknown labels.
+    - color_coordinates (MappingProxyType): Color name -> (x, y).
+    - transition_times (MappingProxyType): Label -> transition time.
+    - errors (tuple): Problems found while validating the data.
+    """
+    __slots__ = ('data', 'brightness_labels', 'brightness_levels',
+                 'default_brightness', 'color_coordinates',
+                 'transition_times', 'errors')
+
+    MAX_BRIGHTNESS = 254
+
+    def __init__(self, data):
+        """
+        Compiles and validates configuration data.
+
+        Args:
+            data (dict): Parsed configuration data.
+        """
+        errors = []
+
+        levels = self._table(data, "brightness_levels", errors,
+                             lambda value: isinstance(value, int) and
+                             0 <= value <= self.MAX_BRIGHTNESS,
+                             "an integer from 0 to 254")
+        colors = self._table(data, "color_coordinates", errors,
+                             lambda value: isinstance(value, list) and
+                             len(value) == 2 and
+                             all(isinstance(c, (int, float)) and 0 <= c <= 1
+                                 for c in value),
+                             "a pair of numbers from 0 to 1")
+        transitions = self._table(data, "transition_times", errors,
+                                  lambda value: isinstance(value, int) and
+                                  value >= 0,
+                                  "a non-negative integer")
+
+        default_brightness = data.get("default_brightness")
+        if not isinstance(default_brightness, int):
+            errors.append("default_brightness must be an integer")
+        default_transition = data.get("default_transition_time")
+        if default_transition is not None and \
+                default_transition not in transitions:
+            errors.append("default_transition_time {!r} is not one of the "
+                          "transition_times".format(default_transition))
+
+        # Every slider value is mapped to the label of the highest 
+        # threshold it reaches, "NEUTRAL" below all of them.
+        thresholds = sorted(levels.items(), key=lambda item: item[1],
+                            reverse=True)
+        labels = []
+        for value in range(self.MAX_BRIGHTNESS + 1):
+            labels.append(next((label for label, threshold in thresholds
+                                if value >= threshold), "NEUTRAL"))
+
+        set_attribute = object.__setattr__
+        set_attribute(self, 'data', data)
+        set_attribute(self, 'brightness_labels', tuple(labels))
+        set_attribute(self, 'brightness_levels', MappingProxyType(levels))
+        set_attribute(self, 'default_brightness', default_brightness)
+        set_attribute(self, 'color_coordinates', MappingProxyType(
+            {name: tuple(xy) for name, xy in colors.items()}))
+        set_attribute(self, 'transition_times', MappingProxyType(transitions))
+        set_attribute(self, 'errors', tuple(errors))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ConfigTables is immutable")
+
+    def _table(self, data, key, errors, is_valid, expected):
+        """
+        Returns the valid entries of a label table, recording an error
+        for every invalid one.
+        """
+        table = data.get(key, {})
+        if not isinstance(table, dict):
+            errors.append("{} must be an object".format(key))
+            return {}
+        valid = {}
+        for label, value in table.items():
+            if is_valid(value):
+                valid[label] = value
+            else:
+                errors.append("{}.{} must be {}".format(key, label, expected))
+        return valid
+
+
 class ConfigManager(metaclass=SingletonMeta):
     """
     ConfigManager handles the application's configuration by loading 
     and fetching settings from a JSON file.
 
+    The configuration is compiled into ConfigTables when loaded, so
+    that lookups do not walk the nested JSON data. A reload builds new
+    tables and swaps them in with a single assignment, readers always
+    see either the old or the new configuration, never a mix.
+
     Attributes:
     - config_path (str): Path to the JSON configuration file.
     - config_data (dict): Parsed configuration data from the JSON file.
+    - tables (ConfigTables): The compiled configuration.
 
     Methods:
     - _load_config: Reads and parses the JSON configuration file.
+    - reload: Reloads the configuration file.
+    - watch: Reloads the configuration whenever the file changes.
+    - add_listener: Registers a callback for reloads.
+    - remove_listener: Removes a callback registered for reloads.
     - get_setting: Retrieves a setting value by key from config_data.
+    - set_setting: Changes a setting value by key in config_data.
+    - save: Writes config_data back to the JSON file.
     - get_color_coordinates: Gets coordinates for a specific color.
     - get_brightness: Fetches brightness level for a specific label.
+    - label_for_brightness: Finds the label for a brightness value.
     - get_transition_time: Retrieves transition time for a given label.
     """
     def __init__(self, config_path="config.json"):
@@ -39,7 +153,19 @@ class ConfigManager(metaclass=SingletonMeta):
                 Defaults to "config.json".
         """
         self.config_path = config_path
-        self.config_data = self._load_config()
+        self._mtime = None
+        self._watcher = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        self.tables = self._compile(self._load_config())
+
+    @property
+    def config_data(self):
+        """
+        Returns:
+            dict: The configuration data of the current tables.
+        """
+        return self.tables.data
 
     def _load_config(self):
         """
@@ -48,9 +174,94 @@ class ConfigManager(metaclass=SingletonMeta):
         Returns:
             dict: Parsed configuration data.
         """
+        self._mtime = os.stat(self.config_path).st_mtime_ns
         with open(self.config_path, 'r') as config_file:
             return json.load(config_file)
 
+    def _compile(self, data):
+        tables = ConfigTables(data)
+        for error in tables.errors:
+            logger.warning("%s: %s", self.config_path, error)
+        return tables
+
+    def reload(self):
+        """
+        Reloads the configuration file. A file that cannot be parsed is
+        reported and the current configuration is kept.
+
+        Lookups through the tables (labels, colors, transition times)
+        see the new configuration right away. Settings that were read
+        into other objects, such as the rate limits, the scenes or the
+        color gamut, are up to the listeners to apply.
+
+        Returns:
+            bool: True if the new configuration was swapped in.
+        """
+        try:
+            tables = self._compile(self._load_config())
+        except (OSError, ValueError) as error:
+            logger.warning("Keeping the current configuration: %s", error)
+            return False
+        self.tables = tables
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(tables)
+            except Exception:
+                logger.exception("Failed to apply the reloaded "
+                                 "configuration")
+        return True
+
+    def add_listener(self, callback):
+        """
+        Registers a callback for reloads of the configuration file.
+
+        Args:
+            callback (callable): Called as callback(tables) with the new
+                                 ConfigTables, from the thread that
+                                 reloaded.
+        """
+        with self._lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """
+        Removes a callback registered with add_listener.
+
+        Args:
+            callback (callable): The callback to remove.
+        """
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def watch(self, interval=1.0):
+        """
+        Starts a background thread reloading the configuration whenever
+        the modification time of the file changes.
+
+        Args:
+            interval (float, optional): Seconds between two checks.
+                                        Defaults to 1.0.
+        """
+        if self._watcher is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    mtime = os.stat(self.config_path).st_mtime_ns
+                except OSError:
+                    continue
+                if mtime != self._mtime:
+                    self.reload()
+
+        self._watcher = threading.Thread(target=run, name="ConfigWatcher",
+                                         daemon=True)
+        self._watcher.start()
+
     def get_setting(self, key, default=None):
         """
         Retrieves a setting's value using its key.
@@ -65,6 +276,42 @@ class ConfigManager(metaclass=SingletonMeta):
             value if the key is not present.
         """
         return self.config_data.get(key, default)
+
+    def set_setting(self, key, value):
+        """
+        Changes a setting's value. The change is kept in memory until
+        save() is called.
+
+        Args:
+            key (str): The key corresponding to the setting's value.
+            value: The new value, which must be JSON serializable.
+        """
+        data = dict(self.config_data)
+        data[key] = value
+        self.tables = self._compile(data)
+
+    def save(self):
+        """
+        Writes the configuration back to the JSON file.
+
+        The data is written to a temporary file first and then moved 
+        over the configuration, so a crash never leaves a half written
+        file behind.
+        """
+        # Only needed when saving, tempfile is slow to import.
+        import tempfile
+
+        directory = os.path.dirname(os.path.abspath(self.config_path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as config_file:
+                json.dump(self.config_data, config_file, indent=4)
+            os.replace(temp_path, self.config_path)
+            # Our own write is not a change to reload.
+            self._mtime = os.stat(self.config_path).st_mtime_ns
+        except BaseException:
+            os.unlink(temp_path)
+            raise
     
     def get_color_coordinates(self, color_name):
         """
@@ -76,7 +323,7 @@ class ConfigManager(metaclass=SingletonMeta):
         Returns:
             A value representing the coordinates of the color.
         """
-        return self.get_setting("color_coordinates").get(color_name)
+        return self.tables.color_coordinates.get(color_name)
 
     def get_brightness(self, label="NEUTRAL"):
         """
@@ -90,11 +337,25 @@ class ConfigManager(metaclass=SingletonMeta):
             int: Brightness level corresponding to the label or the
                  default brightness.
         """
-        #Using the ConfigManager to grab a value from JSON
-        brightness_levels = self.get_setting("brightness_levels", {})
+        tables = self.tables
         # Returns the default value if nothing specified
-        default_brightness = self.get_setting("default_brightness")
-        return brightness_levels.get(label, default_brightness) 
+        return tables.brightness_levels.get(label, tables.default_brightness)
+
+    def label_for_brightness(self, value):
+        """
+        Finds the brightness label for a brightness value, the label 
+        with the highest threshold the value reaches.
+
+        Args:
+            value (int): Brightness from 0 to 254, values outside are
+                         clamped to that range.
+
+        Returns:
+            str: The brightness label, "NEUTRAL" if the value is below
+                 every threshold.
+        """
+        value = min(max(int(value), 0), ConfigTables.MAX_BRIGHTNESS)
+        return self.tables.brightness_labels[value]
     
     def get_transition_time(self, label="SHORT"):
         """
@@ -108,7 +369,5 @@ class ConfigManager(metaclass=SingletonMeta):
             int: Transition time corresponding to the label or a 
             default value if not found.
         """
-        transition_times = self.get_setting("transition_times", {})
-        
-        # Defaults to return None if not found.
-        return transition_times.get(label, 0)
\ No newline at end of file
+        # Defaults to 0 (no transition) if not found.
+        return self.tables.transition_times.get(label, 0)
\ No newline at end of file
@@ -0,0 +1,784 @@
+"""
+A controller worker process that GUI, CLI, automation and effect
+front-ends attach to at the same time.
+
+The worker owns the HueController: the bridge connections, the state
+cache, the dispatcher and the rate limiter. Front-ends run in their own
+processes, so a CPU heavy effect no longer competes with the bridge
+I/O, or with a Tk loop, for one interpreter lock.
+
+Two channels connect a front-end to the worker:
+
+- The control channel is a multiprocessing.connection, authenticated
+  with a shared key. It carries small requests like ("set_power",
+  ("group", "1", True), {}) and their answers.
+- Frames, the per-light colors an effect produces many times a second,
+  go through a ring buffer in shared memory written by the front-end.
+  A frame is one fixed size slot of packed light states, nothing is
+  pickled. After writing a slot the front-end rings a doorbell on a
+  second connection, the worker then drains the ring and queues the
+  newest state of each light on the dispatcher.
+
+When the ring is full the newest frame is dropped, like the ambient
+pipeline drops frames it cannot keep up with, an effect is better off
+skipping a frame than falling behind.
+"""
+
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import (connection, get_context, resource_tracker,
+                             shared_memory)
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# One light of a frame. A transition of 0xFFFF means none is given.
+FRAME_ENTRY = np.dtype([('light', '<u4'), ('on', 'u1'), ('bri', 'u1'),
+                        ('transition', '<u2'), ('x', '<f4'), ('y', '<f4')])
+NO_TRANSITION = 0xFFFF
+
+
+class FrameRing:
+    """
+    FrameRing is a single producer, single consumer ring of frames in
+    shared memory.
+
+    The header holds the number of frames written (head), read (tail)
+    and dropped as 64 bit counters, each written by one side only. A
+    slot holds the time the frame was written, the number of lights in
+    it and up to max_lights FRAME_ENTRY records.
+
+    Attributes:
+    - name (str): The shared memory block, for attach().
+    - slots (int): Frames the ring holds.
+    - max_lights (int): Lights a frame holds.
+
+    Methods:
+    - attach: Opens a ring created by another process.
+    - write: Adds a frame, dropping it when the ring is full.
+    - read: Takes the oldest frame.
+    - depth: Returns the number of frames waiting.
+    - counters: Returns the written, read and dropped counters.
+    - close: Closes the shared memory, unlink removes it.
+    """
+    HEADER = 64
+    SLOT_HEADER = 16
+
+    def __init__(self, slots=8, max_lights=64, name=None, untrack=True):
+        """
+        Creates a ring, or opens one when a name is given.
+
+        Args:
+            slots (int, optional): Frames the ring holds. Defaults to 8.
+            max_lights (int, optional): Lights a frame holds. Defaults
+                                        to 64.
+            name (str, optional): Open this existing ring instead,
+                                  see attach().
+            untrack (bool, optional): See attach().
+        """
+        if name is None:
+            size = self.HEADER + slots * self._slot_size(max_lights)
+            self._memory = shared_memory.SharedMemory(create=True, size=size)
+            self._owner = True
+        else:
+            self._memory = shared_memory.SharedMemory(name=name)
+            self._owner = False
+            # Python < 3.13 registers an attached block with the
+            # resource tracker, which would remove it when this process
+            # ends although the creator still uses it.
+            if untrack and os.name == 'posix':
+                resource_tracker.unregister(self._memory._name,
+                                            'shared_memory')
+
+        buffer = self._memory.buf
+        self._counters = np.ndarray(3, dtype='<u8', buffer=buffer)
+        self._shape = np.ndarray(2, dtype='<u4', buffer=buffer, offset=24)
+        if name is None:
+            self._counters[:] = 0
+            self._shape[:] = (slots, max_lights)
+        self.name = self._memory.name
+        self.slots, self.max_lights = (int(value) for value in self._shape)
+
+        slot_size = self._slot_size(self.max_lights)
+        self._stamps = np.ndarray(self.slots, dtype='<f8', buffer=buffer,
+                                  offset=self.HEADER,
+                                  strides=(slot_size,))
+        self._counts = np.ndarray(self.slots, dtype='<u4', buffer=buffer,
+                                  offset=self.HEADER + 8,
+                                  strides=(slot_size,))
+        self._entries = [np.ndarray(self.max_lights, dtype=FRAME_ENTRY,
+                                    buffer=buffer,
+                                    offset=self.HEADER + index * slot_size +
+                                    self.SLOT_HEADER)
+                         for index in range(self.slots)]
+
+    @classmethod
+    def attach(cls, name, untrack=True):
+        """
+        Args:
+            name (str): The name of a ring created by another process.
+            untrack (bool, optional): Take the ring off this process's
+                    resource tracker. Has to be False when the creator
+                    shares the tracker, see tracker_id().
+
+        Returns:
+            FrameRing: The ring.
+        """
+        return cls(name=name, untrack=untrack)
+
+    @classmethod
+    def _slot_size(cls, max_lights):
+        return cls.SLOT_HEADER + max_lights * FRAME_ENTRY.itemsize
+
+    def write(self, entries, stamp=None):
+        """
+        Adds a frame. Only the producer may call this.
+
+        Args:
+            entries (numpy.ndarray): FRAME_ENTRY records, at most
+                                     max_lights.
+            stamp (float, optional): time.monotonic() the frame was
+                                     made. Defaults to now.
+
+        Returns:
+            bool: False if the ring was full and the frame dropped.
+
+        Raises:
+            ValueError: If the frame holds more than max_lights lights.
+        """
+        if len(entries) > self.max_lights:
+            raise ValueError("A frame holds at most {} lights".format(
+                self.max_lights))
+        head, tail = int(self._counters[0]), int(self._counters[1])
+        if head - tail >= self.slots:
+            self._counters[2] += 1
+            return False
+        index = head % self.slots
+        self._entries[index][:len(entries)] = entries
+        self._counts[index] = len(entries)
+        self._stamps[index] = time.monotonic() if stamp is None else stamp
+        # Publishing the head last hands the slot to the consumer.
+        self._counters[0] = head + 1
+        return True
+
+    def read(self):
+        """
+        Takes the oldest frame. Only the consumer may call this.
+
+        Returns:
+            tuple: (stamp, entries) with a copy of the records, None
+                   when the ring is empty.
+        """
+        head, tail = int(self._counters[0]), int(self._counters[1])
+        if tail >= head:
+            return None
+        index = tail % self.slots
+        frame = (float(self._stamps[index]),
+                 self._entries[index][:int(self._counts[index])].copy())
+        self._counters[1] = tail + 1
+        return frame
+
+    def depth(self):
+        """
+        Returns:
+            int: Frames written but not read yet.
+        """
+        return int(self._counters[0]) - int(self._counters[1])
+
+    def counters(self):
+        """
+        Returns:
+            dict: "written", "read" and "dropped" frames.
+        """
+        written, read, dropped = (int(value) for value in self._counters)
+        return {'written': written, 'read': read, 'dropped': dropped}
+
+    def close(self, unlink=None):
+        """
+        Closes the shared memory.
+
+        Args:
+            unlink (bool, optional): Also remove the block. Defaults to
+                                     True for the creator.
+        """
+        # The arrays hold on to the buffer, which has to be released
+        # before the block can be closed.
+        self._counters = self._shape = self._stamps = self._counts = None
+        self._entries = []
+        self._memory.close()
+        if self._owner if unlink is None else unlink:
+            try:
+                self._memory.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def tracker_id():
+    """
+    Identifies the resource tracker of this process, processes started
+    by the same parent share one.
+
+    Returns:
+        tuple: The device and inode of the pipe to the tracker, None
+               where shared memory is not tracked.
+    """
+    if os.name != 'posix':
+        return None
+    status = os.fstat(resource_tracker.getfd())
+    return status.st_dev, status.st_ino
+
+
+def encode_frame(states):
+    """
+    Packs light states into FRAME_ENTRY records.
+
+    Args:
+        states (dict): Light ID -> state with "on", "bri", "xy" and
+                       "transitiontime", as queued on the dispatcher.
+
+    Returns:
+        numpy.ndarray: The records.
+    """
+    entries = np.zeros(len(states), dtype=FRAME_ENTRY)
+    for index, (light_id, state) in enumerate(states.items()):
+        entry = entries[index]
+        entry['light'] = int(light_id)
+        entry['on'] = bool(state.get('on', True))
+        entry['bri'] = min(max(int(state.get('bri', 0)), 0), 254)
+        entry['transition'] = state.get('transitiontime', NO_TRANSITION)
+        entry['x'], entry['y'] = state.get('xy') or (np.nan, np.nan)
+    return entries
+
+
+def decode_entry(entry):
+    """
+    Args:
+        entry (numpy.void): A FRAME_ENTRY record.
+
+    Returns:
+        tuple: (light ID, state) ready for the dispatcher.
+    """
+    if not entry['on']:
+        state = {'on': False}
+    else:
+        state = {'on': True}
+        if entry['bri']:
+            state['bri'] = int(entry['bri'])
+        if not np.isnan(entry['x']):
+            state['xy'] = [round(float(entry['x']), 4),
+                           round(float(entry['y']), 4)]
+    if entry['transition'] != NO_TRANSITION:
+        state['transitiontime'] = int(entry['transition'])
+    return str(int(entry['light'])), state
+
+
+def _latency_stats(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {'mean_ms': sum(values) / len(values) * 1000,
+            'p50_ms': values[len(values) // 2] * 1000,
+            'p99_ms': values[min(len(values) - 1,
+                                 int(len(values) * 0.99))] * 1000}
+
+
+class ControllerService:
+    """
+    ControllerService serves a HueController to front-ends in other
+    processes, over control connections and shared memory frame rings.
+
+    Every front-end connection gets its own thread. A connection that
+    opens with ("frames", ring name) is a doorbell for that ring, any
+    other carries requests of (name, args, kwargs), answered with
+    ("ok", result) or ("error", type, message).
+
+    Attributes:
+    - COMMANDS (tuple): Controller methods front-ends may call, next to
+                        "ping", "submit", "state", "flush" and "stats".
+    - LATENCY_SAMPLES (int): Latencies kept per statistic.
+    - controller (HueController): The controller shared by everyone.
+    - address (tuple): The (host, port) served on.
+
+    Methods:
+    - start: Starts accepting front-ends in a background thread.
+    - serve_forever: Accepts front-ends on the calling thread.
+    - stop: Stops accepting and disconnects the front-ends.
+    - stats: Returns request, frame and queue depth statistics.
+    """
+    COMMANDS = ('set_power', 'submit_light_settings', 'recall_scene',
+                'play_timeline', 'handle_event', 'find_lights', 'resolve',
+                'target_lights', 'is_on', 'brightness', 'refresh_state')
+
+    LATENCY_SAMPLES = 1000
+
+    def __init__(self, controller, host='127.0.0.1', port=0, authkey=None):
+        """
+        Initializes the ControllerService and starts listening.
+
+        Args:
+            controller (HueController): The controller to serve.
+            host (str, optional): Interface to listen on. Defaults to
+                                  the loopback interface.
+            port (int, optional): TCP port, 0 for any free one.
+            authkey (bytes): Key front-ends have to present.
+
+        Raises:
+            ValueError: If no authkey is given.
+        """
+        if not authkey:
+            raise ValueError("the controller service needs an authkey")
+        self.controller = controller
+        self._listener = connection.Listener((host, port), authkey=authkey)
+        self.address = self._listener.address
+        self._connections = []
+        self._rings = {}
+        self._requests = 0
+        self._errors = 0
+        self._request_latency = deque(maxlen=self.LATENCY_SAMPLES)
+        self._frame_latency = deque(maxlen=self.LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+        self._running = True
+        self._thread = None
+
+    def start(self):
+        """
+        Starts accepting front-ends in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        name="ControllerService",
+                                        daemon=True)
+        self._thread.start()
+
+    def serve_forever(self):
+        """
+        Accepts front-ends on the calling thread until stop() is called.
+        """
+        while self._running:
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                break
+            except Exception:
+                # A front-end with the wrong key, it is not served.
+                logger.warning("Refused a front-end", exc_info=True)
+                continue
+            with self._lock:
+                self._connections.append(conn)
+            threading.Thread(target=self._serve, args=(conn,),
+                             name="ControllerService-client",
+                             daemon=True).start()
+
+    def stop(self):
+        """
+        Stops accepting front-ends and closes every connection.
+        """
+        self._running = False
+        self._listener.close()
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        if self._thread is not None and \
+                self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+
+    def stats(self):
+        """
+        Returns:
+            dict: "connections" open, "requests" served, "errors",
+                  the request latency, per ring the frame counters and
+                  queue depth, the frame latency from written to queued,
+                  the dispatcher counters and the rate limiter state.
+        """
+        with self._lock:
+            rings = {name: dict(ring.counters(), depth=ring.depth())
+                     for name, ring in self._rings.items()}
+            stats = {'connections': len(self._connections),
+                     'requests': self._requests,
+                     'errors': self._errors,
+                     'request_latency': _latency_stats(
+                         self._request_latency),
+                     'frame_latency': _latency_stats(self._frame_latency)}
+        stats['rings'] = rings
+        stats['dispatcher'] = self.controller.dispatcher.stats()
+        stats['rate_limiter'] = self.controller.rate_limiter.stats()
+        return stats
+
+    def _serve(self, conn):
+        try:
+            message = conn.recv()
+            if isinstance(message, tuple) and message[:1] == ("frames",):
+                self._serve_frames(conn, *message[1:])
+                return
+            while True:
+                self._answer(conn, message)
+                message = conn.recv()
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._lock:
+                if conn in self._connections:
+                    self._connections.remove(conn)
+            conn.close()
+
+    def _answer(self, conn, message):
+        start = time.perf_counter()
+        try:
+            name, args, kwargs = message
+            reply = ("ok", self._call(name, args, kwargs))
+        except Exception as error:
+            reply = ("error", type(error).__name__, str(error))
+        with self._lock:
+            self._requests += 1
+            self._errors += reply[0] == "error"
+            self._request_latency.append(time.perf_counter() - start)
+        conn.send(reply)
+
+    def _call(self, name, args, kwargs):
+        controller = self.controller
+        if name == "ping":
+            return time.monotonic()
+        if name == "submit":
+            kind, target, settings = args
+            controller.dispatcher.submit(
+                kind, controller.resolve(kind, target), settings, **kwargs)
+            return None
+        if name == "state":
+            kind, target = args
+            return controller.state_cache.get(
+                kind, controller.resolve(kind, target))
+        if name == "flush":
+            return controller.dispatcher.flush(*args, **kwargs)
+        if name == "stats":
+            return self.stats()
+        if name not in self.COMMANDS:
+            raise ValueError("unknown command: {}".format(name))
+        result = getattr(controller, name)(*args, **kwargs)
+        # Queued commands are answered at once, like "submit".
+        return None if isinstance(result, Future) else result
+
+    def _serve_frames(self, conn, name, tracker):
+        ring = FrameRing.attach(name, untrack=tracker != tracker_id())
+        with self._lock:
+            self._rings[name] = ring
+        submit = self.controller.dispatcher.submit
+        try:
+            while True:
+                conn.recv_bytes()
+                # Everything in the ring is drained at once, only the
+                # newest state of each light is queued.
+                states = {}
+                stamps = []
+                frame = ring.read()
+                while frame is not None:
+                    stamps.append(frame[0])
+                    for entry in frame[1]:
+                        light_id, state = decode_entry(entry)
+                        states[light_id] = state
+                    frame = ring.read()
+                for light_id, state in states.items():
+                    submit("light", light_id, state, priority="background")
+                now = time.monotonic()
+                with self._lock:
+                    self._frame_latency.extend(now - stamp
+                                               for stamp in stamps)
+        finally:
+            with self._lock:
+                self._rings.pop(name, None)
+            ring.close(unlink=False)
+
+
+class ServiceError(Exception):
+    """
+    Raised by ServiceClient when the worker could not carry out a
+    request.
+    """
+
+
+class FrameWriter:
+    """
+    FrameWriter sends frames from a front-end to the worker through a
+    FrameRing.
+
+    Attributes:
+    - ring (FrameRing): The ring the frames are written to.
+
+    Methods:
+    - write: Sends the states of a frame.
+    - write_entries: Sends a frame already packed as FRAME_ENTRY records.
+    - close: Closes the ring and its doorbell.
+    """
+    def __init__(self, ring, doorbell):
+        """
+        Args:
+            ring (FrameRing): A ring created by this process.
+            doorbell (Connection): Connection to the worker that
+                                   announced the ring.
+        """
+        self.ring = ring
+        self._doorbell = doorbell
+
+    def write(self, states, stamp=None):
+        """
+        Args:
+            states (dict): Light ID -> state, see encode_frame().
+            stamp (float, optional): time.monotonic() of the frame.
+
+        Returns:
+            bool: False if the ring was full and the frame dropped.
+        """
+        return self.write_entries(encode_frame(states), stamp)
+
+    def write_entries(self, entries, stamp=None):
+        """
+        Args:
+            entries (numpy.ndarray): FRAME_ENTRY records.
+            stamp (float, optional): time.monotonic() of the frame.
+
+        Returns:
+            bool: False if the ring was full and the frame dropped.
+        """
+        if not self.ring.write(entries, stamp):
+            return False
+        self._doorbell.send_bytes(b'')
+        return True
+
+    def close(self):
+        """
+        Closes the doorbell and removes the ring.
+        """
+        self._doorbell.close()
+        self.ring.close()
+
+
+class ServiceClient:
+    """
+    ServiceClient is a front-end's handle on the controller worker.
+
+    Requests are sent one at a time, a client shared between threads
+    serializes them.
+
+    Attributes:
+    - address (tuple): The (host, port) of the worker.
+
+    Methods:
+    - call: Calls a command in the worker and returns its result.
+    - ping: Returns the round trip time of the control channel.
+    - submit: Queues a state for a light or group.
+    - state: Returns the cached state of a light or group.
+    - stats: Returns the worker's statistics.
+    - open_frames: Creates a frame ring for an effect.
+    - close: Disconnects from the worker.
+    """
+    def __init__(self, address, authkey):
+        """
+        Connects to the worker.
+
+        Args:
+            address (tuple): The (host, port) of the worker.
+            authkey (bytes): The key the worker was started with.
+        """
+        self.address = tuple(address)
+        self._authkey = authkey
+        self._conn = connection.Client(self.address, authkey=authkey)
+        self._lock = threading.Lock()
+        self._writers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def call(self, name, *args, **kwargs):
+        """
+        Calls a command in the worker.
+
+        Args:
+            name (str): One of ControllerService.COMMANDS, "ping",
+                        "submit", "state", "flush" or "stats".
+            *args, **kwargs: Passed on to the command.
+
+        Returns:
+            The command's result.
+
+        Raises:
+            ServiceError: If the command raised in the worker.
+        """
+        with self._lock:
+            self._conn.send((name, args, kwargs))
+            reply = self._conn.recv()
+        if reply[0] == "error":
+            raise ServiceError("{}: {}".format(reply[1], reply[2]))
+        return reply[1]
+
+    def ping(self):
+        """
+        Returns:
+            float: Seconds for a request to reach the worker and come
+                   back.
+        """
+        start = time.perf_counter()
+        self.call("ping")
+        return time.perf_counter() - start
+
+    def submit(self, kind, target, settings, priority="normal"):
+        """
+        Queues a state on the worker's dispatcher.
+
+        Args:
+            kind (str): "light" or "group".
+            target (str): An ID or a name.
+            settings (dict): The bridge state attributes.
+            priority (str, optional): "user", "normal" or "background".
+        """
+        self.call("submit", kind, target, settings, priority=priority)
+
+    def state(self, kind, target):
+        """
+        Returns:
+            dict: The cached state of a light or group, by ID or name.
+        """
+        return self.call("state", kind, target)
+
+    def stats(self):
+        """
+        Returns:
+            dict: See ControllerService.stats().
+        """
+        return self.call("stats")
+
+    def open_frames(self, slots=8, max_lights=64):
+        """
+        Creates a frame ring and announces it to the worker.
+
+        Args:
+            slots (int, optional): Frames the ring holds.
+            max_lights (int, optional): Lights a frame holds.
+
+        Returns:
+            FrameWriter: Writes frames to the ring.
+        """
+        ring = FrameRing(slots, max_lights)
+        doorbell = connection.Client(self.address, authkey=self._authkey)
+        doorbell.send(("frames", ring.name, tracker_id()))
+        writer = FrameWriter(ring, doorbell)
+        self._writers.append(writer)
+        return writer
+
+    def close(self):
+        """
+        Closes the frame rings and disconnects from the worker.
+        """
+        for writer in self._writers:
+            writer.close()
+        self._writers = []
+        self._conn.close()
+
+
+def service_settings(config):
+    """
+    Reads the "service" settings.
+
+    The key front-ends present is the "authkey" setting. Without one, a
+    random key is generated on first use and kept, readable by the
+    owner only, in the "authkey_file" next to config.json, where
+    front-ends of the same user read it from.
+
+    Args:
+        config (ConfigManager): The configuration.
+
+    Returns:
+        tuple: ((host, port), authkey as bytes).
+    """
+    settings = config.get_setting("service", {})
+    address = (settings.get("host", '127.0.0.1'), settings.get("port", 8766))
+    if settings.get("authkey"):
+        return address, settings["authkey"].encode('utf-8')
+
+    path = os.path.join(
+        os.path.dirname(os.path.abspath(config.config_path)),
+        settings.get("authkey_file", "service.key"))
+    try:
+        descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                             0o600)
+    except FileExistsError:
+        with open(path, 'rb') as key_file:
+            authkey = key_file.read().strip()
+        if not authkey:
+            raise ValueError("the key file {} is empty".format(path))
+        return address, authkey
+    authkey = secrets.token_hex(32).encode('ascii')
+    with os.fdopen(descriptor, 'wb') as key_file:
+        key_file.write(authkey)
+    return address, authkey
+
+
+def run_service(bridge_ip=None, username=None, host='127.0.0.1', port=0,
+                authkey=None, ready=None):
+    """
+    Runs a worker: connects a HueController and serves it until the
+    process is terminated.
+
+    Args:
+        bridge_ip (str, optional): See HueController.
+        username (str, optional): See HueController.
+        host (str, optional): Interface to listen on.
+        port (int, optional): TCP port, 0 for any free one.
+        authkey (bytes): Key front-ends have to present, required.
+        ready (Connection, optional): Receives the address once
+                                      front-ends can attach.
+    """
+    from hue_controller import HueController
+
+    controller = HueController(bridge_ip, username)
+    service = ControllerService(controller, host, port, authkey)
+    if ready is not None:
+        ready.send(service.address)
+        ready.close()
+    try:
+        service.serve_forever()
+    finally:
+        service.stop()
+        controller.close()
+
+
+def spawn_service(bridge_ip=None, username=None, host='127.0.0.1', port=0,
+                  authkey=None, timeout=30.0):
+    """
+    Starts a worker process and waits until front-ends can attach.
+
+    The worker is started fresh rather than forked, it shares nothing
+    with the calling process, a Tk window included.
+
+    Args:
+        See run_service().
+        timeout (float, optional): Seconds to wait for the worker.
+
+    Returns:
+        tuple: (multiprocessing.Process, (host, port)).
+
+    Raises:
+        ValueError: If no authkey is given.
+        TimeoutError: If the worker did not come up in time.
+    """
+    if not authkey:
+        raise ValueError("the controller service needs an authkey")
+    context = get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=run_service,
+                              args=(bridge_ip, username, host, port, authkey,
+                                    sender),
+                              name="LumenController", daemon=True)
+    process.start()
+    sender.close()
+    if not receiver.poll(timeout):
+        process.terminate()
+        raise TimeoutError("The controller worker did not start")
+    return process, receiver.recv()
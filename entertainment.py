@@ -0,0 +1,371 @@
+import colorsys
+import logging
+import math
+import socket
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class FramePacket:
+    """
+    FramePacket is a preallocated Entertainment API (HueStream v1)
+    datagram holding one frame for a fixed set of lights.
+
+    The packet is allocated once. Every frame only overwrites the
+    sequence number and the color values in place, so streaming at
+    50 Hz allocates nothing per frame.
+
+    Layout: a 16 byte header ("HueStream", version 1.0, sequence,
+    reserved, color space, reserved) followed by 9 bytes per light
+    (type, 16 bit light ID, three 16 bit color values), big-endian.
+
+    Attributes:
+    - light_ids (tuple): The lights in packet order.
+    - buffer (bytearray): The packet bytes.
+    - view (memoryview): A view of the buffer, handed to the socket.
+
+    Methods:
+    - set_sequence: Writes the sequence number.
+    - set_color: Writes the color of the light at an index.
+    """
+    HEADER_SIZE = 16
+    LIGHT_SIZE = 9
+    RGB = 0x00
+    XY = 0x01
+
+    _COLOR = struct.Struct('>HHH')
+    _LIGHT = struct.Struct('>BH')
+
+    def __init__(self, light_ids, color_space=RGB):
+        """
+        Initializes the FramePacket.
+
+        Args:
+            light_ids (list): IDs of the lights in the frame.
+            color_space (int, optional): FramePacket.RGB or
+                                         FramePacket.XY.
+                                         Defaults to RGB.
+        """
+        self.light_ids = tuple(int(light_id) for light_id in light_ids)
+        self.buffer = bytearray(self.HEADER_SIZE +
+                                self.LIGHT_SIZE * len(self.light_ids))
+        self.view = memoryview(self.buffer)
+
+        self.buffer[0:9] = b'HueStream'
+        self.buffer[9:11] = b'\x01\x00'
+        self.buffer[14] = color_space
+        for index, light_id in enumerate(self.light_ids):
+            self._LIGHT.pack_into(self.buffer, self._offset(index), 0,
+                                  light_id)
+
+    def _offset(self, index):
+        return self.HEADER_SIZE + self.LIGHT_SIZE * index
+
+    def set_sequence(self, sequence):
+        """
+        Args:
+            sequence (int): The frame number, wrapped to one byte.
+        """
+        self.buffer[11] = sequence & 0xFF
+
+    def set_color(self, index, a, b, c):
+        """
+        Writes the color of one light.
+
+        Args:
+            index (int): Position of the light in light_ids.
+            a, b, c (float): Red, green and blue, or x, y and
+                             brightness, each from 0.0 to 1.0. Values
+                             outside that range are clamped.
+        """
+        self._COLOR.pack_into(self.buffer, self._offset(index) + 3,
+                              int(min(max(a, 0.0), 1.0) * 0xFFFF),
+                              int(min(max(b, 0.0), 1.0) * 0xFFFF),
+                              int(min(max(c, 0.0), 1.0) * 0xFFFF))
+
+    @classmethod
+    def parse(cls, data):
+        """
+        Reads the sequence number and colors from a received packet.
+
+        Args:
+            data (bytes): The packet.
+
+        Returns:
+            tuple: (sequence, {light_id: (a, b, c)}) with raw 16 bit
+                   color values.
+        """
+        colors = {}
+        for offset in range(cls.HEADER_SIZE, len(data), cls.LIGHT_SIZE):
+            _, light_id = cls._LIGHT.unpack_from(data, offset)
+            colors[light_id] = cls._COLOR.unpack_from(data, offset + 3)
+        return data[11], colors
+
+
+class ColorLoop:
+    """
+    An effect cycling all lights through the color wheel, each light
+    shifted a little from its neighbour.
+    """
+    def __init__(self, period=4.0, spread=0.1):
+        """
+        Args:
+            period (float, optional): Seconds per full cycle.
+            spread (float, optional): Hue offset between lights.
+        """
+        self.period = period
+        self.spread = spread
+
+    def __call__(self, elapsed, packet):
+        base = elapsed / self.period
+        for index in range(len(packet.light_ids)):
+            red, green, blue = colorsys.hsv_to_rgb(
+                (base + index * self.spread) % 1.0, 1.0, 1.0)
+            packet.set_color(index, red, green, blue)
+
+
+class Pulse:
+    """
+    An effect fading all lights in and out in a single color.
+    """
+    def __init__(self, color=(1.0, 1.0, 1.0), period=2.0):
+        """
+        Args:
+            color (tuple, optional): Red, green and blue from 0.0 to 1.0.
+            period (float, optional): Seconds per pulse.
+        """
+        self.color = color
+        self.period = period
+
+    def __call__(self, elapsed, packet):
+        level = 0.5 - 0.5 * math.cos(2 * math.pi * elapsed / self.period)
+        red, green, blue = self.color
+        for index in range(len(packet.light_ids)):
+            packet.set_color(index, red * level, green * level, blue * level)
+
+
+class EntertainmentStream:
+    """
+    EntertainmentStream renders an effect into a FramePacket at a fixed
+    frame rate and sends every frame as a UDP datagram.
+
+    Frames are scheduled against absolute deadlines on the monotonic
+    clock, so a slow frame does not push every later frame back. When
+    the stream falls more than a whole frame behind, the missed frames
+    are skipped rather than sent in a burst.
+
+    An effect is any callable taking (elapsed seconds, packet) that
+    writes the colors of the frame with packet.set_color. An effect
+    that raises is logged and ends the stream.
+
+    The Hue bridge expects the datagrams inside a DTLS session, which
+    the standard library does not provide. A socket like object with
+    a sendto method, e.g. a DTLS wrapped socket, can be passed in.
+
+    Attributes:
+    - rate (float): Frames per second, 25 to 50 for the Hue bridge.
+    - packet (FramePacket): The frame being streamed.
+    - frames_sent (int): Number of frames sent.
+    - frames_skipped (int): Number of frames skipped when late.
+    - error (Exception): What the effect raised when it ended the
+                         stream, None while it runs.
+
+    Methods:
+    - start: Starts streaming in a background thread.
+    - stop: Stops streaming.
+    - set_effect: Replaces the running effect.
+    - stats: Returns the frame counters.
+    """
+    def __init__(self, light_ids, address, effect, rate=25.0,
+                 color_space=FramePacket.RGB, sock=None):
+        """
+        Initializes the EntertainmentStream.
+
+        Args:
+            light_ids (list): IDs of the lights to stream to.
+            address (tuple): (host, port) the frames are sent to. The
+                             bridge listens on port 2100.
+            effect (callable): Renders a frame as effect(elapsed, packet).
+            rate (float, optional): Frames per second. Defaults to 25.
+            color_space (int, optional): FramePacket.RGB or
+                                         FramePacket.XY.
+            sock (optional): Object with a sendto method used to send
+                             the frames. Defaults to a new UDP socket.
+        """
+        self.address = address
+        self.effect = effect
+        self.rate = rate
+        self.packet = FramePacket(light_ids, color_space)
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.error = None
+
+        self._sock = sock or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._owns_socket = sock is None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def set_effect(self, effect):
+        """
+        Replaces the running effect from the next frame on.
+
+        Args:
+            effect (callable): Renders a frame as effect(elapsed, packet).
+        """
+        self.effect = effect
+
+    def start(self):
+        """
+        Starts streaming in a background thread.
+        """
+        self._stopped.clear()
+        self.error = None
+        self._thread = threading.Thread(target=self._run,
+                                        name="EntertainmentStream",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops streaming and waits for the stream thread to end.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._owns_socket:
+            self._sock.close()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Frames sent and skipped.
+        """
+        return {'frames_sent': self.frames_sent,
+                'frames_skipped': self.frames_skipped}
+
+    def _run(self):
+        period = 1.0 / self.rate
+        start = time.monotonic()
+        frame = 0
+        while not self._stopped.is_set():
+            deadline = start + frame * period
+            now = time.monotonic()
+            if deadline > now:
+                if self._stopped.wait(deadline - now):
+                    return
+            elif now - deadline > period:
+                # More than a frame behind, skip to the current one.
+                late = int((now - deadline) / period)
+                self.frames_skipped += late
+                frame += late
+
+            try:
+                self.effect(frame * period, self.packet)
+            except Exception as error:
+                logger.exception("Effect failed, stopping the stream")
+                self.error = error
+                self._stopped.set()
+                return
+            self.packet.set_sequence(frame)
+            self._sock.sendto(self.packet.view, self.address)
+            self.frames_sent += 1
+            frame += 1
+
+
+class LoopbackReceiver:
+    """
+    LoopbackReceiver listens for entertainment frames on the local
+    machine and measures how evenly they arrive, standing in for the
+    bridge in tests and benchmarks.
+
+    Attributes:
+    - address (tuple): (host, port) the receiver listens on.
+    - received (int): Number of frames received.
+    - dropped (int): Number of frames missing from the sequence.
+    - last_colors (dict): Colors of the last frame, by light ID.
+
+    Methods:
+    - start: Starts receiving in a background thread.
+    - stop: Stops receiving.
+    - stats: Returns the frame counters and arrival jitter.
+    """
+    def __init__(self, host='127.0.0.1', port=0, max_size=1024):
+        """
+        Initializes the LoopbackReceiver.
+
+        Args:
+            host (str, optional): Address to listen on.
+            port (int, optional): Port to listen on, 0 picks a free one.
+            max_size (int, optional): Largest datagram expected.
+        """
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((host, port))
+        self._sock.settimeout(0.2)
+        self.address = self._sock.getsockname()
+
+        self.received = 0
+        self.dropped = 0
+        self.last_colors = {}
+
+        self._buffer = bytearray(max_size)
+        self._intervals = []
+        self._last_arrival = None
+        self._last_sequence = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts receiving in a background thread.
+        """
+        self._thread = threading.Thread(target=self._run,
+                                        name="LoopbackReceiver", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops receiving and closes the socket.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._sock.close()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Frames received and dropped, the mean interval between
+                  frames and its standard deviation (jitter), both in
+                  milliseconds.
+        """
+        intervals = self._intervals
+        if not intervals:
+            return {'received': self.received, 'dropped': self.dropped,
+                    'interval_ms': 0.0, 'jitter_ms': 0.0}
+        mean = sum(intervals) / len(intervals)
+        variance = sum((value - mean) ** 2 for value in intervals) \
+            / len(intervals)
+        return {'received': self.received, 'dropped': self.dropped,
+                'interval_ms': mean * 1000,
+                'jitter_ms': math.sqrt(variance) * 1000}
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                size = self._sock.recv_into(self._buffer)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            arrival = time.monotonic()
+            sequence, self.last_colors = FramePacket.parse(
+                memoryview(self._buffer)[:size])
+
+            if self._last_sequence is not None:
+                self.dropped += (sequence - self._last_sequence - 1) % 256
+                self._intervals.append(arrival - self._last_arrival)
+            self._last_sequence = sequence
+            self._last_arrival = arrival
+            self.received += 1
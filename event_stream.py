@@ -0,0 +1,362 @@
+import http.client
+import json
+import logging
+import ssl
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class EventStreamUnsupported(Exception):
+    """
+    Raised when the bridge does not offer the v2 event stream.
+    """
+
+
+def v2_to_v1(resource):
+    """
+    Translates a resource from a v2 event into the v1 state attributes
+    used by the rest of Lumen.
+
+    Args:
+        resource (dict): One entry of the "data" list of a v2 event.
+
+    Returns:
+        tuple: (kind, target_id, state) with kind "light" or "group",
+               or None for resources Lumen does not track.
+    """
+    id_v1 = resource.get('id_v1', '')
+    if resource.get('type') == 'light' and id_v1.startswith('/lights/'):
+        kind = "light"
+    elif resource.get('type') == 'grouped_light' and \
+            id_v1.startswith('/groups/'):
+        kind = "group"
+    else:
+        return None
+    target_id = id_v1.rsplit('/', 1)[1]
+
+    state = {}
+    if 'on' in resource:
+        state['on'] = resource['on'].get('on')
+    if 'dimming' in resource:
+        percent = resource['dimming'].get('brightness', 0)
+        state['bri'] = max(1, min(254, round(percent * 254 / 100)))
+    xy = resource.get('color', {}).get('xy')
+    if xy:
+        state['xy'] = [xy['x'], xy['y']]
+    mirek = resource.get('color_temperature', {}).get('mirek')
+    if mirek:
+        state['ct'] = mirek
+    return kind, target_id, state
+
+
+def v2_sensor_event(resource):
+    """
+    Translates a sensor resource from a v2 event into an event for the
+    automation engine.
+
+    Args:
+        resource (dict): One entry of the "data" list of a v2 event.
+
+    Returns:
+        tuple: (event type, sensor ID, data), e.g. ("motion", "5",
+               {"motion": True}), or None for other resources.
+    """
+    id_v1 = resource.get('id_v1', '')
+    if not id_v1.startswith('/sensors/'):
+        return None
+    sensor_id = id_v1.rsplit('/', 1)[1]
+    resource_type = resource.get('type')
+    if resource_type == 'motion' and 'motion' in resource:
+        return "motion", sensor_id, {
+            'motion': resource['motion'].get('motion')}
+    if resource_type == 'button' and 'button' in resource:
+        return "button", sensor_id, {
+            'button': resource['button'].get('last_event')}
+    if resource_type == 'light_level' and 'light' in resource:
+        return "light_level", sensor_id, {
+            'light_level': resource['light'].get('light_level')}
+    return None
+
+
+class EventStream:
+    """
+    EventStream keeps the StateCache in step with changes made outside
+    Lumen, by wall switches, the phone app or automations.
+
+    It holds one long-lived connection to the v2 event stream of the
+    bridge (server-sent events) and reports every light and group
+    update to the cache. A dropped connection is re-established with
+    backoff and resumed from the last event received. Bridges without
+    the event stream are polled instead, lights and groups, more often
+    while things are changing and less often while they are not. After
+    max_failures attempts in a row fail to reach the stream, the bridge
+    is polled too, and the stream tried again every
+    stream_retry_interval seconds until it is back. An
+    update that fails to be handled, e.g. by a cache listener, is
+    logged and skipped, it never stops the stream or the polling.
+
+    Attributes:
+    - mode (str): "stream" or "polling", whichever is in use.
+    - events (int): Number of updates reported to the cache.
+    - reconnects (int): Number of times the stream was re-established.
+    - on_event (callable): Called with the sensor events translated by
+                           v2_sensor_event, None to ignore them.
+
+    Methods:
+    - start: Starts following the bridge in a background thread.
+    - stop: Stops following the bridge.
+    """
+    PATH = '/eventstream/clip/v2'
+
+    def __init__(self, host, username, state_cache, fetch_state,
+                 scheme='https', timeout=300.0, max_backoff=30.0,
+                 poll_min_interval=1.0, poll_max_interval=30.0,
+                 on_event=None, max_failures=5,
+                 stream_retry_interval=300.0):
+        """
+        Initializes the EventStream.
+
+        Args:
+            host (str): Address of the bridge, optionally with ":port".
+            username (str): The whitelisted API username, sent as the
+                            hue-application-key.
+            state_cache (StateCache): The cache to report updates to.
+            fetch_state (callable): Returns the full bridge state, used
+                                    by the polling fallback.
+            scheme (str, optional): "https" for real bridges, "http" for
+                                    local stand-ins. Defaults to "https".
+            timeout (float, optional): Seconds without data before the
+                                       stream is reconnected.
+            max_backoff (float, optional): Longest wait between two
+                                           reconnect attempts.
+            poll_min_interval (float, optional): Shortest poll interval.
+            poll_max_interval (float, optional): Longest poll interval.
+            on_event (callable, optional): Called as on_event(type, 
+                    sensor_id, data) for motion, button and light level
+                    events. Only the event stream carries them.
+            max_failures (int, optional): Failed attempts in a row to
+                    reach the stream before the bridge is polled.
+                    Defaults to 5.
+            stream_retry_interval (float, optional): Seconds of polling
+                    before the stream is tried again. Defaults to 300.
+        """
+        self.host = host
+        self.username = username
+        self.state_cache = state_cache
+        self.fetch_state = fetch_state
+        self.scheme = scheme
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.poll_min_interval = poll_min_interval
+        self.poll_max_interval = poll_max_interval
+        self.on_event = on_event
+        self.max_failures = max_failures
+        self.stream_retry_interval = stream_retry_interval
+
+        self.mode = "stream"
+        self.events = 0
+        self.reconnects = 0
+
+        self._last_event_id = None
+        self._socket = None
+        self._streaming = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts following the bridge in a background thread.
+        """
+        self._thread = threading.Thread(target=self._run,
+                                        name="EventStream", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops following the bridge and closes the stream.
+        """
+        self._stopped.set()
+        sock = self._socket
+        if sock is not None:
+            # Unblocks the thread waiting for the next event.
+            try:
+                sock.shutdown(2)
+            except OSError:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        backoff = 1.0
+        failures = 0
+        while not self._stopped.is_set():
+            self._streaming = False
+            try:
+                self._stream()
+                backoff = 1.0
+                failures = 0
+            except EventStreamUnsupported:
+                logger.info("Event stream not supported, polling instead")
+                self.mode = "polling"
+                self._poll()
+                return
+            except Exception as error:
+                if self._stopped.is_set():
+                    return
+                if self._streaming:
+                    # The stream was up, this is a new run of failures.
+                    backoff = 1.0
+                    failures = 0
+                failures += 1
+                if failures >= self.max_failures:
+                    logger.warning("Event stream unreachable (%s), polling "
+                                   "for %.0fs", error,
+                                   self.stream_retry_interval)
+                    self.mode = "polling"
+                    self._poll(self.stream_retry_interval)
+                    self.mode = "stream"
+                    backoff = 1.0
+                    failures = 0
+                elif isinstance(error, (OSError, http.client.HTTPException,
+                                        ValueError)):
+                    logger.warning("Event stream lost (%s), retrying in "
+                                   "%.0fs", error, backoff)
+                    self._stopped.wait(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                else:
+                    logger.exception("Event stream failed, retrying in "
+                                     "%.0fs", backoff)
+                    self._stopped.wait(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+            self.reconnects += 1
+
+    def _connect(self):
+        if self.scheme == 'https':
+            # The bridge uses a self-signed certificate.
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            return http.client.HTTPSConnection(self.host, timeout=self.timeout,
+                                               context=context)
+        return http.client.HTTPConnection(self.host, timeout=self.timeout)
+
+    def _stream(self):
+        """
+        Reads the event stream until the connection ends.
+        """
+        headers = {'hue-application-key': self.username,
+                   'Accept': 'text/event-stream'}
+        if self._last_event_id is not None:
+            headers['Last-Event-ID'] = self._last_event_id
+
+        connection = self._connect()
+        try:
+            # The response takes the socket over from the connection, it
+            # is kept here so stop() can still shut it down.
+            connection.connect()
+            self._socket = connection.sock
+            if self._stopped.is_set():
+                return
+            connection.request('GET', self.PATH, headers=headers)
+            response = connection.getresponse()
+            if response.status in (403, 404):
+                raise EventStreamUnsupported(response.status)
+            if response.status != 200:
+                raise http.client.HTTPException(
+                    "unexpected status {}".format(response.status))
+            self._streaming = True
+
+            event_id, data = None, []
+            while not self._stopped.is_set():
+                line = response.readline()
+                if not line:
+                    return
+                line = line.decode('utf-8').rstrip('\r\n')
+                if not line:
+                    # A blank line ends the event.
+                    if data:
+                        self._handle_event(event_id, '\n'.join(data))
+                    event_id, data = None, []
+                elif line.startswith('id:'):
+                    event_id = line[3:].strip()
+                elif line.startswith('data:'):
+                    data.append(line[5:].strip())
+                # Comments (":") keep the connection alive, ignored.
+        finally:
+            self._socket = None
+            connection.close()
+
+    def _handle_event(self, event_id, data):
+        if event_id is not None:
+            self._last_event_id = event_id
+        try:
+            events = json.loads(data)
+        except ValueError:
+            logger.warning("Skipping malformed event %s", event_id)
+            return
+        for event in events:
+            if not isinstance(event, dict) or \
+                    event.get('type') not in ('update', 'add'):
+                continue
+            for resource in event.get('data', []):
+                try:
+                    self._handle_resource(resource)
+                except Exception:
+                    logger.exception("Failed to handle an update of %s",
+                                     resource.get('id_v1'))
+
+    def _handle_resource(self, resource):
+        update = v2_to_v1(resource)
+        if update is not None and update[2]:
+            self.state_cache.report(*update)
+            self.events += 1
+        elif update is None and self.on_event is not None:
+            sensor_event = v2_sensor_event(resource)
+            if sensor_event is not None:
+                self.on_event(*sensor_event)
+
+    def _poll(self, duration=None):
+        """
+        Polls the full bridge state, lights and groups, halving the
+        interval after a change was seen and growing it while nothing
+        changes.
+
+        Args:
+            duration (float, optional): Seconds to poll for, None to
+                                        poll until stopped.
+        """
+        deadline = None if duration is None else time.monotonic() + duration
+        interval = self.poll_min_interval
+        while True:
+            wait = interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return
+            if self._stopped.wait(wait):
+                return
+            try:
+                api = self.fetch_state()
+            except Exception as error:
+                logger.warning("Polling the bridge failed: %s", error)
+                interval = self.poll_max_interval
+                continue
+
+            changed = False
+            for kind, resources, attribute in (("light", 'lights', 'state'),
+                                               ("group", 'groups', 'action')):
+                for target_id, resource in (api.get(resources) or {}).items():
+                    try:
+                        if self.state_cache.report(
+                                kind, target_id, resource.get(attribute, {})):
+                            changed = True
+                            self.events += 1
+                    except Exception:
+                        logger.exception("Failed to handle an update of "
+                                         "%s %s", kind, target_id)
+
+            if changed:
+                interval = max(self.poll_min_interval, interval / 2)
+            else:
+                interval = min(self.poll_max_interval, interval * 1.5)
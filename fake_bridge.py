@@ -0,0 +1,523 @@
+"""
+A simulated Philips Hue Bridge for benchmarks and offline testing.
+
+FakeBridge serves the parts of the v1 REST API that phue and the
+Lumen transports use from a local HTTP server, so the controller can
+be exercised without a real bridge on the network. It also serves a
+plain HTTP stand-in for the v2 event stream.
+
+Like a real bridge it can be slow, refuse commands sent faster than
+about 10 light and 1 group command per second, and answer with errors,
+all of which is configurable. Commands over the rate limits are
+answered with HTTP 429 and error 901 in the body, as newer bridge
+firmware does; injected errors keep HTTP 200.
+
+Usage:
+    with FakeBridge(lights=10) as bridge:
+        transport = PooledTransport(bridge.address)
+        transport.request('GET', '/api/' + bridge.username)
+"""
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeBridge:
+    """
+    FakeBridge keeps the state of a number of simulated lights and
+    groups and serves it over HTTP.
+
+    Attributes:
+    - username (str): The whitelisted API username.
+    - latency (float): Seconds every request is delayed by.
+    - state (dict): The full bridge state, as returned by a GET on
+                    /api/<username>.
+    - request_count (int): Number of requests served.
+    - event_stream (bool): Whether the v2 event stream is offered.
+    - rate_limits (dict): Kind -> commands accepted per second, None
+                          for no limits.
+    - commands (list): (time.monotonic(), kind, ID, state) of every
+                       light and group command applied.
+    - throttled (int): Number of commands refused for exceeding the
+                       rate limits.
+    - errors (int): Number of commands answered with an injected error.
+
+    Methods:
+    - start: Starts serving in a background thread.
+    - stop: Stops the server.
+    - handle: Answers a single request, used by the HTTP handler.
+    - set_light_state: Changes a light as a wall switch would.
+    - wait_for_events: Returns the stream events after a given one.
+    - fail_next: Makes the next commands fail with an error.
+    """
+    # The rates a real bridge handles before it starts refusing
+    # commands with error 901.
+    BRIDGE_RATE_LIMITS = {'light': 10.0, 'group': 1.0}
+
+    def __init__(self, lights=10, groups=None, latency=0.0,
+                 host='127.0.0.1', port=0, username='lumen',
+                 event_stream=True, jitter=0.0, rate_limits=None,
+                 error_rate=0.0, seed=None):
+        """
+        Initializes the FakeBridge.
+
+        Args:
+            lights (int, optional): Number of simulated lights.
+                                    Defaults to 10.
+            groups (dict, optional): Group ID -> list of light IDs.
+                    Defaults to a single room holding every light.
+            latency (float, optional): Seconds every request is delayed
+                                       by. Defaults to 0.0.
+            host (str, optional): Address to listen on.
+                                  Defaults to "127.0.0.1".
+            port (int, optional): Port to listen on. Defaults to 0,
+                                  picking a free port.
+            username (str, optional): The whitelisted API username.
+                                      Defaults to "lumen".
+            event_stream (bool, optional): Whether the v2 event stream
+                                           is offered. Defaults to True.
+            jitter (float, optional): Up to this many seconds are added
+                                      to the latency of every request.
+            rate_limits (dict, optional): Kind -> commands accepted per
+                    second, e.g. FakeBridge.BRIDGE_RATE_LIMITS. Defaults
+                    to None, accepting any rate.
+            error_rate (float, optional): Share of commands answered
+                                          with error 901 at random.
+            seed (int, optional): Seeds the random jitter and errors.
+        """
+        self.username = username
+        self.latency = latency
+        self.request_count = 0
+        self.event_stream = event_stream
+        self.jitter = jitter
+        self.rate_limits = rate_limits
+        self.error_rate = error_rate
+        self.commands = []
+        self.throttled = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        # kind -> (tokens, time.monotonic() of the last refill)
+        self._buckets = {}
+        self._fail_next = []
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        # (event id, encoded event) for every change, oldest first
+        self._events = []
+        self._stopping = False
+
+        light_ids = [str(number) for number in range(1, lights + 1)]
+        if groups is None:
+            groups = {'1': light_ids}
+
+        self.state = {
+            'lights': {light_id: self._new_light(light_id)
+                       for light_id in light_ids},
+            'groups': {str(group_id): self._new_group(group_id, members)
+                       for group_id, members in groups.items()},
+            'scenes': {},
+            'config': {
+                'name': 'Lumen fake bridge',
+                'bridgeid': '001788FFFE000000',
+                'apiversion': '1.50.0',
+                'modelid': 'BSB002'
+            }
+        }
+
+        self._server = ThreadingHTTPServer((host, port), _FakeBridgeHandler)
+        self._server.daemon_threads = True
+        self._server.bridge = self
+        self._thread = None
+
+    @property
+    def address(self):
+        """
+        Returns:
+            str: "host:port" the bridge is reachable at.
+        """
+        host, port = self._server.server_address[:2]
+        return "{}:{}".format(host, port)
+
+    def start(self):
+        """
+        Starts serving requests in a background thread.
+
+        Returns:
+            FakeBridge: The bridge itself, for chaining.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="FakeBridge", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the server and closes its socket.
+        """
+        with self._changed:
+            self._stopping = True
+            self._changed.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def handle(self, method, path, body):
+        """
+        Answers a single request.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The requested path.
+            body: The decoded JSON body, None for GET and DELETE.
+
+        Returns:
+            tuple: (HTTP status, response body as JSON encoded bytes).
+        """
+        delay = self.latency
+        if self.jitter:
+            with self._lock:
+                delay += self._random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+
+        parts = [part for part in path.split('/') if part]
+        with self._lock:
+            self.request_count += 1
+            # Encoded while holding the lock, the state may be changed
+            # by other requests as soon as it is released.
+            status, payload = self._dispatch(method, path, parts, body)
+            return status, json.dumps(payload).encode('utf-8')
+
+    def set_light_state(self, light_id, state):
+        """
+        Changes a light outside of the API, as a wall switch or the
+        phone app would, and publishes the change on the event stream.
+
+        Args:
+            light_id (str): The ID of the light.
+            state (dict): The state attributes to change.
+        """
+        with self._lock:
+            self._set_lights([str(light_id)], ['lights', str(light_id)],
+                             state)
+
+    def fail_next(self, count=1, error_type=901,
+                  description="Internal error, 503"):
+        """
+        Makes the next light or group commands fail with an error.
+
+        Args:
+            count (int, optional): Number of commands to fail.
+            error_type (int, optional): The bridge error type.
+                                        Defaults to 901.
+            description (str, optional): The error description.
+        """
+        with self._lock:
+            self._fail_next.extend([(error_type, description)] * count)
+
+    def wait_for_events(self, last_event_id, timeout):
+        """
+        Waits for events newer than the given one.
+
+        Args:
+            last_event_id (int): The last event already delivered,
+                                 0 for none.
+            timeout (float): Seconds to wait for a new event.
+
+        Returns:
+            list: (event id, encoded event) tuples, or None once the
+                  bridge is stopping.
+        """
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self._stopping or (self._events and
+                                           self._events[-1][0] > last_event_id),
+                timeout)
+            if self._stopping:
+                return None
+            return [event for event in self._events
+                    if event[0] > last_event_id]
+
+    def _publish(self, light_id, state):
+        """
+        Appends a v2 update event for a light. Must be called with the
+        lock held.
+        """
+        resource = {'id': "light-{}".format(light_id),
+                    'id_v1': "/lights/{}".format(light_id),
+                    'type': 'light'}
+        if 'on' in state:
+            resource['on'] = {'on': state['on']}
+        if 'bri' in state:
+            resource['dimming'] = {'brightness': state['bri'] * 100 / 254}
+        if 'xy' in state:
+            resource['color'] = {'xy': {'x': state['xy'][0],
+                                        'y': state['xy'][1]}}
+        if 'ct' in state:
+            resource['color_temperature'] = {'mirek': state['ct']}
+
+        event_id = len(self._events) + 1
+        event = [{'id': "event-{}".format(event_id),
+                  'creationtime': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                                time.gmtime()),
+                  'type': 'update',
+                  'data': [resource]}]
+        self._events.append((event_id, json.dumps(event)))
+        self._changed.notify_all()
+
+    def _dispatch(self, method, path, parts, body):
+        if parts == ['api'] and method == 'POST':
+            return 200, [{'success': {'username': self.username}}]
+        if parts == ['api', 'config']:
+            return 200, self._public_config()
+        if len(parts) < 2 or parts[0] != 'api':
+            return 404, self._error(4, path, "method not available")
+        if parts[1] != self.username:
+            return 200, self._error(1, '/', "unauthorized user")
+        return self._route(method, parts[2:], body)
+
+    def _route(self, method, parts, body):
+        if not parts:
+            return 200, self.state
+        resource = parts[0]
+        if resource not in self.state:
+            return 200, self._error(4, '/' + resource, "method not available")
+
+        if method == 'GET':
+            if len(parts) == 1:
+                return 200, self.state[resource]
+            item = self._lookup(resource, parts[1])
+            if item is None:
+                return 200, self._not_found(parts)
+            return 200, item
+
+        if resource == 'scenes' and method in ('POST', 'PUT'):
+            return 200, self._store_scene(parts, body)
+        if resource == 'scenes' and method == 'DELETE' and len(parts) == 2:
+            if self.state['scenes'].pop(parts[1], None) is None:
+                return 200, self._not_found(parts)
+            return 200, [{'success': "/scenes/{} deleted".format(parts[1])}]
+
+        if method == 'PUT' and len(parts) == 3:
+            if resource == 'lights' and parts[2] == 'state':
+                refused = self._refuse("light", parts)
+                if refused:
+                    return refused
+                self.commands.append((time.monotonic(), "light", parts[1],
+                                      body))
+                return 200, self._set_lights([parts[1]], parts, body)
+            if resource == 'groups' and parts[2] == 'action':
+                refused = self._refuse("group", parts)
+                if refused:
+                    return refused
+                self.commands.append((time.monotonic(), "group", parts[1],
+                                      body))
+                return 200, self._set_group(parts[1], parts, body)
+
+        return 200, self._error(4, '/' + '/'.join(parts),
+                                "method not available")
+
+    def _refuse(self, kind, parts):
+        """
+        Decides whether a command is refused, for an injected error or
+        for exceeding the rate limits. Must be called with the lock held.
+
+        Returns:
+            tuple: (HTTP status, error response), or None when the
+                   command is accepted.
+        """
+        address = '/' + '/'.join(parts)
+        if self._fail_next:
+            error_type, description = self._fail_next.pop(0)
+            self.errors += 1
+            return 200, self._error(error_type, address, description)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors += 1
+            return 200, self._error(901, address, "Internal error, 503")
+
+        rate = (self.rate_limits or {}).get(kind)
+        if rate:
+            # A token bucket holding a second worth of commands, and at
+            # least two so network jitter alone does not get a client
+            # sending at exactly the limit refused.
+            capacity = max(rate, 2.0)
+            now = time.monotonic()
+            tokens, refilled = self._buckets.get(kind, (capacity, now))
+            tokens = min(capacity, tokens + (now - refilled) * rate)
+            if tokens < 1:
+                self._buckets[kind] = (tokens, now)
+                self.throttled += 1
+                return 429, self._error(901, address, "Internal error, "
+                                        "503: too many commands")
+            self._buckets[kind] = (tokens - 1, now)
+        return None
+
+    def _lookup(self, resource, item_id):
+        if resource == 'groups' and item_id == '0':
+            return self._new_group('0', list(self.state['lights']))
+        return self.state[resource].get(item_id)
+
+    def _store_scene(self, parts, body):
+        if len(parts) == 1:
+            number = len(self.state['scenes']) + 1
+            while "scene{}".format(number) in self.state['scenes']:
+                number += 1
+            scene_id = "scene{}".format(number)
+            self.state['scenes'][scene_id] = {
+                'name': body.get('name', scene_id),
+                'type': body.get('type', 'LightScene'),
+                'group': body.get('group'),
+                'lights': list(body.get('lights', [])),
+                'lightstates': {},
+                'appdata': {}
+            }
+        elif len(parts) == 2 and parts[1] in self.state['scenes']:
+            scene_id = parts[1]
+        else:
+            return self._not_found(parts)
+        scene = self.state['scenes'][scene_id]
+        for key in ('name', 'lights', 'lightstates', 'appdata'):
+            if key in body:
+                scene[key] = body[key]
+        if len(parts) == 1:
+            return [{'success': {'id': scene_id}}]
+        return self._success(parts, body)
+
+    def _recall_scene(self, scene_id, parts, body):
+        scene = self.state['scenes'].get(scene_id)
+        if scene is None:
+            return self._not_found(['scenes', scene_id])
+        for light_id, state in scene['lightstates'].items():
+            self._set_lights([light_id], parts, state)
+        return self._success(parts, body)
+
+    def _set_group(self, group_id, parts, body):
+        if 'scene' in (body or {}):
+            return self._recall_scene(body['scene'], parts, body)
+        if group_id == '0':
+            light_ids = list(self.state['lights'])
+        elif group_id in self.state['groups']:
+            group = self.state['groups'][group_id]
+            group['action'].update(self._state_only(body))
+            light_ids = group['lights']
+        else:
+            return self._not_found(parts)
+        self._set_lights(light_ids, parts, body)
+        return self._success(parts, body)
+
+    def _set_lights(self, light_ids, parts, body):
+        for light_id in light_ids:
+            light = self.state['lights'].get(light_id)
+            if light is None:
+                return self._not_found(parts)
+            state = self._state_only(body)
+            light['state'].update(state)
+            self._publish(light_id, state)
+        return self._success(parts, body)
+
+    def _state_only(self, body):
+        return {key: value for key, value in (body or {}).items()
+                if key != 'transitiontime'}
+
+    def _success(self, parts, body):
+        address = '/' + '/'.join(parts)
+        return [{'success': {address + '/' + key: value}}
+                for key, value in (body or {}).items()]
+
+    def _not_found(self, parts):
+        address = '/' + '/'.join(parts)
+        return self._error(3, address,
+                           "resource, {}, not available".format(address))
+
+    def _error(self, error_type, address, description):
+        return [{'error': {'type': error_type,
+                           'address': address,
+                           'description': description}}]
+
+    def _public_config(self):
+        config = self.state['config']
+        return {key: config[key] for key in
+                ('name', 'bridgeid', 'apiversion', 'modelid')}
+
+    def _new_light(self, light_id):
+        return {
+            'name': "Light {}".format(light_id),
+            'type': 'Extended color light',
+            'modelid': 'LCT015',
+            'uniqueid': "00:17:88:01:00:00:00:{:02x}-0b".format(
+                int(light_id) % 256),
+            'state': {'on': False, 'bri': 150, 'xy': [0.5, 0.5],
+                      'ct': 366, 'colormode': 'xy', 'reachable': True}
+        }
+
+    def _new_group(self, group_id, members):
+        return {
+            'name': "Group {}".format(group_id),
+            'type': 'LightGroup' if str(group_id) == '0' else 'Room',
+            'class': 'Living room',
+            'lights': [str(light_id) for light_id in members],
+            'action': {'on': False, 'bri': 150, 'xy': [0.5, 0.5]}
+        }
+
+
+class _FakeBridgeHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive, like the real bridge does.
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, without this the delayed
+    # ACK on the client stalls every keep-alive response.
+    disable_nagle_algorithm = True
+
+    def _respond(self):
+        if self.path.startswith('/eventstream/'):
+            self._stream_events()
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        status, data = self.server.bridge.handle(self.command,
+                                                 self.path, body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_PUT = do_POST = do_DELETE = _respond
+
+    def _stream_events(self):
+        bridge = self.server.bridge
+        if not bridge.event_stream:
+            self.send_error(404)
+            return
+        if self.headers.get('hue-application-key') != bridge.username:
+            self.send_error(403)
+            return
+
+        last_event_id = int(self.headers.get('Last-Event-ID') or 0)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        try:
+            self.wfile.write(b': hi\n\n')
+            while True:
+                events = bridge.wait_for_events(last_event_id, timeout=1.0)
+                if events is None:
+                    return
+                for event_id, data in events:
+                    self.wfile.write("id: {}\ndata: {}\n\n".format(
+                        event_id, data).encode('utf-8'))
+                    last_event_id = event_id
+        except OSError:
+            # The client went away.
+            return
+
+    def log_message(self, format, *args):
+        pass
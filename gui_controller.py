@@ -1,7 +1,8 @@
 import tkinter as tk
 from tkinter import ttk
-from phue import Bridge
 from hue_controller import HueController
+from command_executor import call_when_done
+from view_model import CanvasPainter, ViewModel
 
 class PowerControlFrame(ttk.Frame):
     """
@@ -13,10 +14,16 @@ class PowerControlFrame(ttk.Frame):
                     or off.
     - canvas (tk.Canvas): A canvas displaying a visual representation 
                           of the light's state.
+    - painter (CanvasPainter): Leaves out canvas updates that change
+                               nothing.
+    - target (tuple): ("light" or "group", ID) the switch controls.
 
     Methods:
     - toggle_lights(event=None): Toggles the state of the light between 
                                  on and off.
+    - refresh(): Shows the state of the lights known to the controller.
+    - needs_refresh(dirty): Tells whether changed lights or groups 
+                            affect the state shown.
     """
     
     # CONSTANTS
@@ -36,6 +43,8 @@ class PowerControlFrame(ttk.Frame):
 
         # Boolean flag to keep track of ON/OFF status for lights
         self.is_on = False  
+        self._latest_toggle = None
+        self.target = ("group", "0")
 
         self.light_switch_label = \
             ttk.Label(self, text="Light Switch", justify='center')
@@ -65,10 +74,13 @@ class PowerControlFrame(ttk.Frame):
                                                    tags="toggle_text")
         
         self.canvas.grid(row=1, column=0, columnspan=2)
+        self.painter = CanvasPainter(self.canvas)
         
         # Binding mouse click to the toggle button
         self.canvas.tag_bind("toggle", "<Button-1>", self.toggle_lights)
 
+        self.refresh()
+
     def toggle_lights(self, event=None):
         """
         Toggle the state of the lights and update the 
@@ -96,16 +108,71 @@ class PowerControlFrame(ttk.Frame):
                        lights.
         """
 
-        if self.is_on:
-            self.controller._turn_off_lights_group(0)
-            self.canvas.itemconfig(self.toggle_button, fill="red")
-            self.canvas.itemconfig(self.toggle_text, text="OFF")
-            self.is_on = False
+        # The canvas is updated right away, the command is sent in the 
+        # background and the switch is reverted should it fail.
+        kind, target_id = self.target
+        future = self.controller.set_power(kind, target_id, not self.is_on)
+        self._show_state(not self.is_on)
+        self._latest_toggle = future
+        call_when_done(self, future, self._on_toggle_done)
+
+    def _show_state(self, is_on):
+        """
+        Updates the toggle button to show the lights as on or off.
+
+        Args:
+            is_on (bool): The state to show.
+        """
+        self.is_on = is_on
+        if is_on:
+            self.painter.configure(self.toggle_button, fill="green")
+            self.painter.configure(self.toggle_text, text="ON")
         else:
-            self.controller._turn_on_lights_group(0)
-            self.canvas.itemconfig(self.toggle_button, fill="green")
-            self.canvas.itemconfig(self.toggle_text, text="ON")
-            self.is_on = True
+            self.painter.configure(self.toggle_button, fill="red")
+            self.painter.configure(self.toggle_text, text="OFF")
+
+    def refresh(self):
+        """
+        Shows the state of the lights as known to the controller, 
+        e.g. after someone used a wall switch.
+        """
+        self._show_state(self.controller.is_on(*self.target))
+
+    def needs_refresh(self, dirty):
+        """
+        Tells whether the shown state should be refreshed after lights
+        or groups changed. While a toggle is on its way the switch keeps
+        showing it, _on_toggle_done refreshes once it is answered.
+
+        Args:
+            dirty (set): (kind, target_id) tuples that changed, or 
+                         holding ViewModel.EVERYTHING.
+
+        Returns:
+            bool: True if the change affects the target and no toggle
+                  is pending.
+        """
+        if self._latest_toggle is not None and \
+                not self._latest_toggle.done():
+            return False
+        if ViewModel.EVERYTHING in dirty or \
+                tuple(map(str, self.target)) in dirty:
+            return True
+        return any(("light", light_id) in dirty for light_id in
+                   self.controller.target_lights(*self.target))
+
+    def _on_toggle_done(self, future):
+        """
+        Shows the state known to the controller once the newest toggle
+        was answered, the one it asked for unless the bridge call 
+        failed. Calls superseded by a newer toggle are ignored.
+
+        Args:
+            future (Future): The finished bridge call.
+        """
+        if future is not self._latest_toggle or future.cancelled():
+            return
+        self.refresh()
 
 
 class ColorControlFrame(ttk.Frame):
@@ -119,11 +186,14 @@ class ColorControlFrame(ttk.Frame):
                                 color.
     - lamp_canvas (tk.Canvas): A visual representation of the current 
                                light color.
+    - target (tuple): ("light" or "group", ID) the color is set on.
+    - on_error (callable): Called with a message when a color could not
+                           be set, or None.
 
     Methods:
     - set_color(): Updates the light color based on user selection.
     """
-    def __init__(self, parent, controller: HueController):
+    def __init__(self, parent, controller: HueController, on_error=None):
         """
         Initialize the ColorControlFrame widget.
 
@@ -138,11 +208,13 @@ class ColorControlFrame(ttk.Frame):
         - controller: An instance of the HueController 
                       which manages the interaction 
                       with the Philips Hue lights.
+        - on_error (callable, optional): Called with a message when a
+                                         color could not be set.
 
         Attributes:
         - controller (HueController): 
                         Singleton instance of the HueController.
-        - colors (list): List of available colors for the lights.
+        - colors (list): The color names from the configuration.
         - color_var (tk.StringVar): Holds the current selected color 
                                     from the dropdown.
         - color_dropdown (ttk.Combobox): Dropdown menu for color 
@@ -158,8 +230,11 @@ class ColorControlFrame(ttk.Frame):
 
         # Singleton instance of the hue controller
         self.controller = controller
+        self.on_error = on_error
 
-        self.colors = ['RED', 'GREEN', 'BLUE', 'YELLOW', 'WHITE']
+        self.target = ("group", "0")
+        self.colors = list(
+            controller.config.get_setting("color_coordinates", {}))
         self.color_var = tk.StringVar()
         self.color_dropdown = ttk.Combobox(self, 
                                            values=self.colors, 
@@ -175,9 +250,14 @@ class ColorControlFrame(ttk.Frame):
         self.lamp_canvas = tk.Canvas(self, width=50, height=50, 
                                      bg="black", highlightthickness=0)
         
-        # Color selection will also update the color of the lamp representation
+        # Color selection will also update the color of the lamp 
+        # representation, converted from the color the lights will show.
+        # Converting needs the color engine, which is loaded in the 
+        # background once the window is shown so it never delays it.
         self.lamp_representation = \
-            self.lamp_canvas.create_oval(10, 10, 40, 40, fill="WHITE")
+            self.lamp_canvas.create_oval(10, 10, 40, 40, fill="ivory")
+        self._preview_requested = False
+        self.bind("<Map>", self._load_preview, "+")
 
         # Grid layout to arrange the diffrent elements of the Widget
         self.color_dropdown.grid(row=0, column=0, 
@@ -192,6 +272,25 @@ class ColorControlFrame(ttk.Frame):
                               padx=0, pady=10, 
                               sticky=tk.W)
 
+    def _load_preview(self, event=None):
+        if self._preview_requested:
+            return
+        self._preview_requested = True
+        self._request_preview(self.color_var.get())
+
+    def _request_preview(self, color):
+        # The color engine may still be loading, the preview is 
+        # converted on the executor and shown once ready. A newer
+        # selection cancels a preview not started yet.
+        future = self.controller.run_async(self.controller.preview_color,
+                                           color, key=("preview",))
+        call_when_done(self, future, self._show_preview)
+
+    def _show_preview(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self.lamp_canvas.itemconfig(self.lamp_representation, 
+                                        fill=future.result())
+
     def set_color(self):
         """
         Apply selected color to the lights and update the lamp 
@@ -209,8 +308,31 @@ class ColorControlFrame(ttk.Frame):
                                state of the hui lamps.
         """
         color = self.color_var.get()
-        self.lamp_canvas.itemconfig(self.lamp_representation, fill=color)
-        self.controller._set_light_settings(0, color=color)
+        kind, target_id = self.target
+        # Queued like the brightness, a color that is not configured,
+        # e.g. one typed into the dropdown, is refused right here.
+        try:
+            future = self.controller.submit_light_settings(
+                target_id, color=color, kind=kind)
+        except ValueError as error:
+            self._report(error)
+            return
+        self._request_preview(color)
+        call_when_done(self, future, self._on_color_done)
+
+    def _on_color_done(self, future):
+        """
+        Reports a color the bridge could not be sent.
+
+        Args:
+            future (Future): The finished bridge call.
+        """
+        if not future.cancelled() and future.exception() is not None:
+            self._report(future.exception())
+
+    def _report(self, error):
+        if self.on_error is not None:
+            self.on_error("Color not set: {}".format(error))
 
 
 class BrightnessControlFrame(ttk.Frame):
@@ -221,10 +343,12 @@ class BrightnessControlFrame(ttk.Frame):
     Attributes:
     - brightness_slider (tk.Scale): A slider to adjust the brightness 
                                     level.
+    - target (tuple): ("light" or "group", ID) the brightness is set on.
 
     Methods:
     - set_brightness(event): Updates the light brightness based on the 
                              slider's currently read value.
+    - refresh(): Shows the brightness known to the controller.
     """
     
     def __init__(self, parent, controller: HueController):
@@ -265,9 +389,25 @@ class BrightnessControlFrame(ttk.Frame):
                                           sliderrelief='solid',
                                           bg='yellow')
         
-        self.brightness_slider.set(150)  # Neutral Initial setting
+        # Neutral Initial setting, unless the brightness is known.
+        self.target = ("group", "0")
+        self._shown_value = None
+        self.refresh()
         self.brightness_slider.grid(row=1, column=0, columnspan=2, pady=10)
 
+    def refresh(self):
+        """
+        Moves the slider to the brightness known to the controller 
+        without sending it back to the lights.
+        """
+        brightness = self.controller.brightness(*self.target)
+        value = 150 if brightness is None else brightness
+        # Tk runs the slider command for values set from code too, 
+        # set_brightness skips the one it runs for this value.
+        if value != int(self.brightness_slider.get()):
+            self._shown_value = value
+        self.brightness_slider.set(value)
+
     def set_brightness(self, event):
         """
         Adjusts the light brightness based on the slider's value.
@@ -282,23 +422,365 @@ class BrightnessControlFrame(ttk.Frame):
             event: Event data captured from the slider's value change.
         """
         brightness_value = int(self.brightness_slider.get())
-        brightness_levels = \
-            self.controller.config.get_setting("brightness_levels")
-        
-        label = "NEUTRAL" # Default label
-
-        # Loops through all the brightness levels (stored in config.json)
-        # And sets brightness to the nearest label using the threshold.
-        for level, threshold in sorted(brightness_levels.items(),
-                                       key=lambda item: item[1], reverse=True):
-            # TODO In a future update this logic might be made legacy and
-            # Brightness instead set directly without the aid of thresholds.
-            if brightness_value >= threshold:
-                label = level
-                break
-        
-        
-        self.controller._set_light_settings(0, brightness=label)
+        shown_value, self._shown_value = self._shown_value, None
+        if brightness_value == shown_value:
+            return
+
+        # The label for every slider value is precomputed from the
+        # thresholds in the configuration (JSON).
+        # TODO In a future update this logic might be made legacy and
+        # Brightness instead set directly without the aid of thresholds.
+        label = self.controller.config.label_for_brightness(brightness_value)
+
+        # Queued rather than sent, a drag produces far more events than
+        # the bridge accepts and only the newest brightness matters.
+        kind, target_id = self.target
+        self.controller.submit_light_settings(target_id, brightness=label,
+                                              kind=kind)
+
+
+class TargetFrame(ttk.Frame):
+    """
+    A tkinter Frame Container Widget for choosing the lights the other
+    controls act on: all lights, a room or group, or a single light, 
+    listed by the names they have in the Hue app.
+
+    Attributes:
+    - target (tuple): ("light" or "group", ID) currently chosen.
+    - choices (dict): Label shown -> target.
+
+    Methods:
+    - rebuild(): Lists the groups and lights of the bridge topology.
+    """
+
+    ALL_LIGHTS = "All lights"
+
+    def __init__(self, parent, controller: HueController, on_change=None):
+        """
+        Args:
+            parent: The parent widget.
+            controller (HueController): Singleton instance controlling
+                                        the Hue lights.
+            on_change (callable, optional): Called with the new target
+                                            when another one is chosen.
+        """
+        super().__init__(parent)
+        self.controller = controller
+        self.on_change = on_change
+        self.target = ("group", "0")
+        self.choices = {self.ALL_LIGHTS: self.target}
+
+        self.target_var = tk.StringVar(value=self.ALL_LIGHTS)
+        self.target_dropdown = ttk.Combobox(self, state='readonly',
+                                            values=list(self.choices),
+                                            textvariable=self.target_var)
+        self.target_dropdown.bind("<<ComboboxSelected>>", self._on_select)
+        self.target_dropdown.grid(row=0, column=0, padx=5)
+
+    def rebuild(self):
+        """
+        Lists rooms first, then the other groups, then the lights, by
+        name once the topology is known and by ID until then. Keeps 
+        the current target when it still exists.
+        """
+        topology = self.controller.topology
+        cache = self.controller.state_cache
+        order = lambda target_id: (len(target_id), target_id)
+        rooms = set(topology.rooms())
+        groups = sorted((group_id for group_id in cache.group_ids()
+                         if group_id != '0'),
+                        key=lambda group_id: (group_id not in rooms,
+                                              order(group_id)))
+        choices = {self.ALL_LIGHTS: ("group", "0")}
+        for kind, ids in (("group", groups),
+                          ("light", sorted(cache.group_lights(0), 
+                                           key=order))):
+            for target_id in ids:
+                name = topology.get(kind, target_id).get('name') or \
+                    "{} {}".format(kind.capitalize(), target_id)
+                label = name if name not in choices else \
+                    "{} ({})".format(name, target_id)
+                choices[label] = (kind, target_id)
+        if choices == self.choices:
+            return
+
+        self.choices = choices
+        self.target_dropdown.configure(values=list(choices))
+        labels = {target: label for label, target in choices.items()}
+        if self.target in labels:
+            self.target_var.set(labels[self.target])
+        else:
+            self.target_var.set(self.ALL_LIGHTS)
+            self._on_select()
+
+    def _on_select(self, event=None):
+        self.target = self.choices.get(self.target_var.get(), 
+                                       ("group", "0"))
+        if self.on_change is not None:
+            self.on_change(self.target)
+
+
+class LightGridFrame(ttk.Frame):
+    """
+    A tkinter Frame Container Widget showing every group and light
+    known to the bridge as a tile, colored like the light and grey 
+    while off. Clicking a tile toggles its lights.
+
+    The tiles are items of a single canvas rather than widgets, and 
+    only the tiles of lights that changed are redrawn, so the grid 
+    stays cheap for the Tk main loop with hundreds of lights.
+
+    Attributes:
+    - canvas (tk.Canvas): The scrollable canvas holding the tiles.
+    - painter (CanvasPainter): Leaves out tile updates that change 
+                               nothing.
+    - tiles (dict): (kind, target_id) -> (rectangle, text) item IDs.
+                    Tiles are labeled with the names from the topology.
+
+    Methods:
+    - rebuild(): Lays out one tile per group and light in the state 
+                 cache.
+    - render(dirty): Redraws the tiles of the lights and groups that 
+                     changed.
+    """
+
+    COLUMNS = 10
+    VISIBLE_ROWS = 4
+    TILE_WIDTH = 44
+    TILE_HEIGHT = 30
+    TILE_PAD = 4
+    OFF_COLOR = "gray20"
+    # Shown for lights that are on until the color engine is loaded.
+    ON_COLOR = "ivory"
+    # Characters of a name that fit on a tile.
+    LABEL_LENGTH = 7
+
+    def __init__(self, parent, controller: HueController):
+        super().__init__(parent)
+        self.controller = controller
+        self.tiles = {}
+        self._keys = {}
+        self._engine = None
+        self._engine_future = None
+        self._colors = {}
+
+        width = self.TILE_PAD + self.COLUMNS * (self.TILE_WIDTH 
+                                                + self.TILE_PAD)
+        self.canvas = tk.Canvas(self, width=width, height=0, bg="black",
+                                highlightthickness=0)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL,
+                                       command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.canvas.grid(row=0, column=0)
+        self.scrollbar.grid(row=0, column=1, sticky=tk.NS)
+        self.painter = CanvasPainter(self.canvas)
+
+        self.canvas.tag_bind("tile", "<Button-1>", self._on_click)
+
+    def rebuild(self):
+        """
+        Lays out one tile per group and light in the state cache, 
+        groups first. Nothing is redrawn when they did not change.
+
+        Returns:
+            bool: True if the tiles were laid out again.
+        """
+        cache = self.controller.state_cache
+        order = lambda target_id: (len(target_id), target_id)
+        groups = [("group", group_id) for group_id in
+                  sorted(cache.group_ids(), key=order) if group_id != '0']
+        lights = [("light", light_id) for light_id in
+                  sorted(cache.group_lights(0), key=order)]
+        if list(self.tiles) == groups + lights:
+            return False
+
+        self.canvas.delete("tile")
+        self.painter.forget()
+        self.tiles = {}
+        self._keys = {}
+        index = 0
+        for section in (groups, lights):
+            for kind, target_id in section:
+                row, column = divmod(index, self.COLUMNS)
+                x = self.TILE_PAD + column * (self.TILE_WIDTH 
+                                              + self.TILE_PAD)
+                y = self.TILE_PAD + row * (self.TILE_HEIGHT + self.TILE_PAD)
+                rectangle = self.canvas.create_rectangle(
+                    x, y, x + self.TILE_WIDTH, y + self.TILE_HEIGHT,
+                    fill=self.OFF_COLOR, width=2, tags="tile",
+                    outline="ivory" if kind == "group" else "gray50")
+                text = self.canvas.create_text(
+                    x + self.TILE_WIDTH // 2, y + self.TILE_HEIGHT // 2,
+                    fill="ivory", font=("Arial", 8), tags="tile")
+                self.tiles[(kind, target_id)] = (rectangle, text)
+                self._keys[rectangle] = self._keys[text] = (kind, target_id)
+                index += 1
+            # Lights start on a row of their own.
+            index = -(-index // self.COLUMNS) * self.COLUMNS
+
+        rows = index // self.COLUMNS
+        height = self.TILE_PAD + rows * (self.TILE_HEIGHT + self.TILE_PAD)
+        self.canvas.configure(
+            scrollregion=(0, 0, self.canvas.winfo_reqwidth(), height),
+            height=min(height, self.TILE_PAD + self.VISIBLE_ROWS 
+                       * (self.TILE_HEIGHT + self.TILE_PAD)))
+        return True
+
+    def render(self, dirty):
+        """
+        Redraws the tiles of the lights and groups that changed. Group
+        tiles follow their lights, so they are always redrawn.
+
+        Args:
+            dirty (set): (kind, target_id) tuples as handed out by the
+                         ViewModel.
+        """
+        if ViewModel.EVERYTHING in dirty:
+            self.rebuild()
+            keys = list(self.tiles)
+        elif any(kind == "group" for kind, _ in dirty):
+            # A group command changed all of its lights.
+            keys = list(self.tiles)
+        else:
+            keys = [key for key in self.tiles
+                    if key[0] == "group" or key in dirty]
+        for kind, target_id in keys:
+            self._paint(kind, target_id)
+
+    def _paint(self, kind, target_id, is_on=None):
+        """
+        Colors a tile like the cached state of its light or group.
+
+        Args:
+            kind (str): "light" or "group".
+            target_id (str): The ID of the light or group.
+            is_on (bool, optional): Shown instead of the cached power
+                                    state.
+        """
+        rectangle, text = self.tiles[(kind, target_id)]
+        cache = self.controller.state_cache
+        if kind == "group":
+            state = cache.get("group", target_id)
+            on = self.controller.is_group_on(target_id)
+            bri = self.controller.group_brightness(target_id)
+        else:
+            state = cache.get("light", target_id)
+            on = state.get('on')
+            bri = state.get('bri')
+        if is_on is not None:
+            on = is_on
+        fill = self._color(state.get('xy'), bri) if on else self.OFF_COLOR
+        self.painter.configure(rectangle, fill=fill)
+        self.painter.configure(text, fill="black" if on else "ivory",
+                               text=self._label(kind, target_id))
+
+    def _label(self, kind, target_id):
+        name = self.controller.topology.get(kind, target_id).get('name')
+        if name:
+            return name[:self.LABEL_LENGTH]
+        return "G" + target_id if kind == "group" else target_id
+
+    def _color(self, xy, bri):
+        """
+        Returns the screen color of a light, computed once per color.
+        """
+        if xy is None:
+            return self.ON_COLOR
+        if self._engine is None:
+            self._load_engine()
+            return self.ON_COLOR
+        # Brightness steps of 8 are hard to tell apart on screen.
+        key = (round(xy[0], 3), round(xy[1], 3), (bri or 254) & ~7)
+        color = self._colors.get(key)
+        if color is None:
+            color = self._colors[key] = \
+                self._engine.preview_color(key[:2], key[2])
+        return color
+
+    def _load_engine(self):
+        # Building the color engine takes a moment, it is done in the
+        # background and every tile redrawn once it is ready.
+        if self._engine_future is None:
+            self._engine_future = self.controller.run_async(
+                lambda: self.controller.color_engine)
+            call_when_done(self, self._engine_future, self._on_engine_loaded)
+
+    def _on_engine_loaded(self, future):
+        if future.exception() is None:
+            self._engine = future.result()
+            self.render(set(self.tiles))
+
+    def _on_click(self, event=None):
+        """
+        Toggles the lights of the clicked tile. The tile is updated 
+        right away and shows the cached state again should the bridge
+        call fail.
+        """
+        items = self.canvas.find_withtag("current")
+        key = self._keys.get(items[0]) if items else None
+        if key is None:
+            return
+        kind, target_id = key
+        if kind == "group":
+            is_on = not self.controller.is_group_on(target_id)
+        else:
+            is_on = not self.controller.state_cache.get(
+                "light", target_id).get('on')
+        future = self.controller.set_power(kind, target_id, is_on)
+        self._paint(kind, target_id, is_on)
+        call_when_done(self, future, lambda done: self._on_click_done(
+            done, key))
+
+    def _on_click_done(self, future, key):
+        if not future.cancelled() and future.exception() is not None:
+            self.render({key})
+
+
+class MetricsPanel(tk.Toplevel):
+    """
+    A debug window showing the requests sent to the bridge, their
+    latency and the errors the bridge answered with. Opening it turns
+    on the controller's metrics.
+
+    Methods:
+    - refresh(): Shows the current metrics and schedules the next 
+                 refresh.
+    """
+
+    REFRESH_MS = 1000
+
+    def __init__(self, parent, controller: HueController):
+        super().__init__(parent)
+        self.title("Bridge metrics")
+        self.configure(bg="black")
+        self.controller = controller
+        self.metrics = controller.enable_metrics()
+
+        self.text = tk.Text(self, width=72, height=20, bg="black",
+                            fg="ivory", font=("Courier", 10))
+        self.text.pack(fill='both', expand=True, padx=5, pady=5)
+        self.refresh()
+
+    def refresh(self):
+        snapshot = self.metrics.snapshot()
+        lines = ["{:<36} {:>8} {:>8} {:>10}".format(
+            "endpoint", "requests", "failed", "mean ms")]
+        for endpoint, stats in sorted(snapshot['endpoints'].items()):
+            lines.append("{:<36} {:>8} {:>8} {:>10.1f}".format(
+                endpoint, stats['requests'], stats['failures'],
+                stats['mean_ms']))
+        lines.append("")
+        for (endpoint, code), count in sorted(snapshot['errors'].items()):
+            lines.append("error {:<8} {:<36} {:>6}".format(
+                code, endpoint, count))
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append("{:<36} {:>8}".format(name, value))
+
+        self.text.configure(state='normal')
+        self.text.delete('1.0', 'end')
+        self.text.insert('end', "\n".join(lines))
+        self.text.configure(state='disabled')
+        self.after(self.REFRESH_MS, self.refresh)
 
 
 class HueControllerGUI(tk.Tk):
@@ -307,13 +789,23 @@ class HueControllerGUI(tk.Tk):
     extending the HueController.
 
     Attributes:
+    - target_frame (TargetFrame): 
+                Chooses the lights the controls act on.
     - power_frame (PowerControlFrame): 
                 A Frame of controls for light toggling.
     - color_frame (ColorControlFrame): 
                 A Frame for selecting and setting light color.
     - brightness_frame (BrightnessControlFrame): 
                 A Frame dedicated to adjusting the light brightness.
+    - light_grid (LightGridFrame): 
+                A tile per group and light, clicked to toggle them.
+    - view_model (ViewModel): 
+                Collects state changes and redraws the frames at most
+                once per frame.
+    - metrics_panel (MetricsPanel): 
+                The bridge metrics window, opened with F12.
     """
+
     def __init__(self, controller: HueController):
         """
         Initializes the HueControllerGUI main application window.
@@ -335,13 +827,125 @@ class HueControllerGUI(tk.Tk):
         style.configure('TFrame', background='black')
         style.configure('TLabel', background='black', foreground='ivory')
         self.configure(bg="black")
+        self.target_frame = TargetFrame(self, controller, 
+                                        on_change=self.set_target)
         self.power_frame = PowerControlFrame(self, controller)
-        self.color_frame = ColorControlFrame(self, controller)
+        self.color_frame = ColorControlFrame(
+            self, controller, on_error=self.show_status)
         self.brightness_frame = BrightnessControlFrame(self, controller)
+        self.light_grid = LightGridFrame(self, controller)
+
+        self.status_label = ttk.Label(self, justify='center')
 
+        self.target_frame.pack(pady=10)
         self.power_frame.pack(pady=10)
         self.color_frame.pack(pady=10)
         self.brightness_frame.pack(pady=10)
+        self.light_grid.pack(pady=10, padx=10)
+        self.status_label.pack(pady=5)
+
+        self.controller = controller
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        self.metrics_panel = None
+        self.bind("<F12>", self.show_metrics)
+
+        # State changes arrive on the event stream and worker threads,
+        # they only mark what changed and the Tk thread redraws it once
+        # per frame however many arrived.
+        self.view_model = ViewModel(self)
+        self.view_model.add_view(self.render)
+        controller.state_cache.add_listener(
+            lambda kind, target_id, _: self.view_model.mark(kind, target_id))
+        # Lights and groups added, renamed or removed are rare, the 
+        # controls built from the topology are checked all at once.
+        controller.topology.add_listener(
+            lambda changes: self.view_model.invalidate())
+        self.view_model.start()
+
+        if controller.connected:
+            self.on_connected()
+        else:
+            # Shows the state restored from the journal, if any.
+            self.view_model.invalidate()
+            self.view_model.request_flush()
+            self.status_label.configure(text="Connecting to bridge...")
+
+    def on_connected(self, future=None):
+        """
+        Brings the window up to date once the controller is connected,
+        or shows why it could not connect.
+
+        Args:
+            future (Future, optional): The finished connection attempt,
+                                       when connecting in the background.
+        """
+        if future is not None and future.exception() is not None:
+            self.status_label.configure(
+                text="Bridge not found: {}".format(future.exception()))
+            return
+        self.status_label.configure(
+            text="Connected to {}".format(self.controller.bridge_ip))
+        self.brightness_frame.refresh()
+        self.view_model.invalidate()
+        self.view_model.request_flush()
+        self.controller.start_event_stream()
+        # Loads the color engine before the first color is picked.
+        self.controller.run_async(lambda: self.controller.color_engine)
+
+    def render(self, dirty):
+        """
+        Redraws what depends on the lights and groups that changed, 
+        called by the view model at most once per frame.
+
+        Args:
+            dirty (set): (kind, target_id) tuples that changed.
+        """
+        if ViewModel.EVERYTHING in dirty:
+            self.target_frame.rebuild()
+        if self.power_frame.needs_refresh(dirty):
+            self.power_frame.refresh()
+        self.light_grid.render(dirty)
+
+    def set_target(self, target):
+        """
+        Points the controls at another light or group and shows its 
+        state.
+
+        Args:
+            target (tuple): ("light" or "group", ID).
+        """
+        for frame in (self.power_frame, self.color_frame, 
+                      self.brightness_frame):
+            frame.target = target
+        self.power_frame.refresh()
+        self.brightness_frame.refresh()
+
+    def show_status(self, text):
+        """
+        Shows a message below the controls.
+
+        Args:
+            text (str): The message.
+        """
+        self.status_label.configure(text=text)
+
+    def show_metrics(self, event=None):
+        """
+        Opens the bridge metrics window, or raises it when already open.
+        """
+        if self.metrics_panel is None or \
+                not self.metrics_panel.winfo_exists():
+            self.metrics_panel = MetricsPanel(self, self.controller)
+        self.metrics_panel.lift()
+
+    def on_close(self):
+        """
+        Stops the controller's background workers and closes the window.
+        """
+        self.view_model.stop()
+        self.controller.close()
+        self.destroy()
 
 if __name__ == "__main__":
     """
@@ -1,7 +1,71 @@
 from config_manager import ConfigManager
-from phue import Bridge 
+from batch_commands import BatchResult, plan_batch
+from command_dispatcher import CommandDispatcher
+from command_executor import CommandExecutor
+from rate_limiter import BridgeOverloadError, RateLimiter
+from scene_compiler import SceneManager
+from sequencer import Sequencer, Timeline
+from state_cache import StateCache
+from state_journal import StateJournal
+from topology import Topology
 
+# phue, numpy and the network modules are imported where they are first
+# needed, which keeps them off the path to the first window (see
+# main.py --profile-startup).
+
+import logging
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Bridge error type for "Internal error, 503", sent when it is overloaded.
+OVERLOADED = 901
+
+
+def _bridge_errors(response):
+    """
+    Collects the errors of a bridge response. phue returns the answers
+    of a command as a list, per light for light commands.
+    """
+    if isinstance(response, list):
+        return [error for item in response for error in _bridge_errors(item)]
+    if isinstance(response, dict) and 'error' in response:
+        return [response['error']]
+    return []
+
+
+def _confirmed_settings(response, settings):
+    """
+    Picks the attributes of a command the bridge applied. The bridge
+    confirms every attribute with a "success" entry keyed by its 
+    address, e.g. "/lights/1/state/bri", and names the attribute it
+    rejected in the address of an "error" entry. An error on the whole
+    resource, e.g. "/lights/1/state", rejects every attribute. Without
+    any success entries only the rejected attributes are left out.
+    """
+    items = [response]
+    confirmed = set()
+    rejected = set()
+    answered = False
+    while items:
+        item = items.pop()
+        if isinstance(item, list):
+            items.extend(item)
+        elif isinstance(item, dict) and isinstance(item.get('success'), dict):
+            answered = True
+            confirmed.update(address.rsplit('/', 1)[-1]
+                             for address in item['success'])
+        elif isinstance(item, dict) and isinstance(item.get('error'), dict):
+            address = item['error'].get('address') or ''
+            attribute = address.rsplit('/', 1)[-1]
+            if attribute not in settings:
+                return {}
+            rejected.add(attribute)
+    return {attribute: value for attribute, value in settings.items()
+            if attribute in confirmed or
+            (not answered and attribute not in rejected)}
 
 class HueController:
     """
@@ -11,28 +75,820 @@ class HueController:
     - config (ConfigManager): Instance of the ConfigManager to retrieve
       application settings.
     - bridge_ip (str): IP address of the phue Bridge.
+    - username (str): The whitelisted API username.
+    - shared_config (bool): True for a member of a BridgeCluster, which
+                            leaves scenes and the metrics port alone.
+    - connected (bool): True once connected to the bridge.
+    - transport (PooledTransport): Keep-alive connection pool used for
+                                   every bridge request.
     - bridge (Bridge): Instance of the phue Bridge to communicate with
-                       the Hue lights.
+                       the Hue lights, None until connected.
+    - rate_limiter (RateLimiter): Keeps commands within the rates the
+                                  bridge can handle, adapting to its
+                                  errors and latency.
+    - dispatcher (CommandDispatcher): Coalesces and sends queued
+                                      commands in the background.
+    - executor (CommandExecutor): Runs bridge calls off the caller's
+                                  thread and hands back futures.
+    - state_cache (StateCache): Last known state of every light and
+                                group, used to skip redundant writes.
+    - topology (Topology): The lights, groups and scenes of the bridge
+                           indexed by ID, name, room and type.
+    - light_store (LightStateStore): Columnar copy of the light states
+                                     for queries over many lights, 
+                                     built on first use.
+    - event_stream (EventStream): Follows changes made outside Lumen,
+                                  None until start_event_stream.
+    - color_engine (ColorEngine): Converts colors for the configured
+                                  light gamut, built on first use.
+    - scenes (SceneManager): Keeps the configured scenes stored on the
+                             bridge.
+    - sequencer (Sequencer): Plays timelines through the dispatcher.
+    - metrics (BridgeMetrics): Records the requests sent to the bridge,
+                               None while metrics are disabled.
+    - journal (StateJournal): Persists the state cache across restarts,
+                              None until open_journal.
+    - automation (AutomationEngine): Runs the rules, None until 
+                                     start_automation.
 
     Methods:
+    - connect: Connects to the bridge and loads the state cache.
+    - open_journal: Restores the state cache from the journal and
+                    keeps journaling it.
+    - refresh_state: Reloads the state cache and the topology with one
+                     bulk bridge read.
+    - start_event_stream: Starts following changes made outside Lumen.
+    - resolve: Finds the ID of a light or group given by ID or name.
+    - target_lights: Returns the IDs of the lights a command reaches.
+    - is_on: Tells whether any light of a light or group is on.
+    - brightness: Returns the brightness of a light or group.
+    - find_lights: Finds the lights matching a query, e.g. by room and
+                   brightness.
+    - is_group_on: Tells whether any light in a group is on.
+    - group_brightness: Returns the brightness of a group.
+    - set_power: Turns a light or group on or off.
+    - start_entertainment: Streams an effect to an entertainment group.
+    - stop_entertainment: Stops a running effect stream.
+    - start_ambient: Drives lights from a video or audio file.
+    - start_automation: Starts running the rules file.
+    - handle_event: Runs the rules triggered by an event.
+    - sync_scenes: Uploads new and changed scenes to the bridge.
+    - recall_scene: Applies a stored scene with a single command.
+    - play_timeline: Starts playing a timeline in the background.
+    - enable_metrics: Starts recording the requests sent to the bridge.
+    - disable_metrics: Stops recording requests.
+    - _apply_state: Sends only the attributes that differ from the 
+                    cached state.
+    - _send_checked: Sends a command and reports the bridge's answer to
+                     the rate limiter.
     - _turn_on_lights_group: Turns on a group of lights with optional
                              transition time.
     - _turn_off_lights_group: Turns off a group of lights with optional
                               transition time.
-    - _set_light_settings: Adjusts settings of a group of lights, 
-                           including color and brightness.
+    - _set_light_settings: Same as submit_light_settings.
+    - submit_light_settings: Queues new settings for a group of lights
+                             without blocking the caller.
+    - apply_batch: Applies states to many lights and groups at once.
+    - color_coordinates: Finds the xy of a color name or "#rrggbb".
+    - preview_color: Finds the on-screen color showing a light color.
+    - run_async: Runs a controller call on the executor.
+    - close: Stops the background workers.
     - test_lights: An example routine to demonstrate light controls.
     """
-    def __init__(self):
+    def __init__(self, bridge_ip=None, username=None, connect=True,
+                 shared_config=False):
         """
         Initializes HueController by connecting to the phue Bridge.
+
+        Args:
+            bridge_ip (str, optional): 
+                IP address of the bridge, optionally with ":port". 
+                Defaults to "bridge_ip" from the configuration.
+            username (str, optional): 
+                The whitelisted API username. Defaults to 
+                "bridge_username" from the configuration, or the one
+                phue stored when the application was registered.
+            connect (bool, optional): 
+                Connect right away. When False, connect() has to be
+                called before any command reaches the bridge, which 
+                lets the GUI appear first. Defaults to True.
+            shared_config (bool, optional):
+                True when several controllers share the configuration,
+                as the members of a BridgeCluster do. The configured
+                scenes are then not uploaded, and metrics are recorded
+                but not served on the configured port. Defaults to 
+                False.
         """
         self.config = ConfigManager()
-        self.bridge_ip = self.config.get_setting("bridge_ip")
-        self.bridge = Bridge(self.bridge_ip)
+        self.bridge_ip = bridge_ip or self.config.get_setting("bridge_ip")
+        self.username = username or self.config.get_setting("bridge_username")
+        self.shared_config = shared_config
+        self.transport = None
+        self.bridge = None
+
+        self.state_cache = StateCache()
+        self.topology = Topology()
+        self._light_store = None
+        self.event_stream = None
+
+        # Commands queued through the dispatcher are coalesced per group
+        # and sent from a background thread at a bridge safe rate.
+        adaptation = self.config.get_setting("rate_adaptation", {})
+        self.rate_limiter = RateLimiter(
+            self.config.get_setting("rate_limits"), adaptation.get("burst"),
+            adaptation.get("latency_limit", 1.0))
+        self.dispatcher = CommandDispatcher(self._apply_state,
+                                            self.rate_limiter)
+
+        # One-off commands (toggles, color changes) run on the executor
+        # so the GUI never waits for the bridge.
+        self.executor = CommandExecutor()
+
+        self._color_engine = None
+        self.scenes = SceneManager(self)
+
+        # Timeline keyframes are handed to the dispatcher when due, the
+        # scheduler thread never waits for the bridge. Like other effects
+        # they give way to commands from the user.
+        self.sequencer = Sequencer(
+            lambda kind, target_id, settings: self.dispatcher.submit(
+                kind, target_id, settings, priority="background"))
+
+        self.journal = None
+        self.automation = None
+
+        # Labels and colors are looked up on every use, what was read
+        # from the configuration up front is updated on a reload.
+        self.config.add_listener(self._on_config_reload)
+
+        self.metrics = None
+        metrics_settings = self.config.get_setting("metrics", {})
+        if metrics_settings.get("enabled"):
+            self.enable_metrics(None if shared_config
+                                else metrics_settings.get("port"))
+
+        if connect:
+            self.connect()
+
+    def _on_config_reload(self, tables):
+        """
+        Applies a reloaded configuration to the rate limiter, the color
+        engine and the scenes stored on the bridge.
+
+        Args:
+            tables (ConfigTables): The reloaded configuration.
+        """
+        data = tables.data
+        adaptation = data.get("rate_adaptation", {})
+        self.rate_limiter.configure(data.get("rate_limits"),
+                                    adaptation.get("burst"),
+                                    adaptation.get("latency_limit"))
+        engine = self._color_engine
+        if engine is not None and engine.gamut != data.get("color_gamut", "C"):
+            # Built again for the new gamut on next use.
+            self._color_engine = None
+        if self.connected and not self.shared_config:
+            self.run_async(self.sync_scenes, key=("sync_scenes",))
+
+    @property
+    def color_engine(self):
+        # Building the lookup tables takes a moment, so it is left 
+        # until a color actually has to be converted.
+        if self._color_engine is None:
+            from color_engine import ColorEngine
+            self._color_engine = ColorEngine(
+                self.config.get_setting("color_gamut", "C"))
+        return self._color_engine
+
+    @property
+    def light_store(self):
+        # Only installations querying many lights pay for numpy and the
+        # copy, it follows the state cache from then on.
+        if self._light_store is None:
+            from light_store import LightStateStore
+            store = LightStateStore()
+            self._load_light_store(store)
+            self.state_cache.add_listener(self._on_state_change)
+            self.topology.add_listener(
+                lambda changes: self._load_light_store(store))
+            self._light_store = store
+        return self._light_store
+
+    def _load_light_store(self, store):
+        store.load(self.state_cache.export(),
+                   {light_id: self.topology.room_of(light_id)
+                    for light_id in self.state_cache.group_lights(0)})
+
+    def _on_state_change(self, kind, target_id, changes):
+        # The cache already tells which lights a group change reached.
+        for light_id in self.target_lights(kind, target_id):
+            self._light_store.update(
+                light_id, self.state_cache.get("light", light_id))
+
+    def color_coordinates(self, color):
+        """
+        Finds the xy coordinates of a color.
+
+        Args:
+            color (str): A color name from the configuration, or any
+                         color as "#rrggbb".
+
+        Returns:
+            list: The x and y coordinates, None for unknown names.
+        """
+        if color.startswith('#'):
+            from color_engine import parse_hex
+            xy, _ = self.color_engine.rgb_to_xy(parse_hex(color))
+            return [round(float(value), 4) for value in xy]
+        return self.config.get_color_coordinates(color)
+
+    def preview_color(self, color, brightness=254):
+        """
+        Finds the color showing a light color on screen as closely as
+        possible, within the gamut of the lights.
+
+        Args:
+            color (str): A color name from the configuration, or any
+                         color as "#rrggbb".
+            brightness (int, optional): Brightness from 0 to 254.
+
+        Returns:
+            str: The screen color as "#rrggbb", white for unknown
+                 color names.
+        """
+        from color_engine import WHITE_POINT
+        xy = self.color_coordinates(color) or WHITE_POINT
+        return self.color_engine.preview_color(xy, brightness)
+
+    @property
+    def connected(self):
+        """
+        Returns:
+            bool: True once connect() has succeeded.
+        """
+        return self.bridge is not None
+
+    def connect(self, bridge_ip=None, username=None):
+        """
+        Connects to the bridge, loads the state cache and uploads the
+        configured scenes that changed, unless the configuration is
+        shared with other controllers.
+
+        Args:
+            bridge_ip (str, optional): 
+                IP address of the bridge, replacing the one given at 
+                initialization, e.g. a freshly discovered one.
+            username (str, optional): The whitelisted API username.
+        """
+        self.bridge_ip = bridge_ip or self.bridge_ip
+        from bridge_transport import PooledTransport
+        from transport_bridge import TransportBridge
+
+        self.username = username or self.username
+        transport = PooledTransport(
+            self.bridge_ip, **self.config.get_setting("transport", {}))
 
         # Connects to the bridge (may need to press the link button first).
-        self.bridge.connect()
+        bridge = TransportBridge(self.bridge_ip, transport, self.username)
+        bridge.connect()
+        self.username = bridge.username
+        if self.metrics is not None:
+            self.metrics.username = self.username
+
+        self.transport = transport
+        bridge.metrics = self.metrics
+        api = bridge.get_api()
+        # Shows any difference to the state restored from the journal.
+        self.state_cache.reconcile(api)
+        self.topology.update(api)
+        self.bridge = bridge
+
+        # The configured scenes name group IDs of one bridge.
+        if self.shared_config:
+            return
+        # A scene failing to upload should not keep the lights from
+        # being controlled, it can be synced again later.
+        try:
+            self.scenes.sync(api.get('scenes'))
+        except Exception:
+            logger.exception("Could not upload the scenes")
+
+    def open_journal(self, path=None):
+        """
+        Restores the state cache from the journal written by the last
+        run, so the lights are shown as they were before the bridge is
+        reached, and journals every change from now on. connect() 
+        reconciles the restored state with a single bulk read.
+
+        Args:
+            path (str, optional): Path of the journal file. Defaults to
+                    the "journal" setting, relative to config.json.
+
+        Returns:
+            bool: True if a state was restored.
+        """
+        settings = self.config.get_setting("journal", {})
+        if path is None:
+            path = os.path.join(
+                os.path.dirname(os.path.abspath(self.config.config_path)),
+                settings.get("path", "state.journal"))
+        self.journal = StateJournal(path, settings.get("compact_after", 4096),
+                                    snapshot=self.state_cache.export)
+        restored = self.journal.restore()
+        if restored:
+            self.state_cache.seed(restored)
+            if self._light_store is not None:
+                self._load_light_store(self._light_store)
+        self.state_cache.journal = self.journal
+        return bool(restored)
+
+    def refresh_state(self):
+        """
+        Reloads the state cache and the topology with a single bulk 
+        read of the bridge.
+
+        Returns:
+            list: (kind, ID) of the lights, groups and scenes that were
+                  added, changed or removed since the last read.
+        """
+        api = self.bridge.get_api()
+        self.state_cache.seed(api)
+        if self._light_store is not None:
+            self._load_light_store(self._light_store)
+        return self.topology.update(api)
+
+    def _read_bridge(self):
+        """
+        Reads the full bridge state for the polling fallback, keeping 
+        the topology up to date on the way.
+        """
+        api = self.bridge.get_api()
+        self.topology.update(api)
+        return api
+
+    def start_event_stream(self):
+        """
+        Starts following changes made outside Lumen, reporting them to
+        the state cache. Uses the bridge's event stream when available
+        and falls back to polling otherwise.
+        """
+        if self.event_stream is not None:
+            return
+        from event_stream import EventStream
+        settings = self.config.get_setting("event_stream", {})
+        # Sensor events go to the automation rules.
+        self.event_stream = EventStream(self.bridge_ip,
+                                        self.bridge.username,
+                                        self.state_cache,
+                                        self._read_bridge,
+                                        on_event=self.handle_event,
+                                        **settings)
+        self.event_stream.start()
+
+    def resolve(self, kind, target):
+        """
+        Finds a light or group given by ID or by the name shown in the
+        Hue app.
+
+        Args:
+            kind (str): "light" or "group".
+            target (str or int): An ID or a name.
+
+        Returns:
+            str: The ID, the target itself when it is not a known name
+                 so the bridge can answer for unknown IDs.
+        """
+        return self.topology.resolve(kind, target) or str(target)
+
+    def target_lights(self, kind, target_id):
+        """
+        Returns:
+            list: IDs of the lights a command to the light or group 
+                  reaches.
+        """
+        if kind == "group":
+            return self.state_cache.group_lights(target_id)
+        return [str(target_id)]
+
+    def is_on(self, kind, target_id):
+        """
+        Tells whether a light, or any light of a group, is on according
+        to the state cache.
+
+        Args:
+            kind (str): "light" or "group".
+            target_id (int): The ID of the light or group.
+
+        Returns:
+            bool: True if at least one light is on.
+        """
+        return any(self.state_cache.get("light", light_id).get('on')
+                   for light_id in self.target_lights(kind, target_id))
+
+    def brightness(self, kind, target_id):
+        """
+        Returns the brightness of a light or group according to the 
+        state cache.
+
+        Args:
+            kind (str): "light" or "group".
+            target_id (int): The ID of the light or group.
+
+        Returns:
+            int: The highest brightness of the lights that are on, None
+                 when none is known.
+        """
+        values = [state['bri'] for state in
+                  (self.state_cache.get("light", light_id)
+                   for light_id in self.target_lights(kind, target_id))
+                  if state.get('on') and 'bri' in state]
+        return max(values) if values else None
+
+    def find_lights(self, room=None, on=None, reachable=None, min_bri=None,
+                    max_bri=None, group=None):
+        """
+        Finds the lights matching every given condition with a single
+        vectorized pass over the light store.
+
+        Args:
+            room (str, optional): Only lights in this room, by ID or
+                                  name.
+            on (bool, optional): Only lights that are on, or off.
+            reachable (bool, optional): Only (un)reachable lights.
+            min_bri (int, optional): Only lights at least this bright.
+            max_bri (int, optional): Only lights at most this bright.
+            group (str, optional): Only lights in this group, by ID or
+                                   name.
+
+        Returns:
+            list: IDs of the matching lights.
+        """
+        if room is not None:
+            room = self.resolve("group", room)
+        lights = None
+        if group is not None:
+            lights = self.target_lights("group", self.resolve("group", group))
+        return self.light_store.select(room, on, reachable, min_bri, max_bri,
+                                       lights)
+
+    def is_group_on(self, group_id=0):
+        """
+        Tells whether any light in a group is on, according to the 
+        state cache.
+
+        Args:
+            group_id (int, optional): The ID of the group. Defaults to 0.
+
+        Returns:
+            bool: True if at least one light in the group is on.
+        """
+        return self.is_on("group", group_id)
+
+    def group_brightness(self, group_id=0):
+        """
+        Returns the brightness of a group, according to the state cache.
+
+        Args:
+            group_id (int, optional): The ID of the group. Defaults to 0.
+
+        Returns:
+            int: The highest brightness of the lights in the group that
+                 are on, None when none is known.
+        """
+        return self.brightness("group", group_id)
+
+    def start_entertainment(self, group_id, effect, rate=25.0, sock=None):
+        """
+        Activates streaming on an entertainment group and starts 
+        sending frames of an effect to it.
+
+        Args:
+            group_id (int): The ID of the entertainment group.
+            effect (callable): Renders a frame as effect(elapsed, packet).
+            rate (float, optional): Frames per second. Defaults to 25.
+            sock (optional): Socket like object used to send frames,
+                             e.g. a DTLS wrapped socket.
+
+        Returns:
+            EntertainmentStream: The running stream.
+        """
+        self.bridge.request('PUT', 
+                            '/api/{}/groups/{}'.format(self.bridge.username,
+                                                      group_id),
+                            {'stream': {'active': True}})
+        from entertainment import EntertainmentStream
+        stream = EntertainmentStream(self.state_cache.group_lights(group_id),
+                                     (self.bridge_ip, 2100), effect,
+                                     rate=rate, sock=sock)
+        stream.start()
+        return stream
+
+    def stop_entertainment(self, group_id, stream):
+        """
+        Stops an effect stream and deactivates streaming on its group.
+
+        Args:
+            group_id (int): The ID of the entertainment group.
+            stream (EntertainmentStream): The stream to stop.
+        """
+        stream.stop()
+        self.bridge.request('PUT', 
+                            '/api/{}/groups/{}'.format(self.bridge.username,
+                                                      group_id),
+                            {'stream': {'active': False}})
+
+    def start_ambient(self, source, group_id=0, zones=None):
+        """
+        Starts driving the lights of a group from a frame source, one 
+        zone of the frame per light. The "ambient" setting holds the
+        frame rate, smoothing and queue sizes.
+
+        Args:
+            source (str or object): A .wav or .npy file, or a frame
+                    source such as ambient.WavSource.
+            group_id (int, optional): The group whose lights are 
+                    driven, in ID order. Defaults to 0.
+            zones (list, optional): A (left, top, right, bottom) box
+                    per light as shares of the frame. Defaults to side
+                    by side columns.
+
+        Returns:
+            AmbientPipeline: The running pipeline, stopped with stop().
+        """
+        from ambient import AmbientPipeline, open_source
+        settings = self.config.get_setting("ambient", {})
+        if isinstance(source, str):
+            source = open_source(source, settings.get("rate", 25.0))
+        light_ids = sorted(self.state_cache.group_lights(group_id),
+                           key=lambda light_id: (len(light_id), light_id))
+        pipeline = AmbientPipeline(
+            self, source, light_ids, zones,
+            time_constant=settings.get("time_constant", 0.3),
+            queue_size=settings.get("queue_size", 2),
+            max_side=settings.get("max_side", 64))
+        pipeline.start()
+        return pipeline
+
+    def start_automation(self, path=None):
+        """
+        Loads the rules file and starts running its rules. Sunrise and
+        sunset need the "latitude" and "longitude" of the "automation"
+        setting. Nothing runs until the user created a rules file, see
+        rules.example.json.
+
+        Args:
+            path (str, optional): Path of the rules file. Defaults to
+                    the "automation" setting, relative to config.json.
+
+        Returns:
+            AutomationEngine: The running engine, None when there is no
+                              rules file or it declares no rules.
+        """
+        from automation import AutomationEngine, load_rules
+        settings = self.config.get_setting("automation", {})
+        if path is None:
+            path = os.path.join(
+                os.path.dirname(os.path.abspath(self.config.config_path)),
+                settings.get("rules", "rules.json"))
+        if not os.path.exists(path):
+            return None
+        rules = load_rules(path)
+        if not rules:
+            return None
+        if self.automation is not None:
+            self.automation.stop()
+        self.automation = AutomationEngine(self, rules,
+                                           settings.get("latitude"),
+                                           settings.get("longitude"))
+        self.automation.start()
+        return self.automation
+
+    def handle_event(self, event_type, source=None, data=None):
+        """
+        Runs the automation rules triggered by an event, e.g. a motion
+        sensor reported by the event stream or a script.
+
+        Args:
+            event_type (str): e.g. "motion" or "button".
+            source (str, optional): ID of the sensor the event came from.
+            data (dict, optional): What the event carries.
+
+        Returns:
+            list: Names of the rules that fired.
+        """
+        if self.automation is None:
+            return []
+        return self.automation.handle_event(event_type, source, data)
+
+    def sync_scenes(self):
+        """
+        Uploads the scenes from the "scenes" setting that are new or
+        changed, e.g. after the configuration was reloaded.
+
+        Returns:
+            list: Names of the scenes that were uploaded.
+        """
+        return self.scenes.sync()
+
+    def recall_scene(self, name, transition_time=None):
+        """
+        Applies a scene from the "scenes" setting to all its lights at
+        once, with a single group command instead of one per light.
+
+        Args:
+            name (str): Name of the scene.
+            transition_time (str, optional):
+                The label specifying the time taken to transition.
+                Defaults to the one declared with the scene.
+        """
+        if name not in self.scenes.scene_ids:
+            self.scenes.sync()
+        return self.scenes.recall(name, transition_time)
+
+    def play_timeline(self, timeline, delay=0.0):
+        """
+        Starts playing a timeline and returns at once.
+
+        Args:
+            timeline (str or Timeline): A timeline, or the name of one
+                                        from the "timelines" setting.
+            delay (float, optional): Seconds before it starts.
+
+        Returns:
+            TimelineRun: Pauses, resumes, cancels or waits for the run.
+        """
+        if isinstance(timeline, str):
+            timeline = Timeline.from_dict(
+                timeline, self.config.get_setting("timelines", {})[timeline],
+                self._build_settings)
+        return self.sequencer.play(timeline, delay)
+
+    def enable_metrics(self, port=None):
+        """
+        Starts recording every request sent to the bridge, together with
+        the depth of the dispatcher queue.
+
+        Args:
+            port (int, optional): Also serves the metrics in Prometheus
+                                  text format on this port.
+
+        Returns:
+            BridgeMetrics: The metrics being recorded.
+        """
+        if self.metrics is None:
+            from bridge_metrics import BridgeMetrics
+            self.metrics = BridgeMetrics(self.username)
+            self.metrics.add_gauge("dispatcher_pending",
+                                   self.dispatcher.pending)
+            self.metrics.add_gauge("timelines_running",
+                                   lambda: len(self.sequencer.runs()))
+            if self.bridge is not None:
+                self.bridge.metrics = self.metrics
+        if port is not None:
+            self.metrics.serve(port)
+        return self.metrics
+
+    def disable_metrics(self):
+        """
+        Stops recording requests and serving metrics.
+        """
+        if self.bridge is not None:
+            self.bridge.metrics = None
+        if self.metrics is not None:
+            self.metrics.close()
+            self.metrics = None
+
+    def _send_command(self, kind, target_id, settings):
+        """
+        Sends a state to a single light or a group of lights.
+
+        Args:
+            kind (str): "light" or "group".
+            target_id (int): The ID of the light or group.
+            settings (dict): Bridge state attributes to apply.
+        """
+        # phue treats string IDs as names and looks them up, IDs from
+        # the state cache are numeric strings.
+        if isinstance(target_id, str) and target_id.isdigit():
+            target_id = int(target_id)
+        if kind == "group":
+            return self.bridge.set_group(target_id, settings)
+        return self.bridge.set_light(target_id, settings)
+
+    def _apply_state(self, kind, target_id, settings):
+        """
+        Sends the attributes of a state that differ from the cached 
+        state of the light or group, and nothing if none do.
+
+        How long the bridge took to answer, and whether it was 
+        overloaded, is reported to the rate limiter.
+
+        Args:
+            kind (str): "light" or "group".
+            target_id (int): The ID of the light or group.
+            settings (dict): Bridge state attributes to apply.
+
+        Returns:
+            The bridge response, or None when no request was needed.
+
+        Raises:
+            BridgeOverloadError: If the bridge refused the command as
+                                 overloaded, nothing was applied.
+        """
+        changes = self.state_cache.diff(kind, target_id, settings)
+        if not changes:
+            return None
+        response = self._send_checked(kind, target_id, changes)
+        # Attributes the bridge rejected, e.g. the brightness of a light
+        # that is off, are left out so the next request sends them again.
+        confirmed = _confirmed_settings(response, changes)
+        if set(confirmed) - set(self.state_cache.TRANSIENT):
+            self.state_cache.update(kind, target_id, confirmed)
+        return response
+
+    def _send_checked(self, kind, target_id, settings):
+        """
+        Sends a command and reports how long the bridge took to answer,
+        and whether it was overloaded, to the rate limiter. Other bridge
+        errors are logged.
+
+        Raises:
+            BridgeOverloadError: If the bridge refused the command as
+                                 overloaded.
+        """
+        start = time.monotonic()
+        response = self._send_command(kind, target_id, settings)
+        errors = _bridge_errors(response)
+        overloaded = any(error.get('type') == OVERLOADED for error in errors)
+        self.rate_limiter.record(kind, time.monotonic() - start, overloaded)
+        if overloaded:
+            raise BridgeOverloadError("Bridge overloaded, {} {} refused"
+                                      .format(kind, target_id))
+        for error in errors:
+            logger.warning("Bridge error for %s %s: %s", kind, target_id,
+                           error.get('description'))
+        return response
+
+    def _build_settings(self, color=None, brightness=None,
+                        transition_time="SHORT"):
+        """
+        Translates labels from the configuration into bridge state
+        attributes. Labels left as None are not included.
+
+        Args:
+            color (str, optional): The label for the color to set, or
+                                   any color as "#rrggbb".
+            brightness (str, optional): 
+                The label for the brightness level to set.
+            transition_time (str, optional): 
+                The label specifying the time taken to transition.
+                Defaults to "SHORT".
+
+        Returns:
+            dict: The bridge state attributes.
+
+        Raises:
+            ValueError: If the color is neither a configured name nor a
+                        valid "#rrggbb" color.
+        """
+        settings = {}
+        if color is not None:
+            xy = self.color_coordinates(color)
+            if xy is None:
+                raise ValueError("unknown color {!r}".format(color))
+            settings['xy'] = xy
+        if brightness is not None:
+            settings['bri'] = self.config.get_brightness(brightness)
+        settings['transitiontime'] = \
+            self.config.get_transition_time(transition_time)
+        return settings
+
+    def set_power(self, kind, target_id, on, transition_time=None):
+        """
+        Turns a light or a group of lights on or off. The command is 
+        queued ahead of background effects, the call returns at once.
+
+        Args:
+            kind (str): "light" or "group".
+            target_id (int): The ID of the light or group.
+            on (bool): True to turn on, False to turn off.
+            transition_time (str, optional): 
+                    The label specifying the time taken to transition.
+                    Defaults to "SHORT" when turning on and "NONE" when
+                    turning off.
+
+        Returns:
+            Future: Resolves once the command reached the bridge.
+        """
+        if transition_time is None:
+            transition_time = "SHORT" if on else "NONE"
+        transition = self.config.get_transition_time(transition_time)
+        return self.dispatcher.submit(kind, target_id, 
+                                      {
+                                        'transitiontime': transition,
+                                        'on': bool(on)
+                                      },
+                                      priority="user")
 
     def _turn_on_lights_group(self, group_id = 0, transition_time="SHORT"):
         """
@@ -46,14 +902,11 @@ class HueController:
                             The label specifying the time taken to 
                             transition Default transition label is 
                             "SHORT".
+
+        Returns:
+            Future: Resolves once the command reached the bridge.
         """
-        transition = self.config.get_transition_time(transition_time)
-        self.bridge.set_group(group_id, 
-                                {
-                                  'transitiontime': transition,
-                                  'on': True
-                                }
-                                )
+        return self.set_power("group", group_id, True, transition_time)
     
     def _turn_off_lights_group(self, group_id, transition_time="NONE"):
         """
@@ -64,64 +917,146 @@ class HueController:
             transition_time (str, optional): 
                     The label specifying the time taken to transition.
                     Defaults to "NONE".
+
+        Returns:
+            Future: Resolves once the command reached the bridge.
         """
-        transition = self.config.get_transition_time(transition_time)
-        self.bridge.set_group(group_id, 
-                                {
-                                    'transitiontime': transition,
-                                    'on': False
-                                }
-                                )
+        return self.set_power("group", group_id, False, transition_time)
 
     def _set_light_settings(self,
                             group_id,
-                            color="WHITE",
-                            brightness="NEUTRAL",
-                            transition_time="SHORT"):
+                            color=None,
+                            brightness=None,
+                            transition_time="SHORT",
+                            kind="group"):
+        """
+        Adjusts settings of a group of lights, see submit_light_settings.
+
+        Returns:
+            Future: Resolves once the settings reached the bridge.
+        """
+        return self.submit_light_settings(group_id, color, brightness,
+                                          transition_time, kind)
+
+    def submit_light_settings(self,
+                              group_id,
+                              color=None,
+                              brightness=None,
+                              transition_time="SHORT",
+                              kind="group"):
         """
-        Adjusts settings of a group of lights.
+        Queues new settings for a group of lights and returns at once.
+        Only the given labels are applied, the color is kept when only
+        setting brightness and the other way around. Like set_power, the
+        command is queued ahead of background effects.
+
+        Rapid successive calls for the same group are merged so that
+        only the newest state reaches the bridge.
 
         Args:
-            group_id (int): The ID of the group of lights to control.
-            color (str, optional): 
-                The label for the color to set. Defaults to "WHITE".
+            group_id (int): The ID of the group of lights to control,
+                            or of the light when kind is "light".
+            color (str, optional): The label for the color to set.
             brightness (str, optional): 
                 The label for the brightness level to set.
-                Defaults to "NEUTRAL".
             transition_time (str, optional): 
                 The label specifying the time taken to transition.
                 Defaults to "SHORT".
+            kind (str, optional): "group" or "light". Defaults to 
+                                  "group".
+
+        Returns:
+            Future: Resolves once the settings reached the bridge.
+
+        Raises:
+            ValueError: If a label is not in the configuration.
+        """
+        settings = self._build_settings(color, brightness, transition_time)
+        return self.dispatcher.submit(kind, group_id, settings,
+                                      priority="user")
+
+    def apply_batch(self, states, max_workers=4):
         """
-        settings = {
-            'xy': self.config.get_color_coordinates(color),
-            'bri': self.config.get_brightness(brightness),
-            'transitiontime': self.config.get_transition_time(transition_time)
-        }
-        self.bridge.set_group(group_id, settings)
+        Applies states to many lights and groups at once.
+
+        Lights sharing an identical state are merged into a single group
+        command where every light of a group shares it. The remaining
+        commands are sent in parallel by a bounded pool of workers, each
+        waiting for the rate limiter before talking to the bridge.
+
+        Args:
+            states (dict): (kind, target_id) -> bridge state attributes,
+                           with kind "light" or "group", e.g.
+                           {("light", 3): {'on': True, 'bri': 200}}.
+            max_workers (int, optional): Commands in flight at once.
+                                         Defaults to 4.
+
+        Returns:
+            BatchResult: The response, or exception, for every target 
+                         and the wall time of the batch.
+        """
+        start = time.monotonic()
+        commands = plan_batch(states, self.state_cache)
+
+        def send(command):
+            kind, target_id, settings, _ = command
+            self.rate_limiter.acquire(kind)
+            return self._apply_state(kind, target_id, settings)
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [(command, pool.submit(send, command))
+                       for command in commands]
+            for command, future in futures:
+                try:
+                    result = future.result()
+                except Exception as error:
+                    result = error
+                for target in command[3]:
+                    results[target] = result
+
+        return BatchResult(results, len(commands), time.monotonic() - start)
+
+    def run_async(self, func, *args, key=None, **kwargs):
+        """
+        Runs a controller call on the background executor.
+
+        Args:
+            func (callable): The call to run, e.g. 
+                             self._turn_on_lights_group.
+            key (hashable, optional): 
+                Identifies what the call changes. A call with the same
+                key that has not started yet is cancelled.
+
+        Returns:
+            Future: The future holding the result of the call.
+        """
+        return self.executor.submit(func, *args, key=key, **kwargs)
+
+    def close(self):
+        """
+        Stops the background dispatcher and executor and closes the
+        connections to the bridge.
+        """
+        self.config.remove_listener(self._on_config_reload)
+        if self.event_stream is not None:
+            self.event_stream.stop()
+        if self.automation is not None:
+            self.automation.stop()
+        self.sequencer.stop()
+        self.disable_metrics()
+        self.executor.shutdown()
+        self.dispatcher.stop()
+        if self.transport is not None:
+            self.transport.close()
+        if self.journal is not None:
+            self.journal.close()
 
     def test_lights(self):
         """
         A test method putting on a lightshow in three stages 
         demonstrating some of the typical controls of the 
-        HueController.
-        """
-        self._turn_on_lights_group(0)
-        self._set_light_settings(
-            0, 
-            color="RED", 
-            brightness="VERY_BRIGHT", 
-            transition_time="VERY_SHORT")
-        time.sleep(2)
-        self._set_light_settings(
-            0, 
-            color="GREEN", 
-            brightness="VERY_DIM", 
-            transition_time="SHORT")
-        time.sleep(2)
-        self._set_light_settings(
-            0, 
-            color="BLUE", 
-            brightness="VERY_BRIGHT", 
-            transition_time="VERY_SHORT")
-        time.sleep(2)
-        self._turn_off_lights_group(0, transition_time="SHORT")
\ No newline at end of file
+        HueController. Plays the "test_lights" timeline and waits 
+        for it to end.
+        """
+        self.play_timeline("test_lights").wait()
@@ -0,0 +1,413 @@
+import threading
+
+import numpy as np
+
+
+class LightRecord:
+    """
+    LightRecord is the typed state of a single light, with a fixed set
+    of attributes instead of a dict.
+
+    Attributes:
+    - light_id (str): The ID of the light.
+    - on (bool): Whether the light is on.
+    - bri (int): Brightness from 0 to 254, 0 for lights without one.
+    - xy (tuple): CIE xy color, None for lights without color.
+    - ct (int): Color temperature in mired, 0 for none.
+    - reachable (bool): Whether the bridge can reach the light.
+    - room (str): The ID of the room the light is in, None for none.
+
+    Methods:
+    - from_state: Builds a record from a bridge light state.
+    - to_state: Returns the record as a bridge light state.
+    """
+    __slots__ = ('light_id', 'on', 'bri', 'xy', 'ct', 'reachable', 'room')
+
+    def __init__(self, light_id, on=False, bri=0, xy=None, ct=0,
+                 reachable=True, room=None):
+        self.light_id = str(light_id)
+        self.on = on
+        self.bri = bri
+        self.xy = xy
+        self.ct = ct
+        self.reachable = reachable
+        self.room = room
+
+    @classmethod
+    def from_state(cls, light_id, state, room=None):
+        """
+        Args:
+            light_id (str): The ID of the light.
+            state (dict): The light state as the bridge reports it.
+            room (str, optional): The ID of the room of the light.
+
+        Returns:
+            LightRecord: The record.
+        """
+        xy = state.get('xy')
+        return cls(light_id, bool(state.get('on', False)),
+                   int(state.get('bri', 0)),
+                   tuple(xy) if xy is not None else None,
+                   int(state.get('ct', 0)),
+                   bool(state.get('reachable', True)), room)
+
+    def to_state(self):
+        """
+        Returns:
+            dict: The record as a bridge light state, leaving out what
+                  the light does not have.
+        """
+        state = {'on': self.on, 'reachable': self.reachable}
+        if self.bri:
+            state['bri'] = self.bri
+        if self.xy is not None:
+            state['xy'] = list(self.xy)
+        if self.ct:
+            state['ct'] = self.ct
+        return state
+
+    def __eq__(self, other):
+        if not isinstance(other, LightRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name)
+                   for name in self.__slots__)
+
+    def __repr__(self):
+        return "LightRecord({})".format(", ".join(
+            "{}={!r}".format(name, getattr(self, name))
+            for name in self.__slots__))
+
+
+class LightStateStore:
+    """
+    LightStateStore keeps the state of every light in columns, one
+    array per attribute, for installations with hundreds of lights.
+
+    On and reachable are bitsets, brightness uint8, xy float32 pairs
+    and color temperature uint16, a few bytes per light against the
+    dict per light of the state cache. Each light ID maps to its row
+    in constant time, and queries over every light, e.g. all lights in
+    a room brighter than 100, run as vectorized array operations.
+
+    The store is a read model, the state cache stays the source of
+    truth and HueController keeps the store in step with it.
+
+    Attributes:
+    - NO_ROOM (int): Room code of lights that are not in a room.
+
+    Methods:
+    - load: Replaces the content with a bulk bridge read.
+    - add: Adds a light, or returns the row it already has.
+    - remove: Removes a light.
+    - update: Applies a state change to a light.
+    - update_many: Applies the same state change to several lights.
+    - set_rooms: Assigns the lights to rooms.
+    - get: Returns the record of a light.
+    - records: Returns the records of every light.
+    - select: Returns the IDs of the lights matching a query.
+    - count: Returns how many lights match a query.
+    - nbytes: Returns the memory used by the columns.
+    """
+    NO_ROOM = -1
+
+    def __init__(self, capacity=64):
+        """
+        Initializes an empty LightStateStore.
+
+        Args:
+            capacity (int, optional): Lights to make room for before
+                    the columns have to grow. Defaults to 64.
+        """
+        self._ids = []
+        self._index = {}
+        self._room_codes = {}
+        self._room_ids = []
+        self._lock = threading.Lock()
+        self._allocate(max(8, capacity))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, light_id):
+        return str(light_id) in self._index
+
+    def load(self, api, rooms=None):
+        """
+        Replaces the content with a bulk bridge read.
+
+        Args:
+            api (dict): The full bridge state as returned by
+                        Bridge.get_api() or StateCache.export().
+            rooms (dict, optional): Room ID for each light ID.
+        """
+        lights = api.get('lights') or {}
+        with self._lock:
+            self._ids = []
+            self._index = {}
+            self._allocate(max(8, len(lights)))
+            for light_id, light in lights.items():
+                row = self._add(str(light_id))
+                self._write(row, light.get('state', {}))
+        if rooms is not None:
+            self.set_rooms(rooms)
+
+    def add(self, light_id):
+        """
+        Args:
+            light_id (str): The ID of the light.
+
+        Returns:
+            int: The row of the light.
+        """
+        with self._lock:
+            return self._add(str(light_id))
+
+    def remove(self, light_id):
+        """
+        Removes a light, moving the last row into its place.
+
+        Args:
+            light_id (str): The ID of the light.
+
+        Returns:
+            bool: True if the light was known.
+        """
+        with self._lock:
+            row = self._index.pop(str(light_id), None)
+            if row is None:
+                return False
+            last = len(self._ids) - 1
+            moved = self._ids.pop()
+            if row != last:
+                self._ids[row] = moved
+                self._index[moved] = row
+                self._copy_row(last, row)
+            self._clear_row(last)
+            return True
+
+    def update(self, light_id, state):
+        """
+        Applies a state change to a light, adding the light if it is
+        not known yet.
+
+        Args:
+            light_id (str): The ID of the light.
+            state (dict): The changed bridge state attributes.
+        """
+        with self._lock:
+            self._write(self._add(str(light_id)), state)
+
+    def update_many(self, light_ids, state):
+        """
+        Applies the same state change to several lights at once, e.g.
+        a group command.
+
+        Args:
+            light_ids (list): The IDs of the lights.
+            state (dict): The changed bridge state attributes.
+        """
+        with self._lock:
+            rows = np.fromiter((self._add(str(light_id))
+                                for light_id in light_ids),
+                               dtype=np.intp)
+            if rows.size:
+                self._write(rows, state)
+
+    def set_rooms(self, rooms):
+        """
+        Assigns the lights to rooms, replacing earlier assignments.
+
+        Args:
+            rooms (dict): Room ID for each light ID, lights left out
+                          are in no room.
+        """
+        with self._lock:
+            self._room_codes = {}
+            self._room_ids = []
+            self._room[:] = self.NO_ROOM
+            for light_id, room_id in rooms.items():
+                row = self._index.get(str(light_id))
+                if row is None or room_id is None:
+                    continue
+                room_id = str(room_id)
+                code = self._room_codes.get(room_id)
+                if code is None:
+                    code = self._room_codes[room_id] = len(self._room_ids)
+                    self._room_ids.append(room_id)
+                self._room[row] = code
+
+    def get(self, light_id):
+        """
+        Args:
+            light_id (str): The ID of the light.
+
+        Returns:
+            LightRecord: The state of the light, None if unknown.
+        """
+        with self._lock:
+            row = self._index.get(str(light_id))
+            if row is None:
+                return None
+            return self._record(row)
+
+    def records(self):
+        """
+        Returns:
+            list: A LightRecord for every light.
+        """
+        with self._lock:
+            return [self._record(row) for row in range(len(self._ids))]
+
+    def select(self, room=None, on=None, reachable=None, min_bri=None,
+               max_bri=None, lights=None):
+        """
+        Finds the lights matching every given condition.
+
+        Args:
+            room (str, optional): Only lights in this room.
+            on (bool, optional): Only lights that are on, or off.
+            reachable (bool, optional): Only (un)reachable lights.
+            min_bri (int, optional): Only lights at least this bright.
+            max_bri (int, optional): Only lights at most this bright.
+            lights (list, optional): Only these lights.
+
+        Returns:
+            list: IDs of the matching lights, in the order they were
+                  added.
+        """
+        with self._lock:
+            mask = self._mask(room, on, reachable, min_bri, max_bri, lights)
+            return [self._ids[row] for row in np.flatnonzero(mask)]
+
+    def count(self, **query):
+        """
+        Args:
+            **query: The conditions of select().
+
+        Returns:
+            int: The number of matching lights.
+        """
+        with self._lock:
+            return int(np.count_nonzero(self._mask(**query)))
+
+    def nbytes(self):
+        """
+        Returns:
+            int: Bytes used by the columns, including unused rows.
+        """
+        return sum(column.nbytes for column in (
+            self._on, self._reachable, self._bri, self._xy, self._ct,
+            self._room))
+
+    def _allocate(self, capacity):
+        self._capacity = capacity
+        self._on = np.zeros((capacity + 7) // 8, dtype=np.uint8)
+        self._reachable = np.zeros((capacity + 7) // 8, dtype=np.uint8)
+        self._bri = np.zeros(capacity, dtype=np.uint8)
+        self._xy = np.full((capacity, 2), np.nan, dtype=np.float32)
+        self._ct = np.zeros(capacity, dtype=np.uint16)
+        self._room = np.full(capacity, self.NO_ROOM, dtype=np.int32)
+
+    def _grow(self):
+        columns = (self._on, self._reachable, self._bri, self._xy, self._ct,
+                   self._room)
+        self._allocate(self._capacity * 2)
+        for old, new in zip(columns, (self._on, self._reachable, self._bri,
+                                      self._xy, self._ct, self._room)):
+            new[:len(old)] = old
+
+    def _add(self, light_id):
+        row = self._index.get(light_id)
+        if row is not None:
+            return row
+        row = len(self._ids)
+        if row == self._capacity:
+            self._grow()
+        self._ids.append(light_id)
+        self._index[light_id] = row
+        self._set_bit(self._reachable, row, True)
+        return row
+
+    def _write(self, rows, state):
+        """
+        Writes state attributes to one row or an array of rows.
+        """
+        if 'on' in state:
+            self._set_bit(self._on, rows, state['on'])
+        if 'reachable' in state:
+            self._set_bit(self._reachable, rows, state['reachable'])
+        if state.get('bri') is not None:
+            self._bri[rows] = min(max(int(state['bri']), 0), 254)
+        if state.get('xy') is not None:
+            self._xy[rows] = state['xy'][:2]
+        if state.get('ct') is not None:
+            self._ct[rows] = int(state['ct'])
+
+    def _set_bit(self, bits, rows, value):
+        if isinstance(rows, int):
+            byte = int(bits[rows >> 3])
+            mask = 1 << (rows & 7)
+            bits[rows >> 3] = byte | mask if value else byte & ~mask
+            return
+        masks = np.left_shift(1, rows & 7).astype(np.uint8)
+        if value:
+            np.bitwise_or.at(bits, rows >> 3, masks)
+        else:
+            np.bitwise_and.at(bits, rows >> 3, ~masks)
+
+    def _bit(self, bits, row):
+        return bool(bits[row >> 3] & (1 << (row & 7)))
+
+    def _bits(self, bits):
+        return np.unpackbits(bits, count=len(self._ids),
+                             bitorder='little').view(bool)
+
+    def _copy_row(self, source, target):
+        for bits in (self._on, self._reachable):
+            self._set_bit(bits, target, self._bit(bits, source))
+        self._bri[target] = self._bri[source]
+        self._xy[target] = self._xy[source]
+        self._ct[target] = self._ct[source]
+        self._room[target] = self._room[source]
+
+    def _clear_row(self, row):
+        for bits in (self._on, self._reachable):
+            self._set_bit(bits, row, False)
+        self._bri[row] = 0
+        self._xy[row] = np.nan
+        self._ct[row] = 0
+        self._room[row] = self.NO_ROOM
+
+    def _record(self, row):
+        xy = self._xy[row]
+        room = int(self._room[row])
+        return LightRecord(
+            self._ids[row], self._bit(self._on, row), int(self._bri[row]),
+            None if np.isnan(xy[0]) else (float(xy[0]), float(xy[1])),
+            int(self._ct[row]), self._bit(self._reachable, row),
+            self._room_ids[room] if room != self.NO_ROOM else None)
+
+    def _mask(self, room=None, on=None, reachable=None, min_bri=None,
+              max_bri=None, lights=None):
+        size = len(self._ids)
+        mask = np.ones(size, dtype=bool)
+        if room is not None:
+            code = self._room_codes.get(str(room))
+            if code is None:
+                return np.zeros(size, dtype=bool)
+            mask &= self._room[:size] == code
+        if on is not None:
+            mask &= self._bits(self._on) == bool(on)
+        if reachable is not None:
+            mask &= self._bits(self._reachable) == bool(reachable)
+        if min_bri is not None:
+            mask &= self._bri[:size] >= min_bri
+        if max_bri is not None:
+            mask &= self._bri[:size] <= max_bri
+        if lights is not None:
+            rows = [self._index[str(light_id)] for light_id in lights
+                    if str(light_id) in self._index]
+            selected = np.zeros(size, dtype=bool)
+            selected[rows] = True
+            mask &= selected
+        return mask
@@ -0,0 +1,155 @@
+"""
+A thin command line client for the Lumen daemon.
+
+Only the standard library's HTTP client is imported, so a command
+returns in milliseconds: the bridge connection, state cache and rate
+limits all live in the daemon started with "python main.py --daemon".
+
+Usage:
+    python lumen_cli.py on [--group 1]
+    python lumen_cli.py off
+    python lumen_cli.py color RED [--light 3]
+    python lumen_cli.py off --group "Living room"
+    python lumen_cli.py brightness DIM
+    python lumen_cli.py scene Evening
+    python lumen_cli.py timeline test_lights
+    python lumen_cli.py state
+    python lumen_cli.py stats
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+from urllib.parse import quote
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'config.json')
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    An HTTPConnection talking to a Unix socket instead of a TCP port.
+    """
+    def __init__(self, path, timeout=10.0):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def daemon_settings(path=CONFIG_PATH):
+    """
+    Reads the "daemon" setting without loading the full configuration.
+
+    Returns:
+        dict: The "host", "port" and "socket" of the daemon.
+    """
+    try:
+        with open(path, 'r') as file:
+            return json.load(file).get("daemon", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def call(method, path, body=None, host='127.0.0.1', port=8765,
+         socket_path=None, timeout=10.0):
+    """
+    Sends a request to the daemon.
+
+    Args:
+        method (str): "GET" or "POST".
+        path (str): The API path, e.g. "/groups/0".
+        body (dict, optional): Sent as JSON.
+        host (str, optional): Address of the daemon.
+        port (int, optional): Port of the daemon.
+        socket_path (str, optional): Unix socket of the daemon, used
+                                     instead of host and port.
+        timeout (float, optional): Seconds to wait for an answer.
+
+    Returns:
+        tuple: (HTTP status, decoded JSON response).
+    """
+    if socket_path:
+        connection = UnixHTTPConnection(socket_path, timeout)
+    else:
+        connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        data = json.dumps(body) if body is not None else None
+        connection.request(method, path, data,
+                           {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b'null')
+    finally:
+        connection.close()
+
+
+def build_request(args):
+    """
+    Turns the parsed command line into an API request.
+
+    Returns:
+        tuple: (method, path, body).
+    """
+    target = "/lights/{}".format(quote(args.light, safe='')) \
+        if args.light is not None \
+        else "/groups/{}".format(quote(args.group, safe=''))
+    body = {'wait': args.wait}
+    if args.transition:
+        body['transition_time'] = args.transition
+
+    if args.command in ('on', 'off'):
+        body['on'] = args.command == 'on'
+        return 'POST', target, body
+    if args.command in ('color', 'brightness'):
+        if not args.value:
+            raise SystemExit("{} needs a value".format(args.command))
+        body[args.command] = args.value
+        return 'POST', target, body
+    if args.command in ('scene', 'timeline'):
+        if not args.value:
+            raise SystemExit("{} needs a name".format(args.command))
+        return 'POST', "/{}s/{}".format(args.command,
+                                        quote(args.value, safe='')), body
+    return 'GET', "/" + args.command, None
+
+
+def main(argv=None):
+    settings = daemon_settings()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('command',
+                        choices=['on', 'off', 'color', 'brightness', 'scene',
+                                 'timeline', 'state', 'stats', 'health'])
+    parser.add_argument('value', nargs='?',
+                        help="color or brightness label, scene or "
+                             "timeline name")
+    parser.add_argument('--group', default='0', help="group ID or name")
+    parser.add_argument('--light', help="light ID or name")
+    parser.add_argument('--transition', help="transition time label")
+    parser.add_argument('--wait', action='store_true',
+                        help="return once the bridge got the command")
+    parser.add_argument('--host', default=settings.get("host", '127.0.0.1'))
+    parser.add_argument('--port', type=int,
+                        default=settings.get("port", 8765))
+    parser.add_argument('--socket', default=settings.get("socket"))
+    args = parser.parse_args(argv)
+
+    method, path, body = build_request(args)
+    try:
+        status, response = call(method, path, body, args.host, args.port,
+                                args.socket)
+    except OSError as error:
+        print("Lumen daemon not reachable: {}".format(error),
+              file=sys.stderr)
+        return 2
+    print(json.dumps(response, indent=2))
+    return 0 if status < 400 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+"""
+A local HTTP/JSON control daemon holding one warm HueController.
+
+Scripts, automations and the lumen_cli client send their commands to
+the daemon instead of connecting to the bridge themselves, so they all
+share one connection pool, one state cache and one bridge rate budget.
+
+API:
+    GET  /health                 Whether the bridge is connected.
+    GET  /state                  Cached state of every light and group.
+    GET  /lights                 IDs of the lights matching the query
+                                 parameters room, group, on, reachable,
+                                 min_bri and max_bri.
+    GET  /lights/<id>            Cached state of a light.
+    GET  /groups/<id>            Cached state of a group.
+    GET  /stats                  Dispatcher, rate limiter, sequencer,
+                                 metrics and automation counters.
+    GET  /bridges                Health of every bridge of the cluster.
+    POST /lights/<id>            Queues a state, see below.
+    POST /groups/<id>            Queues a state, see below.
+    POST /scenes/<name>          Recalls a configured scene.
+    POST /timelines/<name>       Starts a configured timeline.
+    POST /events/<type>          Runs the automation rules triggered 
+                                 by an event, e.g. from a sensor script.
+                                 The body holds the "source" ID and the
+                                 event data.
+
+Lights and groups are given by ID or by their name in the Hue app,
+URL encoded. When the "bridges" setting lists further bridges, their
+lights and groups are given as the bridge name and the ID on that
+bridge joined by a slash, e.g. "hall%2F3" (see bridge_cluster.py).
+
+A state is a JSON object with any of "on", "color", "brightness" and
+"transition_time", using the labels from config.json; an unknown
+label is answered with 400. The state is queued and answered with
+202. With "wait": true the request returns once the command reached
+the bridge instead: 200 when the bridge accepted it, 502 when it
+failed and 504 when it did not get through in time.
+"""
+
+import json
+import logging
+import os
+import socketserver
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote
+
+logger = logging.getLogger(__name__)
+
+class LumenDaemon:
+    """
+    LumenDaemon serves a HueController over a local HTTP/JSON API, on a
+    TCP port or a Unix socket.
+
+    Attributes:
+    - controller (HueController): The controller shared by all clients.
+    - cluster (BridgeCluster): The further bridges, None for none.
+    - address: The (host, port) or socket path served on.
+
+    Methods:
+    - start: Starts serving in a background thread.
+    - serve_forever: Serves on the calling thread until shut down.
+    - stop: Stops the server.
+    - handle: Answers a single request, used by the HTTP handler.
+    """
+    # Seconds a request with "wait" waits for its command, below the
+    # client's timeout of lumen_cli.py.
+    WAIT_TIMEOUT = 8.0
+
+    def __init__(self, controller, host='127.0.0.1', port=8765,
+                 socket_path=None, cluster=None):
+        """
+        Initializes the LumenDaemon.
+
+        Args:
+            controller (HueController): The controller to serve.
+            host (str, optional): Address to listen on.
+                                  Defaults to "127.0.0.1".
+            port (int, optional): Port to listen on. Defaults to 8765.
+            socket_path (str, optional): Serve on this Unix socket
+                                         instead of a TCP port.
+            cluster (BridgeCluster, optional): Further bridges served
+                                               next to the controller.
+        """
+        self.controller = controller
+        self.cluster = cluster
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self._server = socketserver.ThreadingUnixStreamServer(
+                socket_path, _UnixDaemonHandler)
+            self.address = socket_path
+        else:
+            self._server = ThreadingHTTPServer((host, port), _DaemonHandler)
+            self.address = self._server.server_address[:2]
+        self._server.daemon_threads = True
+        self._server.lumen_daemon = self
+        self._socket_path = socket_path
+
+    def start(self):
+        """
+        Starts serving requests in a background thread.
+
+        Returns:
+            LumenDaemon: The daemon itself, for chaining.
+        """
+        threading.Thread(target=self._server.serve_forever,
+                         name="LumenDaemon", daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        """
+        Serves requests on the calling thread until stop() is called.
+        """
+        self._server.serve_forever()
+
+    def stop(self):
+        """
+        Stops the server and removes its Unix socket.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        if self._socket_path and os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+
+    def handle(self, method, path, body):
+        """
+        Answers a single request.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The requested path.
+            body (dict): The decoded JSON body, None when empty.
+
+        Returns:
+            tuple: (HTTP status, response to encode as JSON).
+        """
+        path, _, query = path.partition('?')
+        parts = [unquote(part) for part in path.split('/') if part]
+        try:
+            if method == 'GET':
+                return self._get(parts, dict(parse_qsl(query)))
+            if method == 'POST' and len(parts) == 2:
+                return self._post(parts[0], parts[1], body or {})
+        except KeyError as error:
+            return 404, {'error': "unknown {}".format(error)}
+        except ConnectionError as error:
+            return 503, {'error': str(error)}
+        except ValueError as error:
+            return 400, {'error': str(error)}
+        except Exception as error:
+            logger.exception("Failed to handle %s %s", method, path)
+            return 500, {'error': str(error)}
+        return 404, {'error': "no such endpoint: {} {}".format(method, path)}
+
+    def _get(self, parts, query):
+        controller = self.controller
+        cache = controller.state_cache
+        if parts == ['health']:
+            return 200, {'connected': controller.connected,
+                         'bridge': controller.bridge_ip}
+        if parts == ['state']:
+            return 200, {
+                'lights': {light_id: cache.get("light", light_id)
+                           for light_id in cache.group_lights(0)},
+                'groups': {group_id: cache.get("group", group_id)
+                           for group_id in cache.group_ids()}}
+        if parts == ['stats']:
+            stats = {'dispatcher': controller.dispatcher.stats(),
+                     'rate_limiter': controller.rate_limiter.stats(),
+                     'sequencer': controller.sequencer.stats()}
+            if controller.metrics is not None:
+                stats['metrics'] = controller.metrics.snapshot()['endpoints']
+            if controller.automation is not None:
+                stats['automation'] = controller.automation.stats()
+            return 200, stats
+        if parts == ['lights']:
+            return 200, {'lights': self._find_lights(query)}
+        if parts == ['bridges'] and self.cluster is not None:
+            return 200, self.cluster.check_health()
+        if len(parts) == 2 and parts[0] in ('lights', 'groups'):
+            kind = parts[0][:-1]
+            owner, name = controller, parts[1]
+            if self._in_cluster(name):
+                owner, name = self.cluster.resolve(name)
+            state = owner.state_cache.get(kind, owner.resolve(kind, name))
+            if not state:
+                raise KeyError(kind + " " + parts[1])
+            return 200, state
+        return 404, {'error': "no such endpoint: /" + '/'.join(parts)}
+
+    def _find_lights(self, query):
+        conditions = {}
+        for name in ('room', 'group'):
+            if name in query:
+                conditions[name] = query[name]
+        for name in ('on', 'reachable'):
+            if name in query:
+                conditions[name] = query[name].lower() in ('1', 'true', 'yes')
+        for name in ('min_bri', 'max_bri'):
+            if name in query:
+                conditions[name] = int(query[name])
+        return self.controller.find_lights(**conditions)
+
+    def _in_cluster(self, name):
+        return self.cluster is not None and \
+            self.cluster.SEPARATOR in name
+
+    def _post(self, resource, name, body):
+        controller = self.controller
+        member = None
+        if resource in ('lights', 'groups') and self._in_cluster(name):
+            member, name = self.cluster.resolve(name)
+        elif not controller.connected:
+            return 503, {'error': "not connected to the bridge"}
+
+        if resource == 'scenes':
+            controller.recall_scene(name, body.get("transition_time"))
+            return 200, {'recalled': name}
+        if resource == 'timelines':
+            controller.play_timeline(name, body.get("delay", 0.0))
+            return 200, {'started': name}
+        if resource == 'events':
+            data = dict(body)
+            source = data.pop("source", None)
+            return 200, {'fired': controller.handle_event(name, source, data)}
+        if resource not in ('lights', 'groups'):
+            return 404, {'error': "no such endpoint: /" + resource}
+
+        tables = controller.config.tables
+        for field, labels in (("brightness", tables.brightness_levels),
+                              ("transition_time", tables.transition_times)):
+            label = body.get(field)
+            if label is not None and label not in labels:
+                raise ValueError("unknown {} {!r}".format(
+                    field.replace('_', ' '), label))
+        settings = controller._build_settings(
+            body.get("color"), body.get("brightness"),
+            body.get("transition_time", "SHORT"))
+        if "on" in body:
+            settings['on'] = bool(body["on"])
+        # Queued like the GUI's commands, so clients sharing the daemon
+        # are coalesced and rate limited together.
+        kind = resource[:-1]
+        target = member or controller
+        future = target.dispatcher.submit(
+            kind, target.resolve(kind, name), settings)
+        if not body.get("wait"):
+            return 202, {'queued': settings}
+        try:
+            future.result(timeout=self.WAIT_TIMEOUT)
+        except FutureTimeoutError:
+            return 504, {'error': "the bridge did not answer in time",
+                         'queued': settings}
+        except Exception as error:
+            return 502, {'error': str(error) or type(error).__name__,
+                         'queued': settings}
+        return 200, {'sent': settings}
+
+
+class _DaemonHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length)) if length else None
+        except ValueError:
+            body = []
+        if body is not None and not isinstance(body, dict):
+            status, payload = 400, {'error': "body must be a JSON object"}
+        else:
+            status, payload = self.server.lumen_daemon.handle(self.command,
+                                                        self.path, body)
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = _respond
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        return str(self.client_address or 'local')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _UnixDaemonHandler(_DaemonHandler):
+    # TCP_NODELAY does not apply to Unix sockets.
+    disable_nagle_algorithm = False
@@ -16,6 +16,12 @@ Components:
 
 Run:
 Execute this script to launch the Lumen Lights ON application. 
+With --daemon no window is shown, the controller is served over a
+local HTTP/JSON API instead (see lumen_daemon.py) for lumen_cli.py,
+scripts and automations to share, and, when the "service" setting
+is enabled, to front-ends in other processes such as effect engines
+(see controller_service.py). --profile-startup prints the import
+time of every module and the time to the first window, then exits.
 
 Troubleshooting and issues:
 The application will try to find the Bridge automatically but
@@ -27,11 +33,138 @@ Email: rogerhagman84@gmail.com
 
 """
 
-from gui_controller import HueControllerGUI
-from hue_controller import HueController
+import argparse
+import logging
+import sys
+
+from startup_profile import ImportProfiler, StartupTimer
+
+# Everything else is imported inside the functions below, after the
+# startup timer and import profiler are running.
+
+
+def on_connected(app, timer, future):
+    """
+    Updates the window once the bridge is connected and reports how 
+    long the start took.
+    """
+    app.on_connected(future)
+    if future.exception() is None:
+        app.controller.start_automation()
+    print(timer.report())
+
+
+def on_profiled(app, timer, profiler):
+    """
+    Prints the startup profile once the window is shown and closes 
+    the application.
+    """
+    print(timer.report())
+    print()
+    print(profiler.report())
+    app.on_close()
+
+
+def run_daemon(controller, timer):
+    """
+    Connects the controller and serves it over the local API until 
+    interrupted.
+    """
+    from bridge_discovery import bootstrap_controller
+    from lumen_daemon import LumenDaemon
+
+    # Further bridges are served next to the main one, each on its
+    # own controller.
+    cluster = None
+    if controller.config.get_setting("bridges"):
+        from bridge_cluster import BridgeCluster
+        cluster = BridgeCluster.from_config()
+
+    settings = controller.config.get_setting("daemon", {})
+    daemon = LumenDaemon(controller, settings.get("host", '127.0.0.1'),
+                         settings.get("port", 8765), settings.get("socket"),
+                         cluster)
+    bootstrap_controller(controller, timer)
+    controller.start_event_stream()
+    controller.start_automation()
+
+    service = None
+    if controller.config.get_setting("service", {}).get("enabled"):
+        from controller_service import ControllerService, service_settings
+        address, authkey = service_settings(controller.config)
+        service = ControllerService(controller, *address, authkey=authkey)
+        service.start()
+        print("Front-ends attach on {}:{}".format(*service.address))
+
+    print(timer.report())
+    print("Lumen daemon serving on {}".format(daemon.address))
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+        if service is not None:
+            service.stop()
+        if cluster is not None:
+            cluster.close()
+        controller.close()
+
+
+def run_gui(controller, timer, profiler=None):
+    """
+    Shows the window first, finding and connecting to the bridge 
+    happens in the background.
+    """
+    from bridge_discovery import bootstrap_controller
+    from command_executor import call_when_done
+    from gui_controller import HueControllerGUI
 
-    
-if __name__ == "__main__":
-    controller = HueController()
     run_app = HueControllerGUI(controller)
-    run_app.mainloop()
\ No newline at end of file
+    timer.mark("window created")
+
+    def shown(event):
+        # Every widget reports <Map>, only the window itself counts.
+        if event.widget is not run_app:
+            return
+        timer.mark("window shown")
+        if profiler is not None:
+            run_app.after_idle(on_profiled, run_app, timer, profiler)
+    run_app.bind("<Map>", shown, "+")
+
+    if profiler is None:
+        future = controller.run_async(bootstrap_controller, controller, 
+                                      timer)
+        call_when_done(run_app, future,
+                       lambda done: on_connected(run_app, timer, done))
+    run_app.mainloop()
+
+
+if __name__ == "__main__":
+    timer = StartupTimer()
+    profiler = None
+    if "--profile-startup" in sys.argv:
+        profiler = ImportProfiler().install()
+
+    parser = argparse.ArgumentParser(description="Lumen Lights ON")
+    parser.add_argument('--daemon', action='store_true',
+                        help="serve the controller over a local HTTP/JSON "
+                             "API instead of showing a window")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="print the import time of every module and "
+                             "the time to the first window, then exit")
+    args = parser.parse_args()
+
+    from hue_controller import HueController
+    controller = HueController(connect=False)
+    controller.config.watch()
+    # The lights are shown as they were when Lumen last ran until the
+    # bridge answers.
+    controller.open_journal()
+    timer.mark("controller ready")
+
+    if args.daemon:
+        logging.basicConfig(level=logging.INFO)
+        run_daemon(controller, timer)
+    else:
+        run_gui(controller, timer, profiler)
@@ -0,0 +1,270 @@
+import threading
+import time
+
+class BridgeOverloadError(Exception):
+    """
+    Raised when the bridge refuses a command because it is overloaded,
+    error 901 ("Internal error, 503"), so the command can be retried
+    once the bridge had time to recover.
+    """
+
+
+class RateLimiter:
+    """
+    RateLimiter keeps the commands sent to the Philips Hue Bridge
+    within the rates the bridge can handle.
+
+    The bridge accepts roughly ten light commands and one group command
+    per second, anything above that is refused with error 901 or
+    silently dropped by the bridge itself. Each kind of endpoint
+    ("light" or "group") gets its own token bucket, refilled at the
+    rate of the kind and holding at most a burst of tokens. A command
+    takes one token.
+
+    The rates adapt to what the bridge reports, additive increase and
+    multiplicative decrease as in TCP: every command refused as
+    overloaded, or answered slower than the latency limit, halves the
+    rate of its kind, at most once per round trip. Every command
+    answered in time adds back a share of the configured rate, which
+    stays the ceiling.
+
+    Commands have a priority class. "user" and "normal" commands may
+    empty the bucket, "background" commands (effects, timelines) leave
+    a token in it when the burst allows, so a click does not wait
+    behind an effect.
+
+    Attributes:
+    - PRIORITIES (tuple): The priority classes, most urgent first.
+    - rates (dict): Configured, highest commands per second for each
+                    endpoint kind.
+    - burst (dict): Tokens each bucket holds at most.
+    - latency_limit (float): Seconds after which an answer counts as
+                             a sign of an overloaded bridge.
+
+    Methods:
+    - rate: Returns the current, adapted rate of a kind.
+    - delay: Seconds left until a command of a kind may be sent.
+    - reserve: Takes a token for a command sent right now.
+    - acquire: Blocks until a command of a kind may be sent.
+    - record: Adapts the rate to the bridge's answer to a command.
+    - configure: Applies new configured rates, burst and latency limit.
+    - stats: Returns the rates, tokens and adaptation counters.
+    """
+    DEFAULT_RATES = {"light": 10.0, "group": 1.0}
+    DEFAULT_BURST = {"light": 2.0, "group": 1.0}
+
+    PRIORITIES = ("user", "normal", "background")
+
+    # Tokens a command of each class leaves in the bucket.
+    HEADROOM = {"user": 0.0, "normal": 0.0, "background": 1.0}
+
+    DECREASE = 0.5
+    # Share of the configured rate added back per command answered in
+    # time, and the lowest share the rate is cut down to.
+    INCREASE = 0.05
+    MIN_SHARE = 0.1
+
+    def __init__(self, rates=None, burst=None, latency_limit=1.0,
+                 clock=time.monotonic):
+        """
+        Initializes the RateLimiter.
+
+        Args:
+            rates (dict, optional): Commands per second for each
+                                    endpoint kind. Defaults to
+                                    DEFAULT_RATES.
+            burst (dict, optional): Tokens each bucket holds at most.
+                                    Defaults to DEFAULT_BURST.
+            latency_limit (float, optional): Seconds after which an
+                    answer counts as a sign of overload. Defaults to 1.
+            clock (callable, optional): Returns the current time in
+                    seconds. Defaults to time.monotonic.
+        """
+        self.rates = dict(self.DEFAULT_RATES)
+        if rates:
+            self.rates.update(rates)
+        self.burst = dict(self.DEFAULT_BURST)
+        if burst:
+            self.burst.update(burst)
+        self.latency_limit = latency_limit
+        self._clock = clock
+
+        self._current = dict(self.rates)
+        # kind -> (tokens, clock() of the last refill)
+        self._buckets = {}
+        self._decreased = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _capacity(self, kind):
+        return max(1.0, self.burst.get(kind, 1.0))
+
+    def _refill(self, kind, now):
+        """
+        Returns the tokens of a kind at the given time. Must be called
+        with the lock held.
+        """
+        capacity = self._capacity(kind)
+        tokens, refilled = self._buckets.get(kind, (capacity, now))
+        rate = self._current.get(kind)
+        if rate:
+            tokens = min(capacity, tokens + (now - refilled) * rate)
+        self._buckets[kind] = (tokens, now)
+        return tokens
+
+    def _wait(self, kind, tokens, priority):
+        """
+        Seconds until the bucket holds enough tokens for a command of
+        the priority. Must be called with the lock held.
+        """
+        rate = self._current.get(kind)
+        if not rate:
+            return 0.0
+        needed = min(self._capacity(kind), 1.0 + self.HEADROOM[priority])
+        return max(0.0, (needed - tokens) / rate)
+
+    def rate(self, kind):
+        """
+        Args:
+            kind (str): The endpoint kind, "light" or "group".
+
+        Returns:
+            float: The adapted commands per second, None for no limit.
+        """
+        with self._lock:
+            return self._current.get(kind)
+
+    def delay(self, kind, priority="normal"):
+        """
+        Calculates the time left until a command may be sent.
+
+        Args:
+            kind (str): The endpoint kind, "light" or "group".
+            priority (str, optional): The priority class of the
+                                      command. Defaults to "normal".
+
+        Returns:
+            float: Seconds to wait, 0.0 if a command may go out now.
+        """
+        with self._lock:
+            tokens = self._refill(kind, self._clock())
+            return self._wait(kind, tokens, priority)
+
+    def reserve(self, kind):
+        """
+        Takes a token for a command of the given kind being sent now.
+
+        Args:
+            kind (str): The endpoint kind, "light" or "group".
+        """
+        with self._lock:
+            now = self._clock()
+            tokens = self._refill(kind, now)
+            if self._current.get(kind):
+                self._buckets[kind] = (tokens - 1.0, now)
+
+    def acquire(self, kind, priority="normal"):
+        """
+        Blocks the calling thread until a command of the given kind
+        may be sent and takes its token. Callers waiting at the same
+        time are let through one token apart.
+
+        Args:
+            kind (str): The endpoint kind, "light" or "group".
+            priority (str, optional): The priority class of the
+                                      command. Defaults to "normal".
+        """
+        with self._lock:
+            now = self._clock()
+            tokens = self._refill(kind, now)
+            wait = self._wait(kind, tokens, priority)
+            if self._current.get(kind):
+                # The token is taken ahead of time, the bucket may go
+                # below zero while callers are waiting.
+                self._buckets[kind] = (tokens - 1.0, now)
+        if wait > 0:
+            time.sleep(wait)
+
+    def record(self, kind, latency, overloaded=False):
+        """
+        Adapts the rate of a kind to how the bridge answered a command.
+
+        Args:
+            kind (str): The endpoint kind, "light" or "group".
+            latency (float): Seconds the bridge took to answer.
+            overloaded (bool, optional): True if the bridge refused the
+                                         command as overloaded.
+        """
+        with self._lock:
+            ceiling = self.rates.get(kind)
+            rate = self._current.get(kind)
+            if not ceiling or not rate:
+                return
+            counters = self._counters.setdefault(
+                kind, {'overloaded': 0, 'slow': 0, 'decreases': 0})
+            now = self._clock()
+            slow = latency > self.latency_limit
+            if overloaded or slow:
+                counters['overloaded' if overloaded else 'slow'] += 1
+                # Commands sent before the first refusal was seen fail
+                # as well, one decrease per round trip is enough.
+                if now - self._decreased.get(kind, 0.0) < \
+                        max(latency, 1.0 / rate):
+                    return
+                self._decreased[kind] = now
+                counters['decreases'] += 1
+                self._current[kind] = max(ceiling * self.MIN_SHARE,
+                                          rate * self.DECREASE)
+                if overloaded:
+                    # The bridge is full right now, nothing may be sent
+                    # before the bucket refilled.
+                    tokens = self._refill(kind, now)
+                    self._buckets[kind] = (min(tokens, 0.0), now)
+            else:
+                self._current[kind] = min(ceiling,
+                                          rate + ceiling * self.INCREASE)
+
+    def configure(self, rates=None, burst=None, latency_limit=None):
+        """
+        Applies new settings, e.g. after the configuration was reloaded.
+        An adapted rate above its new ceiling is lowered to it, a lower
+        one grows back towards it as commands are answered in time.
+
+        Args:
+            rates (dict, optional): Commands per second for each
+                                    endpoint kind, None for no limit.
+            burst (dict, optional): Tokens each bucket holds at most.
+            latency_limit (float, optional): Seconds after which an
+                    answer counts as a sign of overload.
+        """
+        with self._lock:
+            if rates:
+                self.rates.update(rates)
+                for kind, ceiling in rates.items():
+                    rate = self._current.get(kind)
+                    if rate and ceiling:
+                        ceiling = min(rate, ceiling)
+                    self._current[kind] = ceiling
+            if burst:
+                self.burst.update(burst)
+            if latency_limit is not None:
+                self.latency_limit = latency_limit
+
+    def stats(self):
+        """
+        Returns:
+            dict: Per endpoint kind the current "rate", the configured
+                  "ceiling", the "tokens" in the bucket and how often
+                  commands were "overloaded", "slow" and the rate
+                  decreased.
+        """
+        with self._lock:
+            now = self._clock()
+            stats = {}
+            for kind, ceiling in self.rates.items():
+                stats[kind] = dict(
+                    {'overloaded': 0, 'slow': 0, 'decreases': 0},
+                    rate=self._current.get(kind), ceiling=ceiling,
+                    tokens=round(self._refill(kind, now), 3),
+                    **self._counters.get(kind, {}))
+            return stats
@@ -0,0 +1,200 @@
+import hashlib
+import json
+
+# Prefix of the appdata marking scenes uploaded by Lumen. The bridge
+# allows 16 characters of appdata, the rest holds the content hash.
+APPDATA_PREFIX = "lumen:"
+HASH_LENGTH = 16 - len(APPDATA_PREFIX)
+
+
+def compile_scene(name, definition, controller):
+    """
+    Compiles a scene declared in the configuration into a bridge scene
+    object.
+
+    A definition names the group the scene belongs to, a "state" for
+    every light of the group and, optionally, "lights" overriding it
+    for single lights. States use the same labels as the rest of the
+    configuration, e.g.
+
+        "Evening": {
+            "group": 1,
+            "state": {"color": "YELLOW", "brightness": "DIM"},
+            "lights": {"3": {"on": false}},
+            "transition_time": "MEDIUM"
+        }
+
+    Args:
+        name (str): Name of the scene.
+        definition (dict): The scene as declared in the configuration.
+        controller (HueController): Translates labels and knows which
+                                    lights each group holds.
+
+    Returns:
+        dict: The scene object to upload, with its content hash in the
+              appdata.
+    """
+    group_id = str(definition["group"])
+    transition = definition.get("transition_time", "SHORT")
+    shared = definition.get("state", {})
+    overrides = definition.get("lights", {})
+
+    light_ids = controller.state_cache.group_lights(group_id)
+    light_ids = sorted(set(light_ids) | set(overrides), key=int)
+
+    lightstates = {}
+    for light_id in light_ids:
+        state = dict(shared)
+        state.update(overrides.get(light_id, {}))
+        settings = controller._build_settings(state.get("color"),
+                                              state.get("brightness"),
+                                              transition)
+        settings['on'] = state.get("on", True)
+        lightstates[light_id] = settings
+
+    content = {'name': name, 'group': group_id, 'lightstates': lightstates}
+    digest = hashlib.sha1(json.dumps(content, sort_keys=True)
+                          .encode('utf-8')).hexdigest()[:HASH_LENGTH]
+
+    return {
+        'name': name,
+        'type': 'GroupScene',
+        'group': group_id,
+        'lights': light_ids,
+        'lightstates': lightstates,
+        'recycle': False,
+        'appdata': {'version': 1, 'data': APPDATA_PREFIX + digest}
+    }
+
+
+class SceneManager:
+    """
+    SceneManager uploads the scenes declared in the configuration to
+    the bridge and recalls them.
+
+    Recalling a stored scene is a single group command, however many
+    lights it sets, and the bridge applies it to all lights at once.
+    Each uploaded scene carries a hash of its content, unchanged scenes
+    are never uploaded again.
+
+    Attributes:
+    - scene_ids (dict): Scene name -> ID of the scene on the bridge.
+    - groups (dict): Scene name -> ID of the group it belongs to.
+    - uploaded (int): Number of scenes created or updated.
+    - unchanged (int): Number of scenes already up to date.
+
+    Methods:
+    - sync: Uploads new and changed scenes.
+    - recall: Applies a scene with a single request.
+    """
+    def __init__(self, controller):
+        """
+        Args:
+            controller (HueController): The controller of the bridge
+                                        the scenes are stored on.
+        """
+        self.controller = controller
+        self.scene_ids = {}
+        self.groups = {}
+        self.uploaded = 0
+        self.unchanged = 0
+
+    def _address(self, *parts):
+        return '/'.join(['/api', self.controller.bridge.username, 'scenes']
+                        + list(parts))
+
+    def sync(self, bridge_scenes=None):
+        """
+        Uploads the scenes from the "scenes" setting which are new or
+        have changed since they were last uploaded.
+
+        Args:
+            bridge_scenes (dict, optional): The scenes stored on the
+                    bridge, as found in a full state read. Fetched when
+                    not given.
+
+        Returns:
+            list: Names of the scenes that were uploaded.
+        """
+        definitions = self.controller.config.get_setting("scenes", {})
+        if not definitions:
+            return []
+
+        bridge = self.controller.bridge
+        if bridge_scenes is None:
+            bridge_scenes = bridge.request('GET', self._address())
+        existing = {}
+        for scene_id, scene in (bridge_scenes or {}).items():
+            appdata = scene.get('appdata', {}).get('data', '')
+            if appdata.startswith(APPDATA_PREFIX):
+                existing[scene.get('name')] = (scene_id, appdata,
+                                               scene.get('group'))
+
+        uploaded = []
+        for name, definition in definitions.items():
+            scene = compile_scene(name, definition, self.controller)
+            self.groups[name] = scene['group']
+
+            scene_id, appdata, group_id = existing.get(name,
+                                                       (None, None, None))
+            if appdata == scene['appdata']['data']:
+                self.scene_ids[name] = scene_id
+                self.unchanged += 1
+                continue
+
+            # The type and group of a scene cannot be changed, a scene
+            # moved to another group is stored anew.
+            if scene_id is not None and group_id != scene['group']:
+                bridge.request('DELETE', self._address(scene_id))
+                scene_id = None
+
+            if scene_id is None:
+                response = bridge.request('POST', self._address(), scene)
+                scene_id = self._created_id(name, response)
+            else:
+                update = {key: value for key, value in scene.items()
+                          if key not in ('type', 'group', 'recycle')}
+                bridge.request('PUT', self._address(scene_id), update)
+
+            self.scene_ids[name] = scene_id
+            self.uploaded += 1
+            uploaded.append(name)
+        return uploaded
+
+    def _created_id(self, name, response):
+        for item in response or []:
+            if 'success' in item:
+                return item['success']['id']
+        raise RuntimeError("Could not create scene {!r}: {}".format(
+            name, response))
+
+    def recall(self, name, transition_time=None):
+        """
+        Applies a scene to its lights with a single group command.
+
+        Args:
+            name (str): Name of the scene.
+            transition_time (str, optional):
+                The label specifying the time taken to transition,
+                overriding the one stored with the scene.
+
+        Raises:
+            KeyError: If the scene has not been synced.
+            BridgeOverloadError: If the bridge refused the recall as
+                                 overloaded.
+        """
+        scene_id = self.scene_ids[name]
+        group_id = self.groups[name]
+        settings = {'scene': scene_id}
+        if transition_time is not None:
+            settings['transitiontime'] = \
+                self.controller.config.get_transition_time(transition_time)
+
+        self.controller.rate_limiter.acquire("group")
+        response = self.controller._send_checked("group", group_id, settings)
+
+        definition = self.controller.config.get_setting("scenes", {})[name]
+        scene = compile_scene(name, definition, self.controller)
+        for light_id, state in scene['lightstates'].items():
+            self.controller.state_cache.update("light", light_id, state)
+        return response
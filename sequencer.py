@@ -0,0 +1,411 @@
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class Keyframe:
+    """
+    Keyframe is a state a light or group reaches at a point of a
+    timeline.
+
+    Attributes:
+    - at (float): Seconds into the timeline the state is reached.
+    - kind (str): "light" or "group".
+    - target_id (str): The ID of the light or group.
+    - settings (dict): Bridge state attributes to apply.
+    - send_at (float): Seconds into the timeline the command is sent,
+                       its transition time before the keyframe.
+    """
+    __slots__ = ('at', 'kind', 'target_id', 'settings', 'send_at')
+
+    def __init__(self, at, kind, target_id, settings):
+        """
+        Args:
+            at (float): Seconds into the timeline the state is reached.
+            kind (str): "light" or "group".
+            target_id (str): The ID of the light or group.
+            settings (dict): Bridge state attributes to apply. Its
+                             transitiontime is shortened when the
+                             timeline starts too late to fit it.
+        """
+        self.at = at
+        self.kind = kind
+        self.target_id = str(target_id)
+        self.settings = dict(settings)
+
+        # The bridge interpolates towards the new state by itself, the
+        # command goes out early enough for the light to arrive on time.
+        transition = self.settings.get('transitiontime', 0) / 10
+        self.send_at = max(0.0, at - transition)
+        if 'transitiontime' in self.settings:
+            self.settings['transitiontime'] = \
+                int(round((at - self.send_at) * 10))
+
+
+class Timeline:
+    """
+    Timeline is a named sequence of keyframes.
+
+    Attributes:
+    - name (str): Name of the timeline.
+    - keyframes (list): The Keyframes, in the order they are sent.
+    - loop (bool): Whether the timeline starts over once done.
+    - duration (float): Seconds one pass of the timeline takes.
+
+    Methods:
+    - from_dict: Builds a timeline from its declaration.
+    """
+    def __init__(self, name, keyframes, loop=False, duration=None):
+        """
+        Args:
+            name (str): Name of the timeline.
+            keyframes (list): The Keyframes of the timeline.
+            loop (bool, optional): Start over once done.
+                                   Defaults to False.
+            duration (float, optional): Seconds one pass takes.
+                                        Defaults to the last keyframe.
+        """
+        self.name = name
+        self.keyframes = sorted(keyframes, key=lambda frame: frame.send_at)
+        self.loop = loop
+        last = max((frame.at for frame in keyframes), default=0.0)
+        self.duration = last if duration is None else max(duration, last)
+
+    @classmethod
+    def from_dict(cls, name, data, build_settings):
+        """
+        Builds a timeline from its declaration, e.g.
+
+            {
+                "loop": false,
+                "keyframes": [
+                    {"at": 1.0, "group": 0, "on": true, "color": "RED",
+                     "brightness": "BRIGHT", "transition_time": "SHORT"}
+                ]
+            }
+
+        Each keyframe names a "group" or a "light" and takes the same
+        labels as the rest of the configuration.
+
+        Args:
+            name (str): Name of the timeline.
+            data (dict): The declaration.
+            build_settings (callable): Translates labels into bridge
+                    state attributes, e.g. HueController._build_settings.
+
+        Returns:
+            Timeline: The compiled timeline.
+
+        Raises:
+            ValueError: If a keyframe names neither a group nor a light.
+        """
+        keyframes = []
+        for frame in data.get("keyframes", []):
+            if "group" in frame:
+                kind, target_id = "group", frame["group"]
+            elif "light" in frame:
+                kind, target_id = "light", frame["light"]
+            else:
+                raise ValueError("Keyframe of timeline {!r} names no group "
+                                 "or light: {}".format(name, frame))
+            settings = build_settings(frame.get("color"),
+                                      frame.get("brightness"),
+                                      frame.get("transition_time", "NONE"))
+            if "on" in frame:
+                settings['on'] = frame["on"]
+            keyframes.append(Keyframe(float(frame.get("at", 0.0)),
+                                      kind, target_id, settings))
+        return cls(name, keyframes, data.get("loop", False),
+                   data.get("duration"))
+
+
+def load_timelines(path, build_settings):
+    """
+    Loads the timelines declared under "timelines" in a JSON file laid
+    out like config.json.
+
+    Args:
+        path (str): Path to the file.
+        build_settings (callable): Translates labels into bridge state
+                                   attributes.
+
+    Returns:
+        dict: Timeline name -> Timeline.
+    """
+    with open(path, 'r') as file:
+        declarations = json.load(file).get("timelines", {})
+    return {name: Timeline.from_dict(name, data, build_settings)
+            for name, data in declarations.items()}
+
+
+class TimelineRun:
+    """
+    TimelineRun is one playback of a timeline on a Sequencer.
+
+    Attributes:
+    - timeline (Timeline): The timeline being played.
+    - paused (bool): Whether the run is paused.
+    - done (bool): Whether the run finished or was cancelled.
+
+    Methods:
+    - pause: Holds the run at its current position.
+    - resume: Continues a paused run.
+    - cancel: Ends the run, keyframes not sent yet are skipped.
+    - wait: Blocks until the run is done.
+    """
+    def __init__(self, sequencer, timeline, start):
+        self.timeline = timeline
+        self._sequencer = sequencer
+        self._start = start
+        self._index = 0
+        self._paused_at = None
+        # Bumped whenever the scheduled event of the run becomes stale.
+        self._generation = 0
+        self._done = threading.Event()
+
+    @property
+    def paused(self):
+        return self._paused_at is not None
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def pause(self):
+        """
+        Holds the run. Commands already sent keep transitioning.
+        """
+        self._sequencer._pause(self)
+
+    def resume(self):
+        """
+        Continues a paused run where it was paused.
+        """
+        self._sequencer._resume(self)
+
+    def cancel(self):
+        """
+        Ends the run, keyframes not sent yet are skipped.
+        """
+        self._sequencer._cancel(self)
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the run finished or was cancelled.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait.
+
+        Returns:
+            bool: True if the run is done, False on timeout.
+        """
+        return self._done.wait(timeout)
+
+    def _due(self):
+        if self._index < len(self.timeline.keyframes):
+            return self._start + self.timeline.keyframes[self._index].send_at
+        # Past the last keyframe the run ends once its duration is over.
+        return self._start + self.timeline.duration
+
+
+class Sequencer:
+    """
+    Sequencer plays timelines on a single scheduler thread.
+
+    The next due keyframe of every running timeline sits in a heap
+    ordered by its monotonic send time, so any number of timelines run
+    at once without a thread or a sleep of their own. Keyframes are
+    handed to a non-blocking send callable, e.g. the dispatcher's
+    submit, so a slow bridge never delays the schedule.
+
+    Attributes:
+    - fired (int): Number of keyframes sent.
+    - missed (int): Number of keyframes sent later than miss_threshold.
+    - max_lateness (float): Largest delay of a keyframe, in seconds.
+
+    Methods:
+    - play: Starts a timeline and returns its TimelineRun.
+    - runs: Returns the runs not done yet.
+    - stats: Returns the deadline metrics.
+    - stop: Cancels every run and stops the scheduler thread.
+    """
+    def __init__(self, send, miss_threshold=0.05):
+        """
+        Initializes the Sequencer and starts its scheduler thread.
+
+        Args:
+            send (callable): Called as send(kind, target_id, settings)
+                             for every keyframe. Should not block.
+            miss_threshold (float, optional): Seconds a keyframe may be
+                    late before it counts as missed. Defaults to 0.05.
+        """
+        self._send = send
+        self._miss_threshold = miss_threshold
+        # (due, sequence, generation, run), earliest first
+        self._heap = []
+        self._sequence = itertools.count()
+        self._runs = set()
+        self._running = True
+        self._condition = threading.Condition()
+
+        self.fired = 0
+        self.missed = 0
+        self.max_lateness = 0.0
+        self._total_lateness = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="Sequencer",
+                                         daemon=True)
+        self._thread.start()
+
+    def play(self, timeline, delay=0.0):
+        """
+        Starts playing a timeline.
+
+        Args:
+            timeline (Timeline): The timeline to play.
+            delay (float, optional): Seconds before it starts.
+
+        Returns:
+            TimelineRun: Controls the playback.
+
+        Raises:
+            ValueError: If the timeline loops but takes no time, it
+                        would start over without end.
+        """
+        if timeline.loop and timeline.keyframes and timeline.duration <= 0:
+            raise ValueError("Looping timeline {!r} needs a duration above "
+                             "0".format(timeline.name))
+        run = TimelineRun(self, timeline, time.monotonic() + delay)
+        with self._condition:
+            self._runs.add(run)
+            self._schedule(run)
+        return run
+
+    def runs(self):
+        """
+        Returns:
+            list: The TimelineRuns not done yet.
+        """
+        with self._condition:
+            return list(self._runs)
+
+    def stats(self):
+        """
+        Returns:
+            dict: The fired and missed counters, the maximum and mean
+                  lateness in milliseconds and the number of runs.
+        """
+        with self._condition:
+            return {
+                'fired': self.fired,
+                'missed': self.missed,
+                'max_lateness_ms': self.max_lateness * 1000,
+                'mean_lateness_ms': (self._total_lateness * 1000 /
+                                     self.fired if self.fired else 0.0),
+                'running': len(self._runs)
+            }
+
+    def stop(self):
+        """
+        Cancels every run and stops the scheduler thread.
+        """
+        with self._condition:
+            for run in list(self._runs):
+                self._finish(run)
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _schedule(self, run):
+        """
+        Pushes the next keyframe of a run, or finishes it. Must be
+        called with the condition held.
+        """
+        run._generation += 1
+        if run._index >= len(run.timeline.keyframes) and \
+                run.timeline.loop and run.timeline.keyframes:
+            run._start += run.timeline.duration
+            run._index = 0
+        heapq.heappush(self._heap, (run._due(), next(self._sequence),
+                                    run._generation, run))
+        self._condition.notify_all()
+
+    def _finish(self, run):
+        run._generation += 1
+        self._runs.discard(run)
+        run._done.set()
+
+    def _pause(self, run):
+        with self._condition:
+            if run.done or run.paused:
+                return
+            run._paused_at = time.monotonic()
+            run._generation += 1
+
+    def _resume(self, run):
+        with self._condition:
+            if run.done or not run.paused:
+                return
+            run._start += time.monotonic() - run._paused_at
+            run._paused_at = None
+            self._schedule(run)
+
+    def _cancel(self, run):
+        with self._condition:
+            if not run.done:
+                self._finish(run)
+
+    def _next_due(self):
+        """
+        Pops the next keyframe that is due, dropping stale entries of
+        paused and cancelled runs. Must be called with the condition
+        held.
+
+        Returns:
+            tuple: (run, keyframe, lateness, wait) where wait is the time
+                   to sleep when nothing is due yet.
+        """
+        while self._heap:
+            due, _, generation, run = self._heap[0]
+            if generation != run._generation:
+                heapq.heappop(self._heap)
+                continue
+            lateness = time.monotonic() - due
+            if lateness < 0:
+                return None, None, None, -lateness
+            heapq.heappop(self._heap)
+            if run._index >= len(run.timeline.keyframes):
+                self._finish(run)
+                continue
+            return run, run.timeline.keyframes[run._index], lateness, None
+        return None, None, None, None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._running:
+                        return
+                    run, keyframe, lateness, wait = self._next_due()
+                    if run is not None:
+                        break
+                    self._condition.wait(wait)
+
+                self.fired += 1
+                self._total_lateness += lateness
+                self.max_lateness = max(self.max_lateness, lateness)
+                if lateness > self._miss_threshold:
+                    self.missed += 1
+                run._index += 1
+                self._schedule(run)
+
+            try:
+                self._send(keyframe.kind, keyframe.target_id,
+                           keyframe.settings)
+            except Exception:
+                logger.exception("Failed to send keyframe of %s",
+                                 run.timeline.name)
@@ -0,0 +1,136 @@
+import importlib.abc
+import sys
+import time
+
+class StartupTimer:
+    """
+    StartupTimer records how long the steps of the application start
+    take, measured from the moment the timer was created.
+
+    Attributes:
+    - marks (dict): Step name -> seconds since the start.
+
+    Methods:
+    - mark: Records that a step was reached.
+    - report: Returns the recorded steps as readable text.
+    """
+    def __init__(self, start=None):
+        """
+        Args:
+            start (float, optional): time.perf_counter() value to
+                    measure from. Defaults to now.
+        """
+        self.start = time.perf_counter() if start is None else start
+        self.marks = {}
+
+    def mark(self, name):
+        """
+        Records that a step was reached, the first time only.
+
+        Args:
+            name (str): Name of the step, e.g. "window shown".
+        """
+        self.marks.setdefault(name, time.perf_counter() - self.start)
+
+    def report(self):
+        """
+        Returns:
+            str: One "name: milliseconds" line per recorded step.
+        """
+        return "\n".join("{:<20} {:8.1f} ms".format(name, seconds * 1000)
+                         for name, seconds in self.marks.items())
+
+
+class _TimedLoader(importlib.abc.Loader):
+    def __init__(self, profiler, loader):
+        self._profiler = profiler
+        self._loader = loader
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._profiler._enter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler._leave(module.__name__)
+
+    def __getattr__(self, name):
+        # get_resource_reader, get_source and the like.
+        return getattr(self._loader, name)
+
+
+class ImportProfiler(importlib.abc.MetaPathFinder):
+    """
+    ImportProfiler measures how long every module takes to import, the
+    same numbers "python -X importtime" prints, but collected in
+    process so they can be reported next to the startup marks.
+
+    Attributes:
+    - modules (dict): Module name -> (own seconds, cumulative seconds).
+
+    Methods:
+    - install: Starts measuring imports made from now on.
+    - uninstall: Stops measuring.
+    - report: Returns the slowest imports as readable text.
+    """
+    def __init__(self):
+        self.modules = {}
+        # Seconds spent in nested imports, one entry per running import.
+        self._stack = []
+
+    def install(self):
+        """
+        Returns:
+            ImportProfiler: The profiler itself, for chaining.
+        """
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+        return self
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and \
+                        hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(self, spec.loader)
+                return spec
+        return None
+
+    def _enter(self):
+        self._stack.append([time.perf_counter(), 0.0])
+
+    def _leave(self, name):
+        started, nested = self._stack.pop()
+        cumulative = time.perf_counter() - started
+        self.modules[name] = (cumulative - nested, cumulative)
+        if self._stack:
+            self._stack[-1][1] += cumulative
+
+    def report(self, limit=15):
+        """
+        Args:
+            limit (int, optional): Number of modules listed.
+
+        Returns:
+            str: The slowest top level imports by cumulative time, with
+                 their own time, and the total.
+        """
+        lines = ["{:<32} {:>9} {:>9}".format("module", "self ms", "cum ms")]
+        slowest = sorted(self.modules.items(), key=lambda item: item[1][1],
+                         reverse=True)
+        for name, (own, cumulative) in slowest[:limit]:
+            lines.append("{:<32} {:9.1f} {:9.1f}".format(
+                name, own * 1000, cumulative * 1000))
+        total = sum(own for own, _ in self.modules.values())
+        lines.append("{:<32} {:>9} {:9.1f} ({} modules)".format(
+            "total", "", total * 1000, len(self.modules)))
+        return "\n".join(lines)
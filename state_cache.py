@@ -0,0 +1,309 @@
+import threading
+
+class StateCache:
+    """
+    StateCache keeps the last known state of every light and group on
+    the bridge so that commands only carry what actually changes.
+
+    The cache is seeded from a single bulk read of the bridge (the
+    result of Bridge.get_api()) and updated with every command sent.
+    A group command is compared against the lights in the group, an
+    attribute is only left out when every light already has it.
+
+    Attributes:
+    - XY_TOLERANCE (float): Largest difference between two xy values
+                            still considered the same color. The bridge
+                            rounds xy to four decimals.
+    - journal (StateJournal): Persists every change, None for none.
+
+    Methods:
+    - seed: Replaces the cache content with a bulk bridge read.
+    - reconcile: Seeds the cache and notifies the listeners of what
+                 differs from the state it held before.
+    - export: Returns the cache content laid out like a bulk read.
+    - get: Returns the cached state of a light or group.
+    - group_lights: Returns the IDs of the lights in a group.
+    - group_ids: Returns the IDs of all known groups.
+    - diff: Returns the attributes of a command that would change
+            something.
+    - update: Records a state sent to the bridge and notifies the
+              listeners.
+    - report: Records a state reported by the bridge and notifies the
+              listeners of what changed.
+    - add_listener: Registers a callback for recorded changes.
+    """
+    XY_TOLERANCE = 0.001
+
+    # Attributes describing how to reach a state rather than the state
+    # itself, they are never cached or compared.
+    TRANSIENT = ('transitiontime',)
+
+    def __init__(self):
+        """
+        Initializes an empty StateCache.
+        """
+        self._lights = {}
+        self._groups = {}
+        self._group_lights = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self.journal = None
+
+    def seed(self, api):
+        """
+        Replaces the cache content with a bulk bridge read.
+
+        Args:
+            api (dict): The full bridge state as returned by
+                        Bridge.get_api().
+        """
+        lights = {}
+        for light_id, light in (api.get('lights') or {}).items():
+            lights[str(light_id)] = dict(light.get('state', {}))
+
+        groups = {}
+        group_lights = {}
+        for group_id, group in (api.get('groups') or {}).items():
+            groups[str(group_id)] = dict(group.get('action', {}))
+            group_lights[str(group_id)] = \
+                [str(light_id) for light_id in group.get('lights', [])]
+
+        # Group 0 is the bridge's implicit group of all lights.
+        groups.setdefault('0', {})
+        group_lights['0'] = list(lights)
+
+        with self._lock:
+            self._lights = lights
+            self._groups = groups
+            self._group_lights = group_lights
+
+        # A bulk read replaces everything journaled so far.
+        if self.journal is not None:
+            self.journal.compact(self.export())
+
+    def reconcile(self, api):
+        """
+        Seeds the cache with a bulk bridge read, e.g. after the cache 
+        was restored from the journal, and notifies the listeners of
+        every attribute that differs from what the cache held.
+
+        Args:
+            api (dict): The full bridge state as returned by
+                        Bridge.get_api().
+
+        Returns:
+            list: (kind, target_id, changes) for every light and group
+                  that changed.
+        """
+        with self._lock:
+            before = {"light": self._lights, "group": self._groups}
+        self.seed(api)
+        with self._lock:
+            after = {"light": self._lights, "group": self._groups}
+            listeners = list(self._listeners)
+
+        updates = []
+        for kind in ("light", "group"):
+            for target_id, state in after[kind].items():
+                cached = before[kind].get(target_id, {})
+                changes = {attribute: value
+                           for attribute, value in state.items()
+                           if not self._same(attribute, cached.get(attribute),
+                                             value)}
+                if changes:
+                    updates.append((kind, target_id, changes))
+        for update in updates:
+            for listener in listeners:
+                listener(*update)
+        return updates
+
+    def export(self):
+        """
+        Returns:
+            dict: A copy of the cache content laid out like a bulk 
+                  bridge read, with "lights" and "groups".
+        """
+        with self._lock:
+            return {
+                'lights': {light_id: {'state': dict(state)}
+                           for light_id, state in self._lights.items()},
+                'groups': {group_id: {'action': dict(self._groups.get(
+                                          group_id, {})),
+                                      'lights': list(light_ids)}
+                           for group_id, light_ids in
+                           self._group_lights.items()}
+            }
+
+    def get(self, kind, target_id):
+        """
+        Returns the cached state of a light or group.
+
+        Args:
+            kind (str): "light" or "group".
+            target_id (int): The ID of the light or group.
+
+        Returns:
+            dict: A copy of the cached state, empty if unknown.
+        """
+        with self._lock:
+            return dict(self._table(kind).get(str(target_id), {}))
+
+    def group_lights(self, group_id):
+        """
+        Args:
+            group_id (int): The ID of the group.
+
+        Returns:
+            list: IDs (as strings) of the lights in the group.
+        """
+        with self._lock:
+            return list(self._group_lights.get(str(group_id), []))
+
+    def group_ids(self):
+        """
+        Returns:
+            list: IDs (as strings) of all known groups, 0 included.
+        """
+        with self._lock:
+            return list(self._group_lights)
+
+    def diff(self, kind, target_id, settings):
+        """
+        Compares a command against the cache.
+
+        Args:
+            kind (str): "light" or "group".
+            target_id (int): The ID of the light or group.
+            settings (dict): The bridge state attributes to send.
+
+        Returns:
+            dict: The attributes that would change something, with the
+                  transition time kept if anything is left. An empty
+                  dict means no request is needed at all.
+        """
+        with self._lock:
+            states = self._states_for(kind, str(target_id))
+            changed = {}
+            for attribute, value in settings.items():
+                if attribute in self.TRANSIENT:
+                    continue
+                if not states or any(not self._same(attribute,
+                                                    state.get(attribute),
+                                                    value)
+                                     for state in states):
+                    changed[attribute] = value
+
+        if changed:
+            for attribute in self.TRANSIENT:
+                if attribute in settings:
+                    changed[attribute] = settings[attribute]
+        return changed
+
+    def update(self, kind, target_id, settings):
+        """
+        Records a state sent to the bridge. Updating a group also 
+        updates every light in it.
+
+        Listeners are called with (kind, target_id, state) from the 
+        calling thread, the lights of a group are not notified one by 
+        one.
+
+        Args:
+            kind (str): "light" or "group".
+            target_id (int): The ID of the light or group.
+            settings (dict): The bridge state attributes.
+        """
+        state = {attribute: value for attribute, value in settings.items()
+                 if attribute not in self.TRANSIENT}
+        target_id = str(target_id)
+        with self._lock:
+            self._table(kind).setdefault(target_id, {}).update(state)
+            if kind == "group":
+                for light_id in self._group_lights.get(target_id, []):
+                    self._lights.setdefault(light_id, {}).update(state)
+            listeners = list(self._listeners)
+
+        if self.journal is not None:
+            self.journal.append(self.journal.COMMAND, kind, target_id, state)
+        for listener in listeners:
+            listener(kind, target_id, state)
+
+    def report(self, kind, target_id, state):
+        """
+        Records a state reported by the bridge, e.g. by the event stream
+        after someone used a wall switch. Unlike update, a group report
+        is not copied to its lights, which are reported on their own.
+
+        Listeners are called with (kind, target_id, changes) from the
+        calling thread when anything changed.
+
+        Args:
+            kind (str): "light" or "group".
+            target_id (int): The ID of the light or group.
+            state (dict): The reported state attributes.
+
+        Returns:
+            dict: The attributes that changed, empty if none did.
+        """
+        target_id = str(target_id)
+        with self._lock:
+            cached = self._table(kind).setdefault(target_id, {})
+            changes = {attribute: value for attribute, value in state.items()
+                       if not self._same(attribute, cached.get(attribute),
+                                         value)}
+            cached.update(changes)
+            listeners = list(self._listeners)
+
+        if changes and self.journal is not None:
+            self.journal.append(self.journal.CONFIRMED, kind, target_id,
+                                changes)
+
+        if changes:
+            for listener in listeners:
+                listener(kind, target_id, changes)
+        return changes
+
+    def add_listener(self, callback):
+        """
+        Registers a callback for states sent to and reported by the 
+        bridge.
+
+        Args:
+            callback (callable): Called as callback(kind, target_id, 
+                                 changes).
+        """
+        with self._lock:
+            self._listeners.append(callback)
+
+    def _table(self, kind):
+        return self._groups if kind == "group" else self._lights
+
+    def _states_for(self, kind, target_id):
+        """
+        Returns the cached states a command would have to change, the
+        member lights for a group and the light itself otherwise.
+        """
+        if kind == "group":
+            light_ids = self._group_lights.get(target_id)
+            if light_ids:
+                return [self._lights.get(light_id, {})
+                        for light_id in light_ids]
+            if target_id in self._groups:
+                return [self._groups[target_id]]
+            return []
+        if target_id in self._lights:
+            return [self._lights[target_id]]
+        return []
+
+    def _same(self, attribute, cached, value):
+        if cached is None or value is None:
+            return False
+        if attribute == 'xy':
+            try:
+                return len(cached) == len(value) and \
+                    all(abs(a - b) <= self.XY_TOLERANCE
+                        for a, b in zip(cached, value))
+            except TypeError:
+                # Not a pair of numbers, only an equal value is the same.
+                return cached == value
+        return cached == value
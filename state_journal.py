@@ -0,0 +1,242 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+class StateJournal:
+    """
+    StateJournal persists the state cache in a compact, append-only
+    binary file so the last known state of every light is available
+    the moment the application starts, before the bridge is reached.
+
+    The file starts with a snapshot of the whole cache, written with
+    every bulk bridge read and whenever the journal grows past
+    compact_after records. Commands sent and states reported by the
+    bridge are appended after it as fixed size records, one write
+    each. Restoring maps the file and replays it in a single pass.
+
+    Record layout (little endian, 21 bytes):
+        type (B), kind (B), target ID (H), time (d), mask (B),
+        on (B), bri (B), x * 10000 (H), y * 10000 (H), ct (H)
+    Membership records put the light ID in the ct field.
+
+    Attributes:
+    - path (str): Path of the journal file.
+    - compact_after (int): Records appended before the journal is
+                           compacted into a new snapshot.
+    - records (int): Records in the file.
+
+    Methods:
+    - restore: Reads the file back into a bulk bridge read layout.
+    - append: Appends a command or a confirmed state.
+    - compact: Replaces the file with a snapshot of the full state.
+    - close: Closes the file.
+    """
+    MAGIC = b'LUMJ0001'
+    RECORD = struct.Struct('<BBHdBBBHHH')
+
+    COMMAND = 1
+    CONFIRMED = 2
+    MEMBER = 3
+
+    KINDS = {"light": 0, "group": 1}
+
+    ON, BRI, XY, CT = 1, 2, 4, 8
+
+    def __init__(self, path, compact_after=4096, snapshot=None):
+        """
+        Initializes the StateJournal.
+
+        Args:
+            path (str): Path of the journal file.
+            compact_after (int, optional): Records appended before the
+                    journal is compacted. Defaults to 4096.
+            snapshot (callable, optional): Returns the full state to
+                    compact into, e.g. StateCache.export.
+        """
+        self.path = path
+        self.compact_after = compact_after
+        self.snapshot = snapshot
+        self.records = 0
+        self._appended = 0
+        self._fd = None
+        self._lock = threading.Lock()
+
+    def restore(self):
+        """
+        Reads the journal back.
+
+        Returns:
+            dict: The restored state laid out like a bulk bridge read,
+                  {"lights": {id: {"state": ...}}, "groups": {id:
+                  {"action": ..., "lights": [...]}}}, or None when there
+                  is no usable journal.
+        """
+        try:
+            with open(self.path, 'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                if size <= len(self.MAGIC):
+                    return None
+                with mmap.mmap(file.fileno(), 0,
+                               access=mmap.ACCESS_READ) as data:
+                    if data[:len(self.MAGIC)] != self.MAGIC:
+                        return None
+                    # A record torn by a crash at the end is ignored.
+                    count = (size - len(self.MAGIC)) // self.RECORD.size
+                    end = len(self.MAGIC) + count * self.RECORD.size
+                    records = self.RECORD.iter_unpack(
+                        data[len(self.MAGIC):end])
+                    api = self._replay(records)
+        except (OSError, ValueError):
+            return None
+        self.records = count
+        return api
+
+    def _replay(self, records):
+        lights = {}
+        groups = {}
+        for (record_type, kind, target, _, mask, on, bri, x, y,
+             ct) in records:
+            target_id = str(target)
+            if record_type == self.MEMBER:
+                group = groups.setdefault(target_id, {'action': {},
+                                                      'lights': []})
+                group['lights'].append(str(ct))
+                continue
+            if kind == self.KINDS["group"]:
+                state = groups.setdefault(target_id, {'action': {},
+                                                      'lights': []})['action']
+                # A group command reaches every light in it.
+                members = [lights.setdefault(light_id, {'state': {}})['state']
+                           for light_id in groups[target_id]['lights']]
+            else:
+                state = lights.setdefault(target_id, {'state': {}})['state']
+                members = []
+            settings = self._decode(mask, on, bri, x, y, ct)
+            state.update(settings)
+            if record_type == self.COMMAND:
+                for member in members:
+                    member.update(settings)
+        return {'lights': lights, 'groups': groups}
+
+    def append(self, record_type, kind, target_id, settings):
+        """
+        Appends a command or a confirmed state. Targets without a
+        numeric ID and settings without a journaled attribute are
+        skipped.
+
+        Args:
+            record_type (int): StateJournal.COMMAND or CONFIRMED.
+            kind (str): "light" or "group".
+            target_id (str): The ID of the light or group.
+            settings (dict): The bridge state attributes.
+        """
+        target_id = str(target_id)
+        if not target_id.isdigit():
+            return
+        record = self._encode(record_type, self.KINDS[kind], int(target_id),
+                              settings)
+        if record is None:
+            return
+        with self._lock:
+            self._write(record)
+            self._appended += 1
+            compact = self.snapshot is not None and \
+                self._appended >= self.compact_after
+        if compact:
+            self.compact(self.snapshot())
+
+    def compact(self, api):
+        """
+        Replaces the journal with a snapshot of the full state.
+
+        Args:
+            api (dict): The full state laid out like a bulk bridge read.
+        """
+        records = [self.MAGIC]
+        for group_id, group in (api.get('groups') or {}).items():
+            if not str(group_id).isdigit():
+                continue
+            for light_id in group.get('lights', []):
+                if str(light_id).isdigit():
+                    records.append(self.RECORD.pack(
+                        self.MEMBER, self.KINDS["group"], int(group_id),
+                        0.0, 0, 0, 0, 0, 0, int(light_id)))
+        for kind, resource, key in (("group", 'groups', 'action'),
+                                    ("light", 'lights', 'state')):
+            for target_id, item in (api.get(resource) or {}).items():
+                if str(target_id).isdigit():
+                    record = self._encode(self.CONFIRMED, self.KINDS[kind],
+                                          int(target_id), item.get(key, {}))
+                    if record is not None:
+                        records.append(record)
+
+        temp_path = self.path + '.tmp'
+        with self._lock:
+            with open(temp_path, 'wb') as file:
+                file.write(b''.join(records))
+                file.flush()
+                os.fsync(file.fileno())
+            self._close_fd()
+            os.replace(temp_path, self.path)
+            self.records = len(records) - 1
+            self._appended = 0
+
+    def close(self):
+        """
+        Closes the journal file.
+        """
+        with self._lock:
+            self._close_fd()
+
+    def _write(self, record):
+        """
+        Appends a record with a single write. Must be called with the
+        lock held.
+        """
+        if self._fd is None:
+            self._fd = os.open(self.path,
+                               os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            if os.fstat(self._fd).st_size == 0:
+                os.write(self._fd, self.MAGIC)
+        os.write(self._fd, record)
+        self.records += 1
+
+    def _close_fd(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _encode(self, record_type, kind, target, settings):
+        mask = 0
+        on = bri = x = y = ct = 0
+        if 'on' in settings:
+            mask |= self.ON
+            on = 1 if settings['on'] else 0
+        if settings.get('bri') is not None:
+            mask |= self.BRI
+            bri = max(0, min(255, int(settings['bri'])))
+        if settings.get('xy') is not None:
+            mask |= self.XY
+            x, y = (max(0, min(65535, int(round(value * 10000))))
+                    for value in settings['xy'][:2])
+        if settings.get('ct') is not None:
+            mask |= self.CT
+            ct = max(0, min(65535, int(settings['ct'])))
+        if not mask:
+            return None
+        return self.RECORD.pack(record_type, kind, target, time.time(),
+                                mask, on, bri, x, y, ct)
+
+    def _decode(self, mask, on, bri, x, y, ct):
+        settings = {}
+        if mask & self.ON:
+            settings['on'] = bool(on)
+        if mask & self.BRI:
+            settings['bri'] = bri
+        if mask & self.XY:
+            settings['xy'] = [x / 10000, y / 10000]
+        if mask & self.CT:
+            settings['ct'] = ct
+        return settings
@@ -0,0 +1,11 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config_manager import ConfigManager
+
+# The configuration is a process wide singleton, load the repository's
+# config.json wherever the tests are run from.
+ConfigManager(os.path.join(ROOT, "config.json"))
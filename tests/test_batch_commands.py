@@ -0,0 +1,69 @@
+from batch_commands import plan_batch
+from state_cache import StateCache
+
+ON = {'on': True, 'bri': 200}
+OFF = {'on': False}
+
+
+def cache(groups, lights=6):
+    cache = StateCache()
+    cache.seed({
+        'lights': {str(light_id): {'state': {}}
+                   for light_id in range(1, lights + 1)},
+        'groups': {group_id: {'action': {}, 'lights': members}
+                   for group_id, members in groups.items()}})
+    return cache
+
+
+def lights(*light_ids, settings=ON):
+    return {("light", str(light_id)): settings for light_id in light_ids}
+
+
+def test_group_inside_the_lights_is_merged():
+    states = lights(1, 2, 3, 4)
+    plan = plan_batch(states, cache({'1': ['1', '2', '3']}))
+    assert plan == [
+        ("group", "1", ON, [("light", "1"), ("light", "2"), ("light", "3")]),
+        ("light", "4", ON, [("light", "4")])]
+
+
+def test_group_with_a_light_outside_the_batch_is_not_merged():
+    plan = plan_batch(lights(1, 2), cache({'1': ['1', '2', '3']}))
+    assert [command[:2] for command in plan] == \
+        [("light", "1"), ("light", "2")]
+
+
+def test_lights_in_different_states_are_merged_apart():
+    states = lights(1, 2)
+    states.update(lights(3, 4, settings=OFF))
+    plan = plan_batch(states, cache({'1': ['1', '2'], '2': ['3', '4']}))
+    assert sorted(command[:3] for command in plan) == \
+        [("group", "1", ON), ("group", "2", OFF)]
+
+
+def test_overlapping_groups_cover_each_light_once():
+    groups = {'1': ['1', '2', '3'], '2': ['3', '4'], '3': ['4', '5']}
+    plan = plan_batch(lights(1, 2, 3, 4, 5), cache(groups))
+    assert [command[:2] for command in plan] == \
+        [("group", "1"), ("group", "3")]
+    covered = [target for command in plan for target in command[3]]
+    assert sorted(covered) == sorted(lights(1, 2, 3, 4, 5))
+
+
+def test_all_lights_go_out_as_group_zero():
+    plan = plan_batch(lights(1, 2, 3, 4, 5, 6), cache({'1': ['1', '2']}))
+    assert [command[:2] for command in plan] == [("group", "0")]
+
+
+def test_single_light_groups_are_not_used():
+    plan = plan_batch(lights(1), cache({'1': ['1']}))
+    assert plan == [("light", "1", ON, [("light", "1")])]
+
+
+def test_group_targets_keep_their_own_command():
+    states = {("group", "2"): OFF}
+    states.update(lights(1, 2))
+    plan = plan_batch(states, cache({'1': ['1', '2'], '2': ['3', '4']}))
+    assert plan == [
+        ("group", "2", OFF, [("group", "2")]),
+        ("group", "1", ON, [("light", "1"), ("light", "2")])]
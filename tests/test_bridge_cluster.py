@@ -0,0 +1,94 @@
+import socket
+
+import pytest
+
+from bridge_cluster import BridgeCluster
+from config_manager import ConfigManager
+from fake_bridge import FakeBridge
+from hue_controller import HueController
+
+
+def closed_address():
+    # A port nothing listens on, connecting to it is refused.
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return "127.0.0.1:{}".format(probe.getsockname()[1])
+
+
+@pytest.fixture
+def fakes():
+    bridges = {name: FakeBridge(lights=3, latency=latency).start()
+               for name, latency in (('fast', 0.0), ('slow', 0.05))}
+    yield bridges
+    for bridge in bridges.values():
+        bridge.stop()
+
+
+@pytest.fixture
+def cluster(fakes):
+    cluster = BridgeCluster(
+        [{'name': name, 'ip': fake.address, 'username': fake.username}
+         for name, fake in fakes.items()] +
+        [{'name': 'gone', 'ip': closed_address(), 'username': 'nobody'}])
+    yield cluster
+    cluster.close()
+
+
+def test_unreachable_bridge_is_offline(cluster):
+    assert list(cluster.offline) == ['gone']
+    assert cluster.controllers['fast'].connected
+    assert cluster.controllers['slow'].connected
+    with pytest.raises(ConnectionError):
+        cluster.resolve("gone/1")
+
+
+def test_lights_share_one_namespace(cluster):
+    assert sorted(cluster.lights()) == [
+        "fast/1", "fast/2", "fast/3", "slow/1", "slow/2", "slow/3"]
+
+
+def test_submit_reaches_the_owning_bridge(cluster, fakes):
+    cluster.submit("light", "slow/2", {'on': True, 'bri': 42}).result(5)
+    assert [command[1:3] for command in fakes['slow'].commands] == \
+        [("light", "2")]
+    assert fakes['fast'].commands == []
+
+
+def test_batch_reports_offline_targets(cluster, fakes):
+    result = cluster.apply_batch({("light", "fast/1"): {'bri': 10},
+                                  ("light", "gone/1"): {'bri': 10}})
+    assert isinstance(result.results[("light", "gone/1")], ConnectionError)
+    assert not isinstance(result.results[("light", "fast/1")], Exception)
+    assert fakes['fast'].commands
+
+
+def test_health_per_bridge(cluster):
+    cluster.submit("light", "fast/1", {'bri': 1}).result(5)
+    health = cluster.check_health()
+    assert health['fast']['reachable'] and health['fast']['sent'] == 1
+    assert health['slow']['reachable']
+    assert not health['gone']['reachable'] and 'error' in health['gone']
+
+
+def test_members_leave_scenes_alone(fakes, monkeypatch):
+    config = ConfigManager()
+    monkeypatch.setitem(config.config_data, "scenes", {
+        "Evening": {"group": 1, "state": {"brightness": "DIM"}}})
+    cluster = BridgeCluster([{'name': 'fast', 'ip': fakes['fast'].address,
+                              'username': fakes['fast'].username}])
+    try:
+        assert not fakes['fast'].state['scenes']
+    finally:
+        cluster.close()
+
+    # A controller of its own does upload them.
+    controller = HueController(fakes['slow'].address, fakes['slow'].username)
+    controller.close()
+    assert fakes['slow'].state['scenes']
+
+
+def test_duplicate_names_are_refused(fakes):
+    fake = fakes['fast']
+    with pytest.raises(ValueError):
+        BridgeCluster([{'name': 'a', 'ip': fake.address},
+                       {'name': 'a', 'ip': fake.address}])
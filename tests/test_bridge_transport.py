@@ -0,0 +1,62 @@
+import socket
+import time
+
+import pytest
+
+from bridge_transport import PooledTransport, Transport
+from fake_bridge import FakeBridge
+
+
+@pytest.fixture
+def bridge():
+    with FakeBridge(lights=2) as bridge:
+        yield bridge
+
+
+def path(bridge):
+    return '/api/{}/lights'.format(bridge.username)
+
+
+def test_pooled_connection_is_reused(bridge):
+    transport = PooledTransport(bridge.address, pool_size=1)
+    try:
+        for _ in range(3):
+            assert set(transport.request('GET', path(bridge))) == {'1', '2'}
+        assert transport._idle.qsize() == 1
+    finally:
+        transport.close()
+
+
+def test_closed_keep_alive_connection_is_retried_at_once(bridge):
+    transport = PooledTransport(bridge.address, backoff=5.0, pool_size=1)
+    try:
+        transport.request('GET', path(bridge))
+        # Stands in for the bridge dropping an idle connection.
+        idle = transport._idle.get_nowait()
+        idle.sock.shutdown(socket.SHUT_RDWR)
+        transport._idle.put(idle)
+
+        start = time.monotonic()
+        assert transport.request('GET', path(bridge))
+        assert time.monotonic() - start < 1.0
+        assert bridge.request_count == 2
+    finally:
+        transport.close()
+
+
+@pytest.mark.parametrize('pooled', [False, True])
+def test_timeouts_back_off(bridge, pooled):
+    transport = (PooledTransport if pooled else Transport)(
+        bridge.address, timeout=0.1, retries=1, backoff=0.2)
+    try:
+        transport.request('GET', path(bridge))
+        bridge.latency = 0.3
+        start = time.monotonic()
+        with pytest.raises(socket.timeout):
+            transport.request('GET', path(bridge))
+        assert time.monotonic() - start >= 0.2 + 2 * 0.1
+        # One send and one retry, the slow bridge is not hit again at once.
+        time.sleep(0.4)
+        assert bridge.request_count == 3
+    finally:
+        transport.close()
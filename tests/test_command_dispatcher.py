@@ -0,0 +1,31 @@
+import threading
+
+from command_dispatcher import CommandDispatcher
+from rate_limiter import RateLimiter
+
+
+def test_numeric_and_string_ids_share_one_slot():
+    sent = []
+    release = threading.Event()
+
+    def send(kind, target_id, settings):
+        release.wait(5)
+        sent.append((kind, target_id, settings))
+
+    dispatcher = CommandDispatcher(send, RateLimiter({"group": 100.0}))
+    try:
+        # The first command holds the worker while the others queue.
+        dispatcher.submit("group", 1, {'on': True})
+        assert dispatcher.flush(0.05) is False
+        first = dispatcher.submit("group", 0, {'bri': 10})
+        second = dispatcher.submit("group", "0", {'bri': 20})
+        assert dispatcher.pending() == 1
+        release.set()
+        first.result(5)
+        second.result(5)
+        assert dispatcher.flush(5)
+    finally:
+        dispatcher.stop()
+
+    assert sent[1:] == [("group", "0", {'bri': 20})]
+    assert dispatcher.stats()['dropped'] == 1
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from config_manager import ConfigManager, ConfigTables
+from hue_controller import HueController
+
+
+@pytest.fixture
+def data():
+    return ConfigManager().config_data
+
+
+@pytest.fixture
+def config(tmp_path, data):
+    path = str(tmp_path / "config.json")
+    with open(path, 'w') as file:
+        json.dump(data, file)
+    # Bypasses the singleton for a configuration of its own.
+    return type.__call__(ConfigManager, path)
+
+
+def rewrite(config, **changes):
+    data = dict(config.config_data, **changes)
+    with open(config.config_path, 'w') as file:
+        json.dump(data, file)
+
+
+@pytest.mark.parametrize("value, label", [
+    (-1, "NEUTRAL"), (0, "NEUTRAL"), (254, "VERY_BRIGHT"),
+    (300, "VERY_BRIGHT"), (150, "NEUTRAL"), (100, "DIM")])
+def test_label_for_brightness_clamps(value, label):
+    assert ConfigManager().label_for_brightness(value) == label
+
+
+def test_reload_notifies_listeners(config):
+    reloaded = []
+    config.add_listener(reloaded.append)
+    rewrite(config, default_brightness=42)
+    assert config.reload()
+    assert config.get_brightness("UNKNOWN") == 42
+    assert [tables.default_brightness for tables in reloaded] == [42]
+
+    config.remove_listener(reloaded.append)
+    assert config.reload()
+    assert len(reloaded) == 1
+
+
+def test_failed_listener_keeps_the_reload(config):
+    def broken(tables):
+        raise RuntimeError("listener bug")
+    config.add_listener(broken)
+    rewrite(config, default_brightness=43)
+    assert config.reload()
+    assert config.get_brightness("UNKNOWN") == 43
+
+
+def test_broken_file_keeps_the_configuration(config):
+    reloaded = []
+    config.add_listener(reloaded.append)
+    with open(config.config_path, 'w') as file:
+        file.write("{")
+    before = config.tables
+    assert not config.reload()
+    assert reloaded == []
+    assert config.tables is before
+
+
+def test_controller_applies_reloaded_settings(data):
+    controller = HueController("127.0.0.1:1", "user", connect=False)
+    try:
+        controller.color_engine
+        controller._on_config_reload(ConfigTables(dict(
+            data, rate_limits={"light": 4, "group": 1},
+            color_gamut="A" if data["color_gamut"] != "A" else "B")))
+        assert controller.rate_limiter.rate("light") == 4
+        assert controller.rate_limiter.rates["light"] == 4
+        assert controller._color_engine is None
+    finally:
+        controller.close()
@@ -0,0 +1,39 @@
+import os
+import stat
+
+import pytest
+
+from controller_service import ControllerService, service_settings
+
+
+class Config:
+    def __init__(self, directory, service):
+        self.config_path = os.path.join(str(directory), "config.json")
+        self._service = service
+
+    def get_setting(self, key, default=None):
+        return self._service if key == "service" else default
+
+
+def test_configured_authkey_is_used(tmp_path):
+    address, authkey = service_settings(
+        Config(tmp_path, {"port": 9000, "authkey": "secret"}))
+    assert address == ('127.0.0.1', 9000)
+    assert authkey == b'secret'
+    assert not os.listdir(tmp_path)
+
+
+def test_random_authkey_is_kept_private(tmp_path):
+    config = Config(tmp_path, {"authkey_file": "service.key"})
+    _, authkey = service_settings(config)
+    path = tmp_path / "service.key"
+    assert len(authkey) == 64
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    # The same key is read back by the next process.
+    assert service_settings(config)[1] == authkey
+    assert service_settings(Config(tmp_path, {}))[1] == authkey
+
+
+def test_service_refuses_to_run_without_authkey():
+    with pytest.raises(ValueError):
+        ControllerService(None, port=0, authkey=None)
@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+from entertainment import (ColorLoop, EntertainmentStream, FramePacket,
+                           LoopbackReceiver)
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def receiver():
+    receiver = LoopbackReceiver()
+    receiver.start()
+    yield receiver
+    receiver.stop()
+
+
+def test_packet_round_trip():
+    packet = FramePacket([3, 7])
+    packet.set_sequence(258)
+    packet.set_color(0, 1.0, 0.0, 0.5)
+    packet.set_color(1, 0.0, 1.0, 0.0)
+    assert bytes(packet.buffer[:9]) == b'HueStream'
+    assert FramePacket.parse(bytes(packet.buffer)) == \
+        (2, {3: (0xFFFF, 0, 0x7FFF), 7: (0, 0xFFFF, 0)})
+
+
+def test_colors_out_of_range_are_clamped():
+    packet = FramePacket([1])
+    packet.set_color(0, 1.5, -0.2, 1.0000001)
+    assert FramePacket.parse(bytes(packet.buffer))[1][1] == \
+        (0xFFFF, 0, 0xFFFF)
+
+
+def test_frames_arrive_at_the_rate(receiver):
+    rate, seconds = 50.0, 1.0
+    stream = EntertainmentStream(range(1, 11), receiver.address,
+                                 ColorLoop(), rate=rate)
+    stream.start()
+    time.sleep(seconds)
+    stream.stop()
+    sent = stream.stats()
+    assert wait_until(lambda: receiver.received == sent['frames_sent'])
+
+    expected = rate * seconds
+    assert expected * 0.8 <= sent['frames_sent'] + sent['frames_skipped'] \
+        <= expected * 1.2
+    stats = receiver.stats()
+    # Nothing is lost on loopback, only frames skipped for being late
+    # leave gaps in the sequence.
+    assert stats['dropped'] == sent['frames_skipped']
+    assert stats['dropped'] <= expected * 0.1
+    assert stats['interval_ms'] == pytest.approx(1000 / rate, rel=0.2)
+    assert stats['jitter_ms'] < 1000 / rate / 2
+    assert len(receiver.last_colors) == 10
+
+
+def test_failing_effect_stops_the_stream(receiver):
+    def effect(elapsed, packet):
+        if elapsed >= 0.1:
+            raise RuntimeError("effect bug")
+        packet.set_color(0, 1.0, 1.0, 1.0)
+
+    stream = EntertainmentStream([1], receiver.address, effect, rate=50.0)
+    stream.start()
+    assert wait_until(lambda: stream.error is not None)
+    stream.stop()
+    assert isinstance(stream.error, RuntimeError)
+    assert 0 < stream.frames_sent <= 5
@@ -0,0 +1,153 @@
+import copy
+import socket
+import time
+
+import pytest
+
+from event_stream import EventStream, v2_sensor_event, v2_to_v1
+from fake_bridge import FakeBridge
+from state_cache import StateCache
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def follow(bridge, cache, **kwargs):
+    # A copy, like a bulk read, so the fake's own state is not shared.
+    stream = EventStream(bridge.address, bridge.username, cache,
+                         lambda: copy.deepcopy(bridge.state), scheme='http',
+                         poll_min_interval=0.05, poll_max_interval=0.2,
+                         **kwargs)
+    stream.start()
+    return stream
+
+
+@pytest.fixture
+def bridge():
+    with FakeBridge(lights=3) as bridge:
+        yield bridge
+
+
+@pytest.fixture
+def cache(bridge):
+    cache = StateCache()
+    cache.seed(copy.deepcopy(bridge.state))
+    return cache
+
+
+def test_v2_light_update_is_translated():
+    kind, target_id, state = v2_to_v1({
+        'id_v1': '/lights/4', 'type': 'light', 'on': {'on': True},
+        'dimming': {'brightness': 50.0},
+        'color': {'xy': {'x': 0.3, 'y': 0.4}},
+        'color_temperature': {'mirek': 300}})
+    assert (kind, target_id) == ("light", "4")
+    assert state == {'on': True, 'bri': 127, 'xy': [0.3, 0.4], 'ct': 300}
+
+
+def test_v2_group_and_sensor_updates_are_translated():
+    assert v2_to_v1({'id_v1': '/groups/2', 'type': 'grouped_light',
+                     'on': {'on': False}}) == ("group", "2", {'on': False})
+    assert v2_to_v1({'id_v1': '/sensors/5', 'type': 'motion'}) is None
+    assert v2_sensor_event({'id_v1': '/sensors/5', 'type': 'motion',
+                            'motion': {'motion': True}}) == \
+        ("motion", "5", {'motion': True})
+
+
+def test_stream_reports_changes_to_the_cache(bridge, cache):
+    stream = follow(bridge, cache)
+    try:
+        bridge.set_light_state("2", {'on': True, 'bri': 254})
+        assert wait_until(lambda: cache.get("light", "2").get('bri') == 254)
+        assert cache.get("light", "2")['on'] is True
+        assert stream.mode == "stream"
+    finally:
+        stream.stop()
+
+
+def test_failing_listener_does_not_stop_the_stream(bridge, cache):
+    seen = []
+
+    def listener(kind, target_id, changes):
+        seen.append(target_id)
+        if target_id == "1":
+            raise RuntimeError("listener bug")
+    cache.add_listener(listener)
+
+    stream = follow(bridge, cache)
+    try:
+        bridge.set_light_state("1", {'bri': 10})
+        bridge.set_light_state("3", {'bri': 20})
+        assert wait_until(lambda: "3" in seen)
+        assert stream.reconnects == 0
+    finally:
+        stream.stop()
+
+
+def test_failing_event_handler_and_bad_data_are_skipped(bridge, cache):
+    def on_event(event_type, source, data):
+        raise RuntimeError("rule bug")
+
+    stream = follow(bridge, cache, on_event=on_event)
+    try:
+        with bridge._changed:
+            bridge._events.append((1, "not json"))
+            bridge._events.append((2, '[{"type": "update", "data": [{'
+                                      '"id_v1": "/sensors/5", '
+                                      '"type": "motion", '
+                                      '"motion": {"motion": true}}]}]'))
+            bridge._changed.notify_all()
+        bridge.set_light_state("2", {'bri': 30})
+        assert wait_until(lambda: cache.get("light", "2").get('bri') == 30)
+        assert stream.reconnects == 0
+    finally:
+        stream.stop()
+
+
+def test_polls_lights_and_groups_without_stream():
+    with FakeBridge(lights=3, event_stream=False) as bridge:
+        cache = StateCache()
+        cache.seed(copy.deepcopy(bridge.state))
+        stream = follow(bridge, cache)
+        try:
+            assert wait_until(lambda: stream.mode == "polling")
+            bridge.set_light_state("1", {'on': True})
+            with bridge._lock:
+                bridge.state['groups']['1']['action']['bri'] = 42
+            assert wait_until(
+                lambda: cache.get("light", "1").get('on') is True and
+                cache.get("group", "1").get('bri') == 42)
+        finally:
+            stream.stop()
+
+
+def test_unreachable_stream_falls_back_to_polling(bridge, cache):
+    # Nothing listens on the stream's port until a second bridge is
+    # started there.
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    stream = EventStream("127.0.0.1:{}".format(port), bridge.username, cache,
+                         lambda: copy.deepcopy(bridge.state), scheme='http',
+                         poll_min_interval=0.05, poll_max_interval=0.2,
+                         max_failures=2, stream_retry_interval=0.5)
+    stream.start()
+    try:
+        assert wait_until(lambda: stream.mode == "polling")
+        bridge.set_light_state("1", {'bri': 77})
+        assert wait_until(lambda: cache.get("light", "1").get('bri') == 77)
+
+        # Only the stream reports the second bridge's changes.
+        with FakeBridge(lights=3, port=port) as restarted:
+            restarted.set_light_state("2", {'bri': 88})
+            assert wait_until(
+                lambda: cache.get("light", "2").get('bri') == 88, timeout=10)
+            assert stream.mode == "stream"
+    finally:
+        stream.stop()
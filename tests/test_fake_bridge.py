@@ -0,0 +1,82 @@
+import http.client
+import json
+
+import pytest
+
+from fake_bridge import FakeBridge
+
+
+def put(bridge, path, body):
+    connection = http.client.HTTPConnection(bridge.address, timeout=5)
+    try:
+        connection.request('PUT', '/api/{}/{}'.format(bridge.username, path),
+                           json.dumps(body))
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+@pytest.fixture
+def bridge():
+    with FakeBridge(lights=3, rate_limits={'light': 5.0, 'group': 1.0}) \
+            as bridge:
+        yield bridge
+
+
+def test_commands_within_the_limits_succeed(bridge):
+    status, body = put(bridge, "lights/1/state", {'on': True, 'bri': 80})
+    assert status == 200
+    assert body == [{'success': {'/lights/1/state/on': True}},
+                    {'success': {'/lights/1/state/bri': 80}}]
+    assert bridge.state['lights']['1']['state']['bri'] == 80
+
+
+def test_commands_over_the_limit_are_refused(bridge):
+    # The bucket holds a second worth of commands.
+    answers = [put(bridge, "lights/1/state", {'bri': bri})
+               for bri in range(1, 11)]
+    statuses = [status for status, _ in answers]
+    assert statuses[:5] == [200] * 5
+    assert 429 in statuses[5:]
+
+    status, body = answers[statuses.index(429)]
+    assert body[0]['error']['type'] == 901
+    assert body[0]['error']['address'] == "/lights/1/state"
+    assert bridge.throttled == statuses.count(429)
+    # Refused commands change nothing.
+    applied = [command[3]['bri'] for command in bridge.commands]
+    assert bridge.state['lights']['1']['state']['bri'] == applied[-1]
+    assert len(applied) == statuses.count(200)
+
+
+def test_groups_have_their_own_limit(bridge):
+    assert put(bridge, "groups/1/action", {'on': True})[0] == 200
+    assert put(bridge, "groups/1/action", {'on': True})[0] == 200
+    assert put(bridge, "groups/1/action", {'on': False})[0] == 429
+    assert put(bridge, "lights/2/state", {'on': True})[0] == 200
+
+
+def test_injected_errors_are_answered_in_the_body(bridge):
+    bridge.fail_next(2)
+    for _ in range(2):
+        status, body = put(bridge, "lights/3/state", {'on': True})
+        assert status == 200
+        assert body[0]['error'] == {'type': 901, 'address': "/lights/3/state",
+                                    'description': "Internal error, 503"}
+    assert put(bridge, "lights/3/state", {'on': True})[0] == 200
+    assert bridge.errors == 2 and bridge.throttled == 0
+    assert bridge.state['lights']['3']['state']['on'] is True
+
+
+def test_random_errors_follow_the_error_rate():
+    with FakeBridge(lights=1, error_rate=1.0, seed=1) as bridge:
+        status, body = put(bridge, "lights/1/state", {'on': True})
+        assert status == 200 and body[0]['error']['type'] == 901
+        assert bridge.errors == 1 and not bridge.commands
+
+
+def test_unknown_light_is_not_found():
+    with FakeBridge(lights=1) as bridge:
+        status, body = put(bridge, "lights/9/state", {'on': True})
+        assert status == 200 and body[0]['error']['type'] == 3
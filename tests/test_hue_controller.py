@@ -0,0 +1,54 @@
+import pytest
+
+from fake_bridge import FakeBridge
+from hue_controller import HueController, _confirmed_settings
+
+
+@pytest.fixture
+def bridge():
+    with FakeBridge(lights=3) as bridge:
+        yield bridge
+
+
+@pytest.fixture
+def controller(bridge):
+    controller = HueController(bridge.address, bridge.username)
+    yield controller
+    controller.close()
+
+
+def test_only_confirmed_attributes_are_applied():
+    settings = {'on': True, 'bri': 80, 'transitiontime': 4}
+    response = [{'success': {'/lights/1/state/on': True}},
+                {'error': {'type': 201, 'address': '/lights/1/state/bri',
+                           'description': "parameter, bri, is not "
+                                          "modifiable. Device is set to off."}},
+                {'success': {'/lights/1/state/transitiontime': 4}}]
+    assert _confirmed_settings(response, settings) == \
+        {'on': True, 'transitiontime': 4}
+
+
+def test_error_on_the_resource_rejects_everything():
+    response = [[{'error': {'type': 3, 'address': '/lights/9/state',
+                            'description': "resource not available"}}]]
+    assert _confirmed_settings(response, {'on': True}) == {}
+
+
+def test_answer_without_entries_keeps_what_was_not_rejected():
+    assert _confirmed_settings(None, {'on': True}) == {'on': True}
+
+
+def test_rejected_command_is_sent_again(controller, bridge):
+    before = controller.state_cache.get("light", "2")['bri']
+    bridge.fail_next(1, error_type=201, description="not modifiable")
+    controller.submit_light_settings(2, brightness="DIM",
+                                     kind="light").result(5)
+    assert controller.state_cache.get("light", "2")['bri'] == before
+    assert not bridge.commands
+
+    # Not diffed away against a state the bridge never took.
+    controller.submit_light_settings(2, brightness="DIM",
+                                     kind="light").result(5)
+    applied = bridge.state['lights']['2']['state']['bri']
+    assert len(bridge.commands) == 1 and applied != before
+    assert controller.state_cache.get("light", "2")['bri'] == applied
@@ -0,0 +1,159 @@
+import time
+
+import pytest
+
+from fake_bridge import FakeBridge
+from hue_controller import HueController
+from rate_limiter import RateLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def limiter(clock):
+    return RateLimiter({"light": 10.0, "group": 1.0},
+                       {"light": 2.0, "group": 1.0}, latency_limit=1.0,
+                       clock=clock)
+
+
+def test_bucket_starts_full_and_refills_at_the_rate(limiter, clock):
+    limiter.reserve("light")
+    limiter.reserve("light")
+    assert limiter.delay("light") == pytest.approx(0.1)
+    clock.advance(0.05)
+    assert limiter.delay("light") == pytest.approx(0.05)
+    clock.advance(0.05)
+    assert limiter.delay("light") == pytest.approx(0.0, abs=1e-9)
+
+
+def test_bucket_holds_at_most_the_burst(limiter, clock):
+    clock.advance(60)
+    assert limiter.stats()["light"]["tokens"] == 2.0
+    limiter.reserve("light")
+    limiter.reserve("light")
+    assert limiter.delay("light") > 0
+
+
+def test_kinds_have_separate_buckets(limiter):
+    limiter.reserve("group")
+    assert limiter.delay("group") == pytest.approx(1.0)
+    assert limiter.delay("light") == 0.0
+
+
+def test_background_leaves_headroom(limiter, clock):
+    limiter.reserve("light")
+    # One token left: enough for a click, not for an effect.
+    assert limiter.delay("light", "user") == 0.0
+    assert limiter.delay("light", "normal") == 0.0
+    assert limiter.delay("light", "background") == pytest.approx(0.1)
+    clock.advance(0.1)
+    assert limiter.delay("light", "background") == pytest.approx(0.0,
+                                                                 abs=1e-9)
+
+
+def test_headroom_is_capped_by_the_burst(limiter):
+    # A bucket of one token can leave nothing for others.
+    assert limiter.delay("group", "background") == 0.0
+
+
+def test_overload_halves_the_rate_once_per_round_trip(limiter, clock):
+    limiter.record("light", 0.05, overloaded=True)
+    assert limiter.rate("light") == 5.0
+    # Refused commands sent before the first answer came back.
+    limiter.record("light", 0.05, overloaded=True)
+    assert limiter.rate("light") == 5.0
+    clock.advance(0.2)
+    limiter.record("light", 0.05, overloaded=True)
+    assert limiter.rate("light") == 2.5
+    stats = limiter.stats()["light"]
+    assert stats["overloaded"] == 3 and stats["decreases"] == 2
+
+
+def test_overload_empties_the_bucket(limiter):
+    limiter.record("light", 0.05, overloaded=True)
+    assert limiter.delay("light") == pytest.approx(1 / 5.0)
+
+
+def test_slow_answers_decrease_the_rate(limiter):
+    limiter.record("group", 2.0)
+    assert limiter.rate("group") == 0.5
+    assert limiter.stats()["group"]["slow"] == 1
+
+
+def test_rate_never_drops_below_the_minimum_share(limiter, clock):
+    for _ in range(20):
+        clock.advance(60)
+        limiter.record("light", 0.05, overloaded=True)
+    assert limiter.rate("light") == pytest.approx(10.0 * limiter.MIN_SHARE)
+
+
+def test_answers_in_time_increase_up_to_the_ceiling(limiter):
+    limiter.record("light", 0.05, overloaded=True)
+    limiter.record("light", 0.05)
+    assert limiter.rate("light") == pytest.approx(5.5)
+    for _ in range(20):
+        limiter.record("light", 0.05)
+    assert limiter.rate("light") == 10.0
+
+
+@pytest.fixture
+def controller():
+    # The bridge accepts fewer light commands than the limiter starts
+    # out sending.
+    with FakeBridge(lights=12, rate_limits={'light': 3.0}) as bridge:
+        controller = HueController(bridge.address, bridge.username)
+        yield controller, bridge
+        controller.close()
+
+
+def test_overloaded_bridge_slows_the_dispatcher_down(controller):
+    controller, bridge = controller
+    futures = [controller.dispatcher.submit("light", str(light_id),
+                                            {'bri': light_id})
+               for light_id in range(1, 13)]
+    for future in futures:
+        future.result(20)
+
+    assert bridge.throttled > 0
+    stats = controller.rate_limiter.stats()["light"]
+    assert stats["overloaded"] == bridge.throttled
+    assert stats["decreases"] >= 1
+    assert controller.rate_limiter.rate("light") < 10.0
+    # Refused commands were sent again, none got lost.
+    assert controller.dispatcher.stats()["retried"] == bridge.throttled
+    assert all(bridge.state['lights'][str(light_id)]['state']['bri'] ==
+               light_id for light_id in range(1, 13))
+
+
+def test_user_commands_go_ahead_of_background_traffic(controller):
+    controller, bridge = controller
+    background = [controller.dispatcher.submit(
+        "light", str(light_id), {'bri': light_id}, priority="background")
+        for light_id in range(1, 12)]
+    deadline = time.monotonic() + 5
+    while len(bridge.commands) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    waiting = 11 - len(bridge.commands)
+
+    controller.dispatcher.submit("light", "12", {'on': True},
+                                 priority="user").result(10)
+    for future in background:
+        future.result(20)
+    order = [command[2] for command in bridge.commands]
+    # At most the command already on its way goes out before the click.
+    assert order.index("12") <= 11 - waiting + 1
+    assert waiting >= 8
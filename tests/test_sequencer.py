@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+
+from config_manager import ConfigManager
+from sequencer import Keyframe, Sequencer, Timeline, load_timelines
+
+
+class Recorder:
+    def __init__(self):
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def __call__(self, kind, target_id, settings):
+        with self._lock:
+            self.sent.append((time.monotonic(), kind, target_id,
+                              dict(settings)))
+
+    def targets(self):
+        with self._lock:
+            return [target_id for _, _, target_id, _ in self.sent]
+
+
+@pytest.fixture
+def recorder():
+    return Recorder()
+
+
+@pytest.fixture
+def sequencer(recorder):
+    sequencer = Sequencer(recorder)
+    yield sequencer
+    sequencer.stop()
+
+
+def timeline(*frames, **kwargs):
+    return Timeline("test", [Keyframe(at, "light", target_id, settings)
+                             for at, target_id, settings in frames],
+                    **kwargs)
+
+
+def test_keyframes_are_sent_in_time_order(sequencer, recorder):
+    start = time.monotonic()
+    run = sequencer.play(timeline((0.10, "3", {'bri': 3}),
+                                  (0.00, "1", {'bri': 1}),
+                                  (0.05, "2", {'bri': 2})))
+    assert run.wait(2)
+    assert recorder.targets() == ["1", "2", "3"]
+    assert recorder.sent[-1][0] - start >= 0.10
+    assert sequencer.stats()['fired'] == 3
+
+
+def test_transition_is_sent_ahead_of_the_keyframe(sequencer, recorder):
+    # The light has to arrive at 0.2 s after a 0.1 s transition.
+    sequencer.play(timeline((0.2, "1", {'bri': 9, 'transitiontime': 1}),
+                            (0.15, "2", {'bri': 1}))).wait(2)
+    assert recorder.targets() == ["1", "2"]
+
+
+def test_timelines_run_at_the_same_time(sequencer, recorder):
+    first = sequencer.play(timeline((0.0, "1", {}), (0.1, "1", {})))
+    second = sequencer.play(timeline((0.05, "2", {})))
+    assert first.wait(2) and second.wait(2)
+    assert recorder.targets() == ["1", "2", "1"]
+
+
+def test_pause_holds_and_resume_continues(sequencer, recorder):
+    run = sequencer.play(timeline((0.0, "1", {}), (0.1, "2", {})))
+    time.sleep(0.03)
+    run.pause()
+    assert run.paused
+    time.sleep(0.2)
+    assert recorder.targets() == ["1"]
+
+    run.resume()
+    assert not run.paused
+    assert run.wait(2)
+    assert recorder.targets() == ["1", "2"]
+    # The pause shifted the rest of the timeline.
+    assert recorder.sent[1][0] - recorder.sent[0][0] >= 0.25
+
+
+def test_cancel_skips_the_rest(sequencer, recorder):
+    run = sequencer.play(timeline((0.0, "1", {}), (0.2, "2", {})))
+    time.sleep(0.05)
+    run.cancel()
+    assert run.done and run.wait(0)
+    time.sleep(0.25)
+    assert recorder.targets() == ["1"]
+    assert sequencer.runs() == []
+
+
+def test_looping_timeline_starts_over(sequencer, recorder):
+    run = sequencer.play(timeline((0.0, "1", {}), loop=True, duration=0.05))
+    time.sleep(0.22)
+    run.cancel()
+    assert 3 <= len(recorder.targets()) <= 6
+
+
+def test_looping_timeline_without_duration_is_refused(sequencer):
+    with pytest.raises(ValueError):
+        sequencer.play(timeline((0.0, "1", {}), loop=True))
+    assert sequencer.runs() == []
+
+
+def test_test_lights_keeps_the_original_timing():
+    # The sleep based routine sent its commands two seconds apart.
+    config = ConfigManager()
+
+    def build_settings(color, brightness, transition_time):
+        return {'transitiontime': config.get_transition_time(transition_time)}
+
+    test_lights = load_timelines(config.config_path,
+                                 build_settings)["test_lights"]
+    assert [frame.send_at for frame in test_lights.keyframes] == \
+        [0.0, 2.0, 4.0, 6.0]
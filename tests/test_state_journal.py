@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from state_journal import StateJournal
+
+API = {
+    'lights': {'1': {'state': {'on': True, 'bri': 200, 'xy': [0.3, 0.4]}},
+               '2': {'state': {'on': False, 'bri': 10, 'ct': 366}}},
+    'groups': {'1': {'action': {'on': True, 'bri': 200},
+                     'lights': ['1', '2']}}
+}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "state.journal")
+
+
+def test_missing_journal_restores_nothing(path):
+    assert StateJournal(path).restore() is None
+
+
+def test_snapshot_and_records_round_trip(path):
+    journal = StateJournal(path)
+    journal.compact(API)
+    journal.append(StateJournal.CONFIRMED, "light", "2", {'on': True})
+    journal.append(StateJournal.COMMAND, "group", "1",
+                   {'bri': 50, 'transitiontime': 4})
+    journal.close()
+
+    restored = StateJournal(path).restore()
+    assert restored['lights']['1']['state'] == \
+        {'on': True, 'bri': 50, 'xy': [0.3, 0.4]}
+    assert restored['lights']['2']['state'] == \
+        {'on': True, 'bri': 50, 'ct': 366}
+    assert restored['groups']['1'] == \
+        {'action': {'on': True, 'bri': 50}, 'lights': ['1', '2']}
+
+
+def test_unjournaled_targets_and_attributes_are_skipped(path):
+    journal = StateJournal(path)
+    journal.append(StateJournal.COMMAND, "light", "kitchen", {'on': True})
+    journal.append(StateJournal.COMMAND, "light", "1", {'alert': 'select'})
+    journal.close()
+    assert journal.records == 0
+    assert StateJournal(path).restore() is None
+
+
+def test_compacts_after_the_threshold(path):
+    snapshots = []
+
+    def snapshot():
+        snapshots.append(True)
+        return API
+
+    journal = StateJournal(path, compact_after=3, snapshot=snapshot)
+    for bri in (1, 2, 3):
+        journal.append(StateJournal.CONFIRMED, "light", "1", {'bri': bri})
+    journal.close()
+
+    assert len(snapshots) == 1
+    # Two memberships, one group and two lights, nothing appended.
+    assert journal.records == 5
+    size = len(StateJournal.MAGIC) + 5 * StateJournal.RECORD.size
+    assert os.path.getsize(path) == size
+    assert StateJournal(path).restore()['lights']['1']['state']['bri'] == 200
+
+
+def test_torn_record_at_the_end_is_ignored(path):
+    journal = StateJournal(path)
+    journal.append(StateJournal.CONFIRMED, "light", "1", {'bri': 90})
+    journal.append(StateJournal.CONFIRMED, "light", "1", {'bri': 120})
+    journal.close()
+    with open(path, 'r+b') as file:
+        file.truncate(os.path.getsize(path) - 5)
+
+    reader = StateJournal(path)
+    assert reader.restore()['lights']['1']['state'] == {'bri': 90}
+    assert reader.records == 1
+
+
+def test_foreign_file_restores_nothing(path):
+    with open(path, 'wb') as file:
+        file.write(b'not a journal at all')
+    assert StateJournal(path).restore() is None
@@ -0,0 +1,210 @@
+import threading
+
+class Topology:
+    """
+    Topology indexes the lights, groups and scenes of the bridge by ID,
+    name, room and type, built from the same bulk read that seeds the
+    state cache.
+
+    Names are looked up in constant time, case insensitively. Applying
+    a newer bulk read only touches the entries that were added, changed
+    or removed, and tells the listeners which ones those were.
+
+    Attributes:
+    - KINDS (tuple): "light", "group" and "scene".
+
+    Methods:
+    - update: Applies a bulk bridge read and returns what changed.
+    - get: Returns the entry of a light, group or scene.
+    - ids: Returns the IDs of every light, group or scene.
+    - find: Finds the ID of a light, group or scene by name.
+    - resolve: Finds the ID of a light, group or scene by ID or name.
+    - of_type: Returns the IDs of the lights or groups of a type.
+    - rooms: Returns the IDs of the groups that are rooms.
+    - room_of: Returns the ID of the room a light is in.
+    - add_listener: Registers a callback for topology changes.
+    """
+    KINDS = ("light", "group", "scene")
+
+    # The attributes kept per entry, everything else in a bulk read is
+    # state or bridge bookkeeping.
+    FIELDS = {
+        "light": ('name', 'type', 'modelid', 'productname'),
+        "group": ('name', 'type', 'class', 'lights'),
+        "scene": ('name', 'type', 'group', 'lights'),
+    }
+
+    RESOURCES = {"light": 'lights', "group": 'groups', "scene": 'scenes'}
+
+    def __init__(self):
+        self._entries = {kind: {} for kind in self.KINDS}
+        self._names = {kind: {} for kind in self.KINDS}
+        self._types = {kind: {} for kind in self.KINDS}
+        self._rooms = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def update(self, api):
+        """
+        Applies a bulk bridge read, updating only the entries that
+        differ from the last one.
+
+        Args:
+            api (dict): The full bridge state as returned by
+                        Bridge.get_api().
+
+        Returns:
+            list: (kind, ID) of every entry added, changed or removed.
+        """
+        changes = []
+        with self._lock:
+            for kind in self.KINDS:
+                items = api.get(self.RESOURCES[kind]) or {}
+                entries = self._entries[kind]
+                fresh = {}
+                for item_id, item in items.items():
+                    fresh[str(item_id)] = self._entry(kind, item)
+                for item_id in [item_id for item_id in entries
+                                if item_id not in fresh]:
+                    self._unindex(kind, item_id)
+                    del entries[item_id]
+                    changes.append((kind, item_id))
+                for item_id, entry in fresh.items():
+                    if entries.get(item_id) == entry:
+                        continue
+                    if item_id in entries:
+                        self._unindex(kind, item_id)
+                    entries[item_id] = entry
+                    self._index(kind, item_id)
+                    changes.append((kind, item_id))
+            listeners = list(self._listeners)
+
+        if changes:
+            for listener in listeners:
+                listener(changes)
+        return changes
+
+    def get(self, kind, item_id):
+        """
+        Returns:
+            dict: A copy of the entry, with its "name", "type" and the
+                  like, empty if unknown.
+        """
+        with self._lock:
+            return dict(self._entries[kind].get(str(item_id), {}))
+
+    def ids(self, kind):
+        """
+        Returns:
+            list: IDs of every light, group or scene, as strings.
+        """
+        with self._lock:
+            return list(self._entries[kind])
+
+    def find(self, kind, name):
+        """
+        Finds a light, group or scene by name, ignoring case.
+
+        Args:
+            kind (str): "light", "group" or "scene".
+            name (str): The name shown in the Hue app.
+
+        Returns:
+            str: The ID, None if no such name is known.
+        """
+        return self._names[kind].get(name.casefold())
+
+    def resolve(self, kind, target):
+        """
+        Finds a light, group or scene given by ID or by name.
+
+        Args:
+            kind (str): "light", "group" or "scene".
+            target (str or int): An ID or a name.
+
+        Returns:
+            str: The ID, None if it matches neither.
+        """
+        target = str(target)
+        if target in self._entries[kind]:
+            return target
+        return self.find(kind, target)
+
+    def of_type(self, kind, item_type):
+        """
+        Args:
+            kind (str): "light" or "group".
+            item_type (str): e.g. "Extended color light" or "Room".
+
+        Returns:
+            list: IDs of the lights or groups of that type.
+        """
+        with self._lock:
+            return sorted(self._types[kind].get(item_type, ()),
+                          key=lambda item_id: (len(item_id), item_id))
+
+    def rooms(self):
+        """
+        Returns:
+            list: IDs of the groups that are rooms.
+        """
+        return self.of_type("group", "Room")
+
+    def room_of(self, light_id):
+        """
+        Returns:
+            str: The ID of the room the light is in, None if it is in
+                 none.
+        """
+        return self._rooms.get(str(light_id))
+
+    def add_listener(self, callback):
+        """
+        Registers a callback for topology changes.
+
+        Args:
+            callback (callable): Called as callback(changes) with the
+                                 list returned by update.
+        """
+        with self._lock:
+            self._listeners.append(callback)
+
+    def _entry(self, kind, item):
+        entry = {field: item[field] for field in self.FIELDS[kind]
+                 if field in item}
+        if 'lights' in entry:
+            entry['lights'] = [str(light_id) for light_id in entry['lights']]
+        if 'group' in entry:
+            entry['group'] = str(entry['group'])
+        return entry
+
+    def _index(self, kind, item_id):
+        entry = self._entries[kind][item_id]
+        if 'name' in entry:
+            # Names are not unique on the bridge, the lowest ID wins.
+            key = entry['name'].casefold()
+            current = self._names[kind].get(key)
+            if current is None or (len(item_id), item_id) < \
+                    (len(current), current):
+                self._names[kind][key] = item_id
+        self._types[kind].setdefault(entry.get('type'), set()).add(item_id)
+        if kind == "group" and entry.get('type') == 'Room':
+            for light_id in entry.get('lights', []):
+                self._rooms[light_id] = item_id
+
+    def _unindex(self, kind, item_id):
+        entry = self._entries[kind][item_id]
+        if 'name' in entry:
+            key = entry['name'].casefold()
+            if self._names[kind].get(key) == item_id:
+                del self._names[kind][key]
+                # Another entry of the same name takes over.
+                for other_id, other in self._entries[kind].items():
+                    if other_id != item_id and \
+                            other.get('name', '').casefold() == key:
+                        self._index(kind, other_id)
+        self._types[kind].get(entry.get('type'), set()).discard(item_id)
+        if kind == "group" and entry.get('type') == 'Room':
+            for light_id in entry.get('lights', []):
+                if self._rooms.get(light_id) == item_id:
+                    del self._rooms[light_id]
@@ -0,0 +1,35 @@
+from phue import Bridge
+
+class TransportBridge(Bridge):
+    """
+    A phue Bridge sending its requests through a Lumen Transport
+    instead of opening a new connection for every call.
+
+    Attributes:
+    - transport (Transport): The transport carrying the requests.
+    - metrics (BridgeMetrics): Records every request, None while
+                               metrics are disabled.
+    """
+    def __init__(self, ip, transport, username=None):
+        """
+        Initializes the TransportBridge.
+
+        Args:
+            ip (str): IP address of the bridge.
+            transport (Transport): The transport carrying the requests.
+            username (str, optional): The whitelisted API username.
+        """
+        # Set before phue's initializer, which may already talk to
+        # the bridge to register the application.
+        self.transport = transport
+        self.metrics = None
+        super().__init__(ip, username)
+
+    def request(self, mode='GET', address=None, data=None):
+        """
+        Sends a request through the transport, replacing phue's own
+        connection handling.
+        """
+        if self.metrics is None:
+            return self.transport.request(mode, address, data)
+        return self.metrics.timed(self.transport.request, mode, address, data)
@@ -0,0 +1,192 @@
+import threading
+
+class ViewModel:
+    """
+    ViewModel collects the lights and groups whose state changed and
+    hands them to the views at most once per frame, so a burst of
+    changes reported by the bridge costs one redraw instead of one per
+    change.
+
+    Changes may be marked from any thread. The Tk thread picks them up
+    every frame_ms, changes marked from the Tk thread itself can be
+    shown at the next idle moment with request_flush.
+
+    Attributes:
+    - frame_ms (int): Milliseconds between two checks for changes.
+    - flushes (int): Number of times the views were called.
+    - marked (int): Number of changes marked, repeats included.
+
+    Methods:
+    - add_view: Registers a callback for changed lights and groups.
+    - mark: Records that a light or group changed.
+    - invalidate: Records that everything changed.
+    - request_flush: Calls the views at the next idle moment.
+    - start: Starts checking for changes every frame.
+    - stop: Stops checking.
+    - flush: Calls the views with everything changed since the last
+             flush.
+    """
+    FRAME_MS = 16
+
+    # Stands for every light and group in a dirty set.
+    EVERYTHING = ("all", None)
+
+    def __init__(self, widget, frame_ms=FRAME_MS):
+        """
+        Initializes the ViewModel.
+
+        Args:
+            widget (tk.Misc): Any widget, used to schedule the flushes
+                              on the Tk thread.
+            frame_ms (int, optional): Milliseconds between two checks
+                                      for changes. Defaults to 16.
+        """
+        self.widget = widget
+        self.frame_ms = frame_ms
+        self.flushes = 0
+        self.marked = 0
+        self._views = []
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._tick_id = None
+        self._idle_id = None
+
+    def add_view(self, callback):
+        """
+        Registers a view.
+
+        Args:
+            callback (callable): Called on the Tk thread as
+                    callback(dirty), with dirty a set of (kind,
+                    target_id) tuples, or holding EVERYTHING.
+        """
+        self._views.append(callback)
+
+    def mark(self, kind, target_id):
+        """
+        Records that a light or group changed. Safe to call from any
+        thread.
+
+        Args:
+            kind (str): "light" or "group".
+            target_id (str): The ID of the light or group.
+        """
+        with self._lock:
+            self._dirty.add((kind, str(target_id)))
+            self.marked += 1
+
+    def invalidate(self):
+        """
+        Records that everything changed, e.g. after the bridge was
+        read again. Safe to call from any thread.
+        """
+        with self._lock:
+            self._dirty.add(self.EVERYTHING)
+            self.marked += 1
+
+    def request_flush(self):
+        """
+        Calls the views at the next idle moment instead of waiting for
+        the next frame. Tk thread only.
+        """
+        if self._idle_id is None:
+            self._idle_id = self.widget.after_idle(self._flush_idle)
+
+    def start(self):
+        """
+        Starts checking for changes every frame_ms.
+        """
+        if self._tick_id is None:
+            self._tick_id = self.widget.after(self.frame_ms, self._tick)
+
+    def stop(self):
+        """
+        Stops checking for changes.
+        """
+        for after_id in (self._tick_id, self._idle_id):
+            if after_id is not None:
+                self.widget.after_cancel(after_id)
+        self._tick_id = self._idle_id = None
+
+    def flush(self):
+        """
+        Calls the views with everything marked since the last flush,
+        and nothing when nothing was.
+
+        Returns:
+            set: The (kind, target_id) tuples handed to the views.
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if dirty:
+            self.flushes += 1
+            for view in self._views:
+                view(dirty)
+        return dirty
+
+    def _flush_idle(self):
+        self._idle_id = None
+        self.flush()
+
+    def _tick(self):
+        self.flush()
+        self._tick_id = self.widget.after(self.frame_ms, self._tick)
+
+
+class CanvasPainter:
+    """
+    CanvasPainter remembers the options last given to every canvas
+    item and only passes on the ones that differ, so redrawing an
+    unchanged item costs no call into Tk.
+
+    Attributes:
+    - canvas (tk.Canvas): The canvas painted on.
+    - calls (int): itemconfig calls made.
+    - skipped (int): itemconfig calls left out, nothing had changed.
+
+    Methods:
+    - configure: Sets the options of an item that changed.
+    - forget: Drops what is known about deleted items.
+    """
+    def __init__(self, canvas):
+        """
+        Args:
+            canvas (tk.Canvas): The canvas painted on.
+        """
+        self.canvas = canvas
+        self.calls = 0
+        self.skipped = 0
+        self._options = {}
+
+    def configure(self, item, **options):
+        """
+        Sets the options of a canvas item that differ from the ones
+        last set.
+
+        Args:
+            item (int): The canvas item ID.
+            **options: Item options, e.g. fill="green".
+        """
+        known = self._options.setdefault(item, {})
+        changed = {name: value for name, value in options.items()
+                   if known.get(name) != value}
+        if not changed:
+            self.skipped += 1
+            return
+        known.update(changed)
+        self.canvas.itemconfig(item, **changed)
+        self.calls += 1
+
+    def forget(self, items=None):
+        """
+        Drops what is known about items deleted from the canvas.
+
+        Args:
+            items (iterable, optional): The deleted item IDs. Defaults
+                                        to every item.
+        """
+        if items is None:
+            self._options.clear()
+            return
+        for item in items:
+            self._options.pop(item, None)